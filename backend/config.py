@@ -1,4 +1,5 @@
 import ast
+import datetime
 import os
 from pathlib import Path
 
@@ -26,6 +27,13 @@ class WebapiConfig(WebapiUpdaterConfig):
         self.backup_item_names = ast.literal_eval(
             os.environ.get("BACKUP_ITEM_NAMES", "{}")
         )
+        self.god_info_ttl = datetime.timedelta(
+            hours=float(os.environ.get("GOD_INFO_TTL_HOURS", "24"))
+        )
+        self.image_dhash_max_distance = int(
+            os.environ.get("IMAGE_DHASH_MAX_DISTANCE", "4")
+        )
+        self.prerender_pages = int(os.environ.get("PRERENDER_PAGES", "0"))
 
 
 class UpdaterConfig(WebapiUpdaterConfig):
@@ -36,6 +44,22 @@ class UpdaterConfig(WebapiUpdaterConfig):
         self.matches_with_no_stats = set(
             os.environ.get("MATCHES_WITH_NO_STATS", "").split(",")
         )
+        self.browser_pool_size = int(os.environ.get("BROWSER_POOL_SIZE", "1"))
+        self.match_page_interval = float(os.environ.get("MATCH_PAGE_INTERVAL", "0"))
+        self.recycle_browser_after = int(os.environ.get("RECYCLE_BROWSER_AFTER", "0"))
+        self.browser_memory_limit = (
+            int(os.environ.get("BROWSER_MEMORY_LIMIT_MB", "0")) * 1024 * 1024
+        )
+        self.daemon_poll_interval = datetime.timedelta(
+            minutes=float(os.environ.get("DAEMON_POLL_INTERVAL_MINUTES", "30"))
+        )
+        self.use_matchstats = bool(os.environ.get("USE_MATCHSTATS"))
+        self.block_resources = bool(os.environ.get("BLOCK_RESOURCES"))
+        self.builds_compression = os.environ.get("BUILDS_COMPRESSION", "")
+        if self.builds_compression not in ["", "gzip", "zstd"]:
+            raise RuntimeError(
+                f"Unknown BUILDS_COMPRESSION (gzip or zstd): {self.builds_compression}"
+            )
 
 
 def get_required_env_var(key: str) -> str:
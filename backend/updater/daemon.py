@@ -0,0 +1,225 @@
+"""
+Runs the updater continuously, instead of from cron. The browser is kept open, and the
+whole schedule is walked only every FULL_WALK_INTERVAL. In between, only the phases
+with match days around today are checked for new results (every
+DAEMON_POLL_INTERVAL_MINUTES), and when no matches are near, it sleeps until they are.
+Its state is written into a small status file (STATUS_FILE), for health checks:
+python -m backend.updater.daemon
+"""
+
+import dataclasses
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+
+from backend.config import get_updater_config, load_updater_config
+from backend.shared import STORAGE_DIR, setup_logging
+from backend.updater.updater import (
+    SCRAPE_STATE_FILE,
+    TIMINGS,
+    TIMINGS_FILE,
+    Browser,
+    Schedule,
+    ScrapeState,
+    update,
+    write_atomically,
+)
+
+logger = logging.getLogger(__name__)
+
+STATUS_FILE = STORAGE_DIR / "updater_status.json"
+# To find new phases, rescheduled matches and the like.
+FULL_WALK_INTERVAL = datetime.timedelta(hours=24)
+# Also when nothing is scheduled, so that the status file shows the daemon is alive.
+IDLE_POLL_INTERVAL = datetime.timedelta(hours=6)
+# The dates on the website are not in UTC.
+DAYS_BEFORE_MATCH = 1
+# The stats are added some hours after the match, sometimes only on the next day.
+DAYS_AFTER_MATCH = 2
+
+
+@dataclasses.dataclass
+class DaemonStatus:
+    pid: int
+    started: str
+    # starting, polling, sleeping or stopped
+    state: str = "starting"
+    updated: str | None = None
+    last_poll: str | None = None
+    last_success: str | None = None
+    last_error: str | None = None
+    error_count: int = 0
+    active_phases: list[str] = dataclasses.field(default_factory=list)
+    next_poll: str | None = None
+
+    def write(self, path: Path) -> None:
+        self.updated = format_time(now())
+        status_bytes = json.dumps(dataclasses.asdict(self), indent=2).encode("utf8")
+        write_atomically(path, status_bytes)
+
+
+def main() -> None:
+    load_updater_config()
+    setup_logging(logging.INFO if len(sys.argv) < 2 else logging.DEBUG)
+
+    poll_interval = get_updater_config().daemon_poll_interval
+    status = DaemonStatus(pid=os.getpid(), started=format_time(now()))
+    status.write(STATUS_FILE)
+    schedule: Schedule = {}
+    last_full_walk: datetime.datetime | None = None
+    browser: Browser | None = None
+    TIMINGS.start_run(TIMINGS_FILE)
+    try:
+        with ScrapeState(SCRAPE_STATE_FILE) as scrape_state:
+            while True:
+                start = now()
+                only_phases = None
+                if (
+                    last_full_walk is not None
+                    and start - last_full_walk < FULL_WALK_INTERVAL
+                ):
+                    only_phases = get_active_phases(schedule, start.date())
+
+                if only_phases is None or only_phases:
+                    logger.info(
+                        f"Polling|{'all' if only_phases is None else len(only_phases)}"
+                    )
+                    status.state = "polling"
+                    status.last_poll = format_time(start)
+                    status.write(STATUS_FILE)
+                    if browser is None:
+                        browser = Browser()
+                    TIMINGS.new_run()
+                    try:
+                        update(browser, scrape_state, schedule, only_phases)
+                    except Exception as e:
+                        logger.exception("Poll failed|")
+                        error = traceback.format_exception_only(e)[-1].strip()
+                        status.last_error = f"{format_time(now())} {error}"
+                        status.error_count += 1
+                        # It could have been the browser which crashed.
+                        close_browser(browser)
+                        browser = None
+                    else:
+                        status.last_success = format_time(start)
+                        status.error_count = 0
+                        if only_phases is None:
+                            last_full_walk = start
+                    finally:
+                        TIMINGS.log_summary()
+
+                next_poll = get_next_poll(
+                    schedule, now(), last_full_walk, poll_interval, status.error_count
+                )
+                status.state = "sleeping"
+                status.active_phases = sorted(
+                    f"{league_name}|{phase}"
+                    for league_name, phase in get_active_phases(schedule, now().date())
+                )
+                status.next_poll = format_time(next_poll)
+                status.write(STATUS_FILE)
+                logger.info(f"Next poll|{status.next_poll}")
+                time.sleep(max((next_poll - now()).total_seconds(), 0))
+
+    except Exception:
+        logger.exception("Crash|")
+        raise
+    finally:
+        if browser is not None:
+            close_browser(browser)
+        status.state = "stopped"
+        status.write(STATUS_FILE)
+        TIMINGS.close()
+
+
+def get_next_poll(
+    schedule: Schedule,
+    current_time: datetime.datetime,
+    last_full_walk: datetime.datetime | None,
+    poll_interval: datetime.timedelta,
+    error_count: int,
+) -> datetime.datetime:
+    if error_count or last_full_walk is None:
+        # Backs off, e.g. while the website or the backend is down.
+        backoff = poll_interval * 2 ** max(error_count - 1, 0)
+        return current_time + min(backoff, IDLE_POLL_INTERVAL)
+
+    next_polls = [last_full_walk + FULL_WALK_INTERVAL]
+    if get_active_phases(schedule, current_time.date()):
+        next_polls.append(current_time + poll_interval)
+    else:
+        next_polls.append(current_time + IDLE_POLL_INTERVAL)
+        if (
+            next_active := get_next_active_start(schedule, current_time.date())
+        ) is not None:
+            next_polls.append(next_active)
+    return max(min(next_polls), current_time)
+
+
+def get_active_phases(schedule: Schedule, today: datetime.date) -> set[tuple[str, str]]:
+    """The phases, which have matches (or will soon have stats) around today."""
+    first_active = today - datetime.timedelta(days=DAYS_AFTER_MATCH)
+    last_active = today + datetime.timedelta(days=DAYS_BEFORE_MATCH)
+    return {
+        key
+        for key, schedule_phase in schedule.items()
+        if any(
+            first_active <= get_schedule_date(month, day, today) <= last_active
+            for month, day in schedule_phase.days
+        )
+    }
+
+
+def get_next_active_start(
+    schedule: Schedule, today: datetime.date
+) -> datetime.datetime | None:
+    """When the first of the future matches becomes active, None if there are none."""
+    last_active = today + datetime.timedelta(days=DAYS_BEFORE_MATCH)
+    future_dates = [
+        date
+        for schedule_phase in schedule.values()
+        for month, day in schedule_phase.days
+        if (date := get_schedule_date(month, day, today)) > last_active
+    ]
+    if not future_dates:
+        return None
+    first_active = min(future_dates) - datetime.timedelta(days=DAYS_BEFORE_MATCH)
+    return datetime.datetime.combine(
+        first_active, datetime.time(), tzinfo=datetime.timezone.utc
+    )
+
+
+def get_schedule_date(month: int, day: int, today: datetime.date) -> datetime.date:
+    """The schedule has no years, so it's the date closest to today."""
+    dates: list[datetime.date] = []
+    for year in [today.year - 1, today.year, today.year + 1]:
+        try:
+            dates.append(datetime.date(year, month, day))
+        except ValueError:
+            # February 29th.
+            pass
+    return min(dates, key=lambda date: abs(date - today))
+
+
+def close_browser(browser: Browser) -> None:
+    try:
+        browser.close()
+    except Exception:
+        logger.exception("Failed to close browser|")
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def format_time(time_: datetime.datetime) -> str:
+    return time_.isoformat(timespec="seconds")
+
+
+if __name__ == "__main__":
+    main()
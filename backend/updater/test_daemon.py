@@ -0,0 +1,91 @@
+import datetime
+import json
+from pathlib import Path
+
+from backend.shared import SPL
+from backend.updater.daemon import (
+    IDLE_POLL_INTERVAL,
+    DaemonStatus,
+    get_active_phases,
+    get_next_poll,
+    get_schedule_date,
+)
+from backend.updater.updater import Schedule, SchedulePhase
+
+POLL_INTERVAL = datetime.timedelta(minutes=30)
+
+
+def make_schedule() -> Schedule:
+    return {
+        (SPL.name, "Phase 1"): SchedulePhase(SPL, "Phase 1", [(12, 20), (12, 21)], []),
+        (SPL.name, "Phase 2"): SchedulePhase(SPL, "Phase 2", [(1, 10), (1, 11)], []),
+    }
+
+
+def test_get_schedule_date() -> None:
+    today = datetime.date(2023, 12, 30)
+    assert get_schedule_date(12, 20, today) == datetime.date(2023, 12, 20)
+    assert get_schedule_date(1, 10, today) == datetime.date(2024, 1, 10)
+    assert get_schedule_date(2, 29, today) == datetime.date(2024, 2, 29)
+
+
+def test_get_active_phases() -> None:
+    schedule = make_schedule()
+    assert get_active_phases(schedule, datetime.date(2023, 12, 19)) == {
+        (SPL.name, "Phase 1")
+    }
+    assert get_active_phases(schedule, datetime.date(2023, 12, 23)) == {
+        (SPL.name, "Phase 1")
+    }
+    assert not get_active_phases(schedule, datetime.date(2023, 12, 24))
+    assert get_active_phases(schedule, datetime.date(2024, 1, 12)) == {
+        (SPL.name, "Phase 2")
+    }
+
+
+def test_get_next_poll() -> None:
+    schedule = make_schedule()
+    utc = datetime.timezone.utc
+    last_full_walk = datetime.datetime(2023, 12, 21, 1, tzinfo=utc)
+
+    now = datetime.datetime(2023, 12, 21, 12, tzinfo=utc)
+    assert get_next_poll(schedule, now, last_full_walk, POLL_INTERVAL, 0) == (
+        now + POLL_INTERVAL
+    )
+    # Nothing scheduled, until the full walk.
+    now = datetime.datetime(2023, 12, 24, 12, tzinfo=utc)
+    last_full_walk = datetime.datetime(2023, 12, 24, 1, tzinfo=utc)
+    assert get_next_poll(schedule, now, last_full_walk, POLL_INTERVAL, 0) == (
+        now + IDLE_POLL_INTERVAL
+    )
+    now = datetime.datetime(2023, 12, 25, 0, 30, tzinfo=utc)
+    assert get_next_poll(schedule, now, last_full_walk, POLL_INTERVAL, 0) == (
+        last_full_walk + datetime.timedelta(hours=24)
+    )
+    # The day before the next match.
+    now = datetime.datetime(2024, 1, 8, 22, tzinfo=utc)
+    last_full_walk = datetime.datetime(2024, 1, 8, 12, tzinfo=utc)
+    assert get_next_poll(schedule, now, last_full_walk, POLL_INTERVAL, 0) == (
+        datetime.datetime(2024, 1, 9, tzinfo=utc)
+    )
+
+    # Backs off after errors.
+    assert get_next_poll(schedule, now, None, POLL_INTERVAL, 1) == now + POLL_INTERVAL
+    assert get_next_poll(schedule, now, None, POLL_INTERVAL, 3) == (
+        now + 4 * POLL_INTERVAL
+    )
+    assert get_next_poll(schedule, now, None, POLL_INTERVAL, 10) == (
+        now + IDLE_POLL_INTERVAL
+    )
+
+
+def test_daemon_status(tmp_path: Path) -> None:
+    status = DaemonStatus(pid=123, started="2023-12-21T12:00:00+00:00")
+    status.active_phases = ["SPL|Phase 1"]
+    status.write(tmp_path / "status.json")
+    status_dict = json.loads((tmp_path / "status.json").read_text(encoding="utf8"))
+    assert status_dict["pid"] == 123
+    assert status_dict["state"] == "starting"
+    assert status_dict["active_phases"] == ["SPL|Phase 1"]
+    assert status_dict["updated"] is not None
+    assert not list(tmp_path.glob("*~"))
@@ -0,0 +1,58 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from backend.updater.timings import Timings, percentile
+
+
+def test_percentile() -> None:
+    assert percentile([3.0], 95) == 3.0
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 95) == 95.0
+    assert percentile(list(reversed(values)), 50) == 50.0
+    assert percentile([1.0, 2.0], 95) == 2.0
+
+
+def test_timings(tmp_path: Path) -> None:
+    timings = Timings()
+    timings.start_run(tmp_path / "timings.jsonl")
+    for match_id in [1, 2, 3]:
+        with timings.span("match", match_id=match_id):
+            pass
+    with pytest.raises(RuntimeError):
+        with timings.span("post_builds", build_count=10):
+            raise RuntimeError("Backend is down")
+    # The durations are not measured, so that the test is not timing dependent.
+    for span, duration in zip(timings.spans, [2.0, 7.0, 3.0]):
+        span["duration"] = duration
+
+    summary = timings.summarize()
+    assert summary["stages"]["match"] == {
+        "count": 3,
+        "total": 12.0,
+        "mean": 4.0,
+        "p95": 7.0,
+    }
+    assert summary["stages"]["post_builds"]["count"] == 1
+    assert summary["slowest_matches"] == [
+        {"match_id": 2, "duration": 7.0},
+        {"match_id": 3, "duration": 3.0},
+        {"match_id": 1, "duration": 2.0},
+    ]
+
+    timings.log_summary()
+    timings.close()
+    lines = (tmp_path / "timings.jsonl").read_text(encoding="utf8").splitlines()
+    spans = [json.loads(line) for line in lines]
+    assert [span["stage"] for span in spans] == [
+        "match",
+        "match",
+        "match",
+        "post_builds",
+        "summary",
+    ]
+    assert {span["run"] for span in spans} == {timings.run}
+    assert spans[3]["error"] == "RuntimeError"
+    assert spans[3]["build_count"] == 10
+    assert spans[4]["slowest_matches"] == summary["slowest_matches"]
@@ -0,0 +1,685 @@
+import datetime
+import html
+import http.server
+import io
+import json
+import threading
+import time
+import typing as t
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+import zstandard
+
+from backend.shared import IMG_URL, SPL
+from backend.updater import updater
+from backend.updater.tools import add_builds_from_log
+from backend.updater.tools.add_builds_from_log import read_games
+from backend.updater.tools.replay_archive import parse_game_data, replay_match
+from backend.updater.updater import (
+    FIRST_EVENT_ID,
+    NO_STATS_RETRY_INTERVAL,
+    WRONG_EVENT_ERROR,
+    AdaptiveTimeout,
+    Browser,
+    BuildsPoster,
+    Match,
+    MatchstatsClient,
+    RateLimiter,
+    ScrapeState,
+    convert_game_data,
+    make_webdriver_options,
+    scrape_matches_in_pool,
+)
+
+EVENT_ID = FIRST_EVENT_ID + 5
+MATCH_ID = 1234
+ITEMS = [
+    {
+        "DeviceName": "Bancroft's Talon",
+        "itemIcon_URL": f"{IMG_URL}/bancrofts-talon.jpg",
+    },
+    {"DeviceName": "Blink Rune", "itemIcon_URL": f"{IMG_URL}/blink-rune.jpg"},
+]
+
+
+def make_player(team: str, role: str, name: str, build: list[str]) -> dict:
+    return {
+        "name": name,
+        "team": team,
+        "god": f"God of {name}",
+        "role": role,
+        "kills": 2,
+        "deaths": 0,
+        "assists": 3,
+        "relics": ["Blink Rune", "null"],
+        "build": build,
+    }
+
+
+MATCH_STATS = {
+    "games": [
+        {
+            "game_duration": "31:05",
+            "winning_team": 1,
+            "team_totals": [{"team": "Team A"}, {"team": "Team B"}],
+            "players": [
+                make_player("Team A", "Carry", "A1", ["Bancroft's Talon"]),
+                make_player("Team B", "Hunter", "B1", ["Jotunn's Ferocity"]),
+                make_player("Team A", "Mid", "A2", []),
+                make_player("Team B", "Mid", "B2", []),
+                make_player("Team B", "Mid", "B3", []),
+            ],
+        }
+    ]
+}
+
+KNOWN_MATCHES = {"max_build_id": 5, "matches": {"Phase 1": [1, 2], "Phase 2": [3]}}
+NEW_KNOWN_MATCHES = {"max_build_id": 7, "matches": {"Phase 3": [4]}}
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    requests: list[str] = []
+
+    def do_GET(self) -> None:
+        self.requests.append(self.path)
+        result: t.Any
+        if self.path == "/items":
+            result = ITEMS
+        elif self.path == f"/matchstats/{EVENT_ID}/{MATCH_ID}":
+            result = MATCH_STATS
+        elif self.path == "/api/known_matches?after_build_id=5":
+            result = NEW_KNOWN_MATCHES
+        elif self.path == "/api/known_matches":
+            result = KNOWN_MATCHES
+        else:
+            result = {"error": WRONG_EVENT_ERROR}
+        body = json.dumps(result).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: t.Any) -> None:
+        pass
+
+
+@pytest.fixture
+def base_url() -> t.Iterator[str]:
+    StandInHandler.requests = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, args=[0.01], daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(base_url: str, tmp_path: Path) -> MatchstatsClient:
+    return MatchstatsClient(
+        matchstats_url=f"{base_url}/matchstats",
+        items_url=f"{base_url}/items",
+        event_ids_file=tmp_path / "event_ids.json",
+        request_delay=0,
+    )
+
+
+def make_match(match_id: int = MATCH_ID) -> Match:
+    url = f"{SPL.match_url}/{match_id}"
+    return Match(SPL, "Phase 1", 3, 4, match_id, url, len(SPL.match_url))
+
+
+def test_get_builds(base_url: str, tmp_path: Path) -> None:
+    builds = make_client(base_url, tmp_path).get_builds(make_match())
+    assert [build["player1"] for build in builds] == ["A1", "A2", "B1", "B2", "B3"]
+    a1, a2, b1, b2, b3 = builds
+    assert a1 == {
+        "league": "SPL",
+        "phase": "Phase 1",
+        "month": 3,
+        "day": 4,
+        "game_i": 1,
+        "match_id": MATCH_ID,
+        "win": False,
+        "hours": 0,
+        "minutes": 31,
+        "seconds": 5,
+        "kda_ratio": 5.0,
+        "kills": 2,
+        "deaths": 0,
+        "assists": 3,
+        "role": "ADC",
+        "team1": "Team A",
+        "team2": "Team B",
+        "relics": [("Blink Rune", "blink-rune.jpg")],
+        "items": [("Bancroft's Talon", "bancrofts-talon.jpg")],
+        "player1": "A1",
+        "god1": "God of A1",
+        "player2": "B1",
+        "god2": "God of B1",
+    }
+    assert b1["win"] and b1["team1"] == "Team B" and b1["player2"] == "A1"
+    assert b1["items"] == [("Jotunn's Ferocity", "jotunns-ferocity.jpg")]
+    # Team B has two mids, so the mid of team A has no opponent.
+    assert a2["player2"] == "Missing data"
+    assert b2["player2"] == b3["player2"] == "A2"
+
+
+def test_event_id_is_remembered(base_url: str, tmp_path: Path) -> None:
+    make_client(base_url, tmp_path).get_builds(make_match())
+    # Every event ID is tried, until the right one.
+    assert len(StandInHandler.requests) == EVENT_ID - FIRST_EVENT_ID + 2
+    event_ids = json.loads((tmp_path / "event_ids.json").read_text(encoding="utf8"))
+    assert event_ids == {"SPL|Phase 1": EVENT_ID}
+
+    StandInHandler.requests = []
+    make_client(base_url, tmp_path).get_builds(make_match())
+    assert StandInHandler.requests == [f"/matchstats/{EVENT_ID}/{MATCH_ID}", "/items"]
+
+
+def test_unknown_event(base_url: str, tmp_path: Path) -> None:
+    client = make_client(base_url, tmp_path)
+    with pytest.raises(RuntimeError, match="Unknown matchstats event"):
+        client.get_builds(make_match(MATCH_ID + 1))
+    # Not searched for again.
+    StandInHandler.requests = []
+    with pytest.raises(RuntimeError, match="Unknown matchstats event"):
+        client.get_builds(make_match(MATCH_ID + 1))
+    assert StandInHandler.requests == []
+
+
+def test_scrape_state_known_matches(base_url: str, tmp_path: Path) -> None:
+    with ScrapeState(tmp_path / "state.db") as scrape_state:
+        scrape_state.sync_known_matches(base_url)
+        assert scrape_state.is_known("Phase 1", 2)
+        assert not scrape_state.is_known("Phase 2", 2)
+        scrape_state.add_scraped_matches([("Phase 2", 2)])
+
+    with ScrapeState(tmp_path / "state.db") as scrape_state:
+        # Only the new matches are added, the local ones are kept.
+        scrape_state.sync_known_matches(base_url)
+        assert StandInHandler.requests[-1] == "/api/known_matches?after_build_id=5"
+        assert scrape_state.is_known("Phase 1", 1)
+        assert scrape_state.is_known("Phase 2", 2)
+        assert scrape_state.is_known("Phase 3", 4)
+        assert scrape_state.get_metadata("known_max_build_id") == "7"
+
+
+def test_scrape_state_no_stats(tmp_path: Path) -> None:
+    no_stats_match = make_match()
+    no_stats_match.has_no_stats = True
+    with ScrapeState(tmp_path / "state.db") as scrape_state:
+        scrape_state.add_no_stats_matches([no_stats_match, make_match(5)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        assert scrape_state.is_recent_no_stats(MATCH_ID, now)
+        assert not scrape_state.is_recent_no_stats(5, now)
+        later = now + NO_STATS_RETRY_INTERVAL
+        assert not scrape_state.is_recent_no_stats(MATCH_ID, later)
+
+        # The stats were added since.
+        scrape_state.add_no_stats_matches([make_match()])
+        assert not scrape_state.is_recent_no_stats(MATCH_ID, now)
+
+
+def test_scrape_state_schedule(tmp_path: Path) -> None:
+    with ScrapeState(tmp_path / "state.db") as scrape_state:
+        phase_matches = [[3, 4, f"{SPL.match_url}/{MATCH_ID}"]]
+        scrape_state.set_schedule_phase(SPL, "Phase 1", "abc", phase_matches)
+        assert scrape_state.get_schedule_phase(SPL, "Phase 1", "abc") == phase_matches
+        assert scrape_state.get_schedule_phase(SPL, "Phase 1", "def") is None
+        assert scrape_state.get_schedule_phase(SPL, "Phase 2", "abc") is None
+
+
+def test_scrape_matches_in_pool() -> None:
+    matches = [make_match(match_id) for match_id in range(20)]
+    drivers = set()
+
+    def scrape(
+        driver: t.Any, matchstats: t.Any, rate_limiter: t.Any, match: Match
+    ) -> list[dict]:
+        drivers.add(driver)
+        time.sleep(0.001 * (match.id % 3))
+        if match.id == 5:
+            raise RuntimeError("Crash")
+        return [{"match_id": match.id, "game_i": game_i} for game_i in [1, 2]]
+
+    new_drivers = [MagicMock(), MagicMock()]
+    match_builds: list[list[dict]] = []
+    with (
+        patch("backend.updater.updater.start_webdriver", side_effect=new_drivers),
+        patch("backend.updater.updater.scrape_match_with_fallback", scrape),
+        patch("backend.updater.updater.get_updater_config", make_config),
+        patch("backend.updater.updater.get_browser_memory", return_value=0),
+    ):
+        scrape_matches_in_pool(
+            MagicMock(driver="driver"),
+            matches,
+            3,
+            None,
+            RateLimiter(0),
+            match_builds.append,
+        )
+
+    # The failed match is skipped, the builds of a match stay together.
+    assert sorted(match_builds, key=lambda builds: builds[0]["match_id"]) == [
+        [{"match_id": match_id, "game_i": game_i} for game_i in [1, 2]]
+        for match_id in range(20)
+        if match_id != 5
+    ]
+    assert drivers == {"driver", *new_drivers}
+    for new_driver in new_drivers:
+        new_driver.quit.assert_called_once()
+
+
+def make_config(**kwargs: t.Any) -> SimpleNamespace:
+    return SimpleNamespace(
+        **{"recycle_browser_after": 0, "browser_memory_limit": 0, **kwargs}
+    )
+
+
+def test_browser_recycling() -> None:
+    drivers = [MagicMock(), MagicMock(), MagicMock()]
+    session_cookie = {"name": "a", "value": "1", "session": True, "expires": -1}
+    cookie = {"name": "b", "value": "2", "session": False, "expires": 5, "size": 2}
+    drivers[0].execute_cdp_cmd.return_value = {"cookies": [session_cookie, cookie]}
+    config = make_config(recycle_browser_after=3, browser_memory_limit=100)
+    with (
+        patch("backend.updater.updater.start_webdriver", side_effect=drivers),
+        patch("backend.updater.updater.get_updater_config", lambda: config),
+        patch(
+            "backend.updater.updater.get_browser_memory",
+            side_effect=[10, 500, 20, 30, 40, 50],
+        ),
+    ):
+        with Browser() as browser:
+            browser.after_match()
+            assert browser.driver is drivers[0]
+            # Too much memory.
+            browser.after_match()
+            assert browser.driver is drivers[1]
+            drivers[0].quit.assert_called_once()
+            cookies = [
+                {"name": "a", "value": "1"},
+                {"name": "b", "value": "2", "expires": 5},
+            ]
+            drivers[1].execute_cdp_cmd.assert_called_once_with(
+                "Network.setCookies", {"cookies": cookies}
+            )
+            # Too many matches.
+            for _ in range(3):
+                browser.after_match()
+            assert browser.driver is drivers[2]
+
+    drivers[2].quit.assert_called_once()
+    assert browser.peak_memory == 500
+
+
+def test_make_webdriver_options(tmp_path: Path) -> None:
+    options = make_webdriver_options(tmp_path, block_resources=True)
+    assert f"--disk-cache-dir={tmp_path}" in options.arguments
+    prefs = options.experimental_options["prefs"]
+    assert prefs["profile.managed_default_content_settings.images"] == 2
+
+    options = make_webdriver_options()
+    assert not any("disk-cache" in argument for argument in options.arguments)
+    assert options.experimental_options["prefs"] == {
+        "intl.accept_languages": "en,en_US"
+    }
+
+
+def test_rate_limiter() -> None:
+    rate_limiter = RateLimiter(0.02)
+    start = time.monotonic()
+    times = []
+
+    def wait() -> None:
+        rate_limiter.wait()
+        times.append(time.monotonic())
+
+    threads = [threading.Thread(target=wait) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(times) - start >= 4 * 0.02
+
+
+def test_adaptive_timeout() -> None:
+    driver = MagicMock()
+    timeout = AdaptiveTimeout(min_timeout=0.2, max_timeout=5)
+    assert timeout.get() == 5
+    assert timeout.wait_until(driver, lambda driver: "ready") == "ready"
+    # Fast waits shorten the timeout down to the minimum.
+    assert timeout.get() == 0.2
+
+    start = time.monotonic()
+    assert timeout.wait_until(driver, lambda driver: None) is None
+    assert 0.2 <= time.monotonic() - start < 1
+    # The implicit wait is restored.
+    driver.implicitly_wait.assert_called_with(3)
+
+
+def make_stats_row(player: str, role: str, relics: list[str]) -> list[dict]:
+    texts = [player, role, f"God of {player}", " 3 ", "1", "2", "400"]
+    images = [[name, f"{IMG_URL}/{name.lower()}.jpg"] for name in relics]
+    return [
+        *({"text": text, "images": []} for text in texts),
+        {"text": "", "images": images},
+        {"text": "", "images": [["Item", f"{IMG_URL}/item.jpg"]]},
+    ]
+
+
+def test_convert_game_data() -> None:
+    totals = [{"text": "", "images": []}] * 9
+    game_data = {
+        "teams": ["Team A", "Team B"],
+        "game_duration": "1:02:03",
+        "team_score": "L",
+        "tables": [
+            make_stats_row("A1", "Carry", ["Blink"]) + totals,
+            make_stats_row("B1", "ADC", []) + make_stats_row("B2", "Mid", []) + totals,
+        ],
+    }
+    a1, b1, b2 = convert_game_data(game_data, make_match(), 2)
+    assert a1 | {"relics": None} == {
+        **b1,
+        "win": False,
+        "team1": "Team A",
+        "team2": "Team B",
+        "player1": "A1",
+        "god1": "God of A1",
+        "player2": "B1",
+        "god2": "God of B1",
+        "relics": None,
+    }
+    assert a1["relics"] == [("Blink", "blink.jpg")]
+    assert (b1["win"], b1["game_i"], b1["role"], b1["kills"]) == (True, 2, "ADC", 3)
+    assert (b1["hours"], b1["minutes"], b1["seconds"]) == (1, 2, 3)
+    assert b1["items"] == [("Item", "item.jpg")]
+    assert b2["player2"] == "Missing data"
+
+    with pytest.raises(RuntimeError, match="Wrong number of player stats"):
+        convert_game_data({**game_data, "tables": [[], []]}, make_match(), 1)
+
+
+def test_converters_pair_opponents_alike() -> None:
+    # Team B has two mids, so the mid of team A has no opponent.
+    players = [
+        ("Team A", "Carry", "A1"),
+        ("Team A", "Mid", "A2"),
+        ("Team B", "Hunter", "B1"),
+        ("Team B", "Mid", "B2"),
+        ("Team B", "Mid", "B3"),
+    ]
+    totals = [{"text": "", "images": []}] * 9
+    game_data = {
+        "teams": ["Team A", "Team B"],
+        "game_duration": "31:05",
+        "team_score": "L",
+        "tables": [
+            [
+                cell
+                for team_, role, name in players
+                if team_ == team
+                for cell in make_stats_row(name, role, [])
+            ]
+            + totals
+            for team in ["Team A", "Team B"]
+        ],
+    }
+    game = {
+        "game_duration": "31:05",
+        "winning_team": 1,
+        "team_totals": [{"team": "Team A"}, {"team": "Team B"}],
+        "players": [make_player(team, role, name, []) for team, role, name in players],
+    }
+    scraped = convert_game_data(game_data, make_match(), 1)
+    item_image_names = {"Blink Rune": "blink-rune.jpg"}
+    from_api = updater.convert_match_stats(
+        [game], "SPL", "Phase 1", 3, 4, 1, item_image_names
+    )
+    for builds in [scraped, from_api]:
+        assert [
+            (build["player1"], build["role"], build["player2"], build["god2"])
+            for build in builds
+        ] == [
+            ("A1", "ADC", "B1", "God of B1"),
+            ("A2", "Mid", "Missing data", "Missing data"),
+            ("B1", "ADC", "A1", "God of A1"),
+            ("B2", "Mid", "A2", "God of A2"),
+            ("B3", "Mid", "A2", "God of A2"),
+        ]
+
+
+def test_builds_poster(tmp_path: Path) -> None:
+    posted: list[list[dict]] = []
+
+    def queue_builds(builds: list[dict]) -> int:
+        if builds[0]["match_id"] == 3:
+            raise RuntimeError("Backend is down")
+        posted.append(builds)
+        return len(posted)
+
+    def match_builds(match_id: int) -> list[dict]:
+        return [{"phase": "Phase 1", "match_id": match_id}] * 2
+
+    with patch("backend.updater.updater.queue_builds", queue_builds):
+        with BuildsPoster(tmp_path, batch_size=3) as builds_poster:
+            for match_id in range(1, 6):
+                builds_poster.add(match_builds(match_id))
+        # The builds of a match are never split.
+        assert posted == [match_builds(1) + match_builds(2), match_builds(5)]
+        assert builds_poster.job_ids == [1, 2]
+        assert builds_poster.build_count == 10
+        assert builds_poster.scraped_matches == {("Phase 1", i) for i in range(1, 6)}
+
+        spooled_paths = list(tmp_path.glob("*.json"))
+        assert len(spooled_paths) == 1
+        spooled = json.loads(spooled_paths[0].read_text(encoding="utf8"))
+        assert spooled == match_builds(3) + match_builds(4)
+        # Still down.
+        builds_poster.post_spooled()
+        assert spooled_paths[0].exists()
+
+        spooled_paths[0].write_text(json.dumps(match_builds(6)), encoding="utf8")
+        builds_poster.post_spooled()
+        assert posted[-1] == match_builds(6)
+        assert not spooled_paths[0].exists()
+
+
+def make_http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code}", response=response)
+
+
+def test_builds_poster_rejected(tmp_path: Path) -> None:
+    def queue_builds(builds: list[dict]) -> int:
+        if builds[0]["match_id"] == 1:
+            raise make_http_error(400)
+        if builds[0]["match_id"] == 2:
+            raise make_http_error(503)
+        return builds[0]["match_id"]
+
+    def wait_for_job(job_id: int) -> None:
+        if job_id == 4:
+            raise RuntimeError(f"Job {job_id} failed: Invalid build")
+
+    builds = {match_id: [{"match_id": match_id}] for match_id in range(1, 5)}
+    for match_id in [1, 2, 3]:
+        (tmp_path / f"{match_id}.json").write_text(json.dumps(builds[match_id]))
+    with (
+        patch("backend.updater.updater.queue_builds", queue_builds),
+        patch("backend.updater.updater.wait_for_job", wait_for_job),
+    ):
+        builds_poster = BuildsPoster(tmp_path)
+        # The rejected batch doesn't block the ones after it.
+        builds_poster.post_spooled()
+        assert (tmp_path / "rejected" / "1.json").exists()
+        assert (tmp_path / "2.json").exists()
+        assert (tmp_path / "3.json").exists()
+        (tmp_path / "2.json").unlink()
+        builds_poster.post_spooled()
+        assert builds_poster.job_ids == [3]
+        assert not (tmp_path / "3.json").exists()
+
+        builds_poster.queue(builds[4])
+        with pytest.raises(RuntimeError, match=r"Jobs failed.*\[4\]"):
+            builds_poster.wait_for_jobs()
+        rejected = (tmp_path / "rejected" / "job_4.json").read_text(encoding="utf8")
+        assert json.loads(rejected) == builds[4]
+        assert not builds_poster.job_builds
+
+
+def test_wait_for_job_timeout() -> None:
+    clock = [0.0]
+    jobs = iter(
+        [{"status": "queued", "progress": None}]
+        + [{"status": "running", "progress": "1/2"}] * 2
+        + [{"status": "running", "progress": "2/2"}] * 1000
+    )
+
+    def sleep(seconds: float) -> None:
+        clock[0] += seconds
+
+    def get(url: str) -> MagicMock:
+        return MagicMock(ok=True, json=lambda: next(jobs))
+
+    with (
+        patch("backend.updater.updater.time.sleep", sleep),
+        patch("backend.updater.updater.time.monotonic", lambda: clock[0]),
+        patch("backend.updater.updater.get_backend_session") as get_backend_session,
+        patch("backend.updater.updater.get_updater_config"),
+    ):
+        get_backend_session.return_value.get = get
+        with pytest.raises(RuntimeError, match="Job 3 timed out, running"):
+            updater.wait_for_job(3)
+    # The timeout starts again with every progress.
+    last_progress = 4 * updater.JOB_POLL_INTERVAL
+    assert clock[0] == pytest.approx(
+        last_progress + updater.JOB_TIMEOUT, abs=updater.JOB_POLL_INTERVAL
+    )
+
+
+def render_page(game_data: dict) -> str:
+    """The parts of a match page which are read by GET_GAME_DATA_JS."""
+
+    def render_cell(cell: dict) -> str:
+        # Protocol-relative, the URLs are resolved like in the browser.
+        images = "".join(
+            f'<img alt="{alt}" src="{src.removeprefix("https:")}">'
+            for alt, src in cell["images"]
+        )
+        return f'<div class="item stat">{html.escape(cell["text"])}{images}</div>'
+
+    tables = "".join(
+        f'<div class="c-PlayerStatsTable">{"".join(map(render_cell, table))}</div>'
+        for table in game_data["tables"]
+    )
+    teams = " vs ".join(f"<strong>{team}</strong>" for team in game_data["teams"])
+    return f"""<html><body>
+<div class="content-wrapper"><strong>Menu</strong></div>
+<div class="content-wrapper">{teams}
+<span class="game-duration">{game_data["game_duration"]}</span>
+<div class="team-score"> {game_data["team_score"]} </div></div>
+{tables}
+</body></html>"""
+
+
+def test_replay_archive(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(updater, "PAGE_ARCHIVE_DIR", tmp_path)
+    totals = [{"text": "", "images": []}] * 9
+    game_datas = [
+        {
+            "teams": ["Team A", "Team B"],
+            "game_duration": f"{game_i}:02:03",
+            "team_score": "W",
+            "tables": [
+                make_stats_row(f"A{game_i}", "Carry", ["Blink"]) + totals,
+                make_stats_row(f"B{game_i}", "ADC", ["Aegis", "Beads"]) + totals,
+            ],
+        }
+        for game_i in [1, 2]
+    ]
+    match = make_match()
+    updater.archive_match_pages(match, [render_page(data) for data in game_datas])
+    # The same page is stored only once.
+    updater.archive_match_pages(make_match(5), [render_page(game_datas[0])])
+    assert len(list(tmp_path.glob("pages/*/*.html.zst"))) == 2
+
+    match_path = updater.get_archived_match_path("SPL", MATCH_ID)
+    pages = json.loads(match_path.read_text(encoding="utf8"))["pages"]
+    page = zstandard.ZstdDecompressor().decompress(
+        updater.get_archived_page_path(pages[1]).read_bytes()
+    )
+    assert parse_game_data(page.decode("utf8"), match.url) == game_datas[1]
+    assert replay_match(match_path) == [
+        build
+        for game_i, game_data in enumerate(game_datas, 1)
+        for build in updater.convert_game_data(game_data, match, game_i)
+    ]
+
+
+def test_read_games_interleaved() -> None:
+    def log_line(match_id: int, game_i: int, player: int) -> str:
+        build = {"match_id": match_id, "game_i": game_i, "player": player}
+        return f"2023-05-06 07:08:09|INFO|updater|Build scraped|{json.dumps(build)}\n"
+
+    # Two browsers logging the games of two matches at once.
+    lines = ["2023-05-06 07:08:09|INFO|updater|Scraping|{}\n"]
+    for player in range(10):
+        lines.append(log_line(1, 1, player))
+        lines.append(log_line(2, 1, player))
+    for player in range(10):
+        lines.append(log_line(1, 2, player))
+    log = "".join(lines).encode("utf8")
+
+    with patch("backend.updater.tools.add_builds_from_log.GAME_WINDOW", 5):
+        games = list(read_games(io.BytesIO(log), 0))
+        assert [
+            [(build["match_id"], build["game_i"]) for build in game_builds]
+            for _, game_builds in games
+        ] == [[(1, 1)] * 10, [(2, 1)] * 10, [(1, 2)] * 10]
+        assert [build["player"] for build in games[0][1]] == list(range(10))
+
+        # Continuing from the offset of the first game skips it, but not the others.
+        offset = games[0][0]
+        assert log[offset:].startswith(log_line(2, 1, 0).encode("utf8"))
+        continued = list(read_games(io.BytesIO(log), offset))
+        assert [game_builds for _, game_builds in continued][-2:] == [
+            games[1][1],
+            games[2][1],
+        ]
+        assert continued[-1][0] == len(log)
+
+
+def test_add_builds_from_log(tmp_path: Path) -> None:
+    log_path = tmp_path / "updater.log"
+    log_path.write_text(
+        "".join(
+            f"2023-05-06 07:08:09|INFO|updater|Build scraped|"
+            f'{json.dumps({"match_id": match_id, "game_i": 1})}\n'
+            for match_id in [1, 1, 2, 2, 3]
+        ),
+        encoding="utf8",
+    )
+    posts: list[tuple[list[int], str | None]] = []
+
+    def post_builds(
+        builds: list[dict], last_checked_tooltip: str | None = None
+    ) -> None:
+        posts.append(([build["match_id"] for build in builds], last_checked_tooltip))
+
+    module = "backend.updater.tools.add_builds_from_log"
+    with (
+        patch(f"{module}.post_builds", post_builds),
+        patch(f"{module}.load_updater_config"),
+        patch("sys.argv", ["add_builds_from_log", str(log_path), "-c", "3"]),
+    ):
+        add_builds_from_log.main()
+    # The last check is updated only once everything is posted.
+    assert posts == [([1, 1, 2, 2], None), ([3], None), ([], "FROM LOG")]
+    assert not log_path.with_name("updater.log.checkpoint").exists()
@@ -0,0 +1,115 @@
+"""
+Timing spans of the stages of the updater (loading the schedules, clicking the phases,
+loading the match pages, reading the games, posting...), so that it's known where the
+time goes, and regressions can be tracked over time. Every span is appended as a JSON
+line to a file (tagged with the run) as soon as it ends. At the end of the run, they are
+summarized into the log: total, mean and p95 per stage, and the slowest matches.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import math
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SLOWEST_MATCH_COUNT = 5
+
+
+class Timings:
+    def __init__(self) -> None:
+        self.run = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.spans: list[dict[str, t.Any]] = []
+        self.lock = threading.Lock()
+        self.file: t.TextIO | None = None
+
+    def start_run(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Line buffered, so that the spans are there even after a crash.
+        self.file = open(path, "a", encoding="utf8", buffering=1)
+
+    def new_run(self) -> None:
+        """The daemon summarizes every poll separately."""
+        with self.lock:
+            self.run = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            self.spans = []
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **attrs: t.Any) -> t.Iterator[None]:
+        """Can be used from any thread. Failed spans are recorded with the error."""
+        start = time.time()
+        start_perf = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            span = {
+                "run": self.run,
+                "stage": stage,
+                "start": start,
+                "duration": time.perf_counter() - start_perf,
+                **attrs,
+            }
+            if error is not None:
+                span["error"] = error
+            self.add(span)
+
+    def add(self, span: dict[str, t.Any]) -> None:
+        with self.lock:
+            self.spans.append(span)
+            if self.file is not None:
+                self.file.write(f"{json.dumps(span)}\n")
+
+    def summarize(self) -> dict[str, t.Any]:
+        with self.lock:
+            spans = list(self.spans)
+        durations: dict[str, list[float]] = {}
+        for span in spans:
+            durations.setdefault(span["stage"], []).append(span["duration"])
+        stages = {
+            stage: {
+                "count": len(stage_durations),
+                "total": sum(stage_durations),
+                "mean": sum(stage_durations) / len(stage_durations),
+                "p95": percentile(stage_durations, 95),
+            }
+            for stage, stage_durations in durations.items()
+        }
+        match_spans = [span for span in spans if span["stage"] == "match"]
+        match_spans.sort(key=lambda span: span["duration"], reverse=True)
+        slowest_matches = [
+            {"match_id": span["match_id"], "duration": span["duration"]}
+            for span in match_spans[:SLOWEST_MATCH_COUNT]
+        ]
+        return {"stages": stages, "slowest_matches": slowest_matches}
+
+    def log_summary(self) -> None:
+        summary = self.summarize()
+        for stage, stats in summary["stages"].items():
+            logger.info(
+                f"Timing|{stage}|count {stats['count']}|total {stats['total']:.1f} s"
+                f"|mean {stats['mean']:.2f} s|p95 {stats['p95']:.2f} s"
+            )
+        for match in summary["slowest_matches"]:
+            logger.info(f"Slowest match|{match['match_id']}|{match['duration']:.1f} s")
+        self.add({"run": self.run, "stage": "summary", **summary})
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank, so it's always one of the values."""
+    sorted_values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
@@ -1,27 +1,134 @@
+"""
+Posts builds from the "Build scraped" lines of an updater log. The builds are posted
+in chunks of whole games, and the progress is saved into a checkpoint file next to
+the log, so that an interrupted run continues where it stopped. The last check is
+updated (to "FROM LOG") only once all of the builds are posted.
+"""
+
+import argparse
+import dataclasses
 import json
-import sys
+import typing as t
+from pathlib import Path
 
 from backend.config import load_updater_config
 from backend.updater.updater import post_builds
 
+# The builds of a game are at most this many builds apart in the log.
+GAME_WINDOW = 1000
+
 
 def main() -> None:
-    if len(sys.argv) < 2:
-        print("Missing log filepath argument", file=sys.stderr)
-        sys.exit(1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log_path", type=Path)
+    parser.add_argument(
+        "-c", "--chunk-size", type=int, default=1000, help="min builds per post"
+    )
+    parser.add_argument(
+        "-r", "--restart", action="store_true", help="ignore the checkpoint"
+    )
+    args = parser.parse_args()
+    log_path: Path = args.log_path
+    checkpoint_path = log_path.with_name(f"{log_path.name}.checkpoint")
 
     load_updater_config()
 
-    builds = []
-    with open(sys.argv[1], "r", encoding="utf-8") as f:
-        for line in f.readlines():
-            line_split = line.split("|")
-            if len(line_split) < 5 or line_split[3] != "Build scraped":
-                continue
-            build_json = json.loads(line_split[4])
-            builds.append(build_json)
+    offset = 0 if args.restart else load_checkpoint(checkpoint_path)
+    if offset:
+        print(f"Continuing from checkpoint: {offset}")
+
+    chunk: list[dict] = []
+    with open(log_path, "rb") as f:
+        for offset, game_builds in read_games(f, offset):
+            chunk.extend(game_builds)
+            if len(chunk) >= args.chunk_size:
+                post_chunk(chunk, checkpoint_path, offset)
+                chunk = []
+    if chunk:
+        post_chunk(chunk, checkpoint_path, offset)
+    post_builds([], "FROM LOG")
+
+    checkpoint_path.unlink(missing_ok=True)
+    print("All done")
+
+
+def read_games(f: t.BinaryIO, offset: int) -> t.Iterator[tuple[int, list[dict]]]:
+    """
+    Yields the builds of each game, along with the offset from which the reading can
+    continue without missing any build of the games which were not yielded yet (the
+    rest of the yielded games is then read again, and skipped by the backend).
+    The builds of a game don't have to be next to each other (the browser pool logs
+    several matches at once), a game is complete once none of its builds came for
+    GAME_WINDOW builds.
+    """
+    f.seek(offset)
+    # By game, in the order of their first builds.
+    pending_games: dict[tuple[int, int], PendingGame] = {}
+    build_i = 0
+    for line in f:
+        line_offset = offset
+        offset += len(line)
+        build = parse_build(line.decode("utf-8"))
+        if build is None:
+            continue
+        game_key = (build["match_id"], build["game_i"])
+        if game_key not in pending_games:
+            pending_games[game_key] = PendingGame(line_offset)
+        pending_game = pending_games[game_key]
+        pending_game.builds.append(build)
+        pending_game.last_build_i = build_i
+        build_i += 1
+
+        complete_keys = [
+            key
+            for key, pending_game in pending_games.items()
+            if pending_game.last_build_i <= build_i - GAME_WINDOW
+        ]
+        for key in complete_keys:
+            game_builds = pending_games.pop(key).builds
+            yield get_next_offset(pending_games, offset), game_builds
+
+    while pending_games:
+        game_builds = pending_games.pop(next(iter(pending_games))).builds
+        yield get_next_offset(pending_games, offset), game_builds
+
+
+@dataclasses.dataclass
+class PendingGame:
+    offset: int
+    builds: list[dict] = dataclasses.field(default_factory=list)
+    last_build_i: int = 0
+
+
+def get_next_offset(
+    pending_games: dict[tuple[int, int], PendingGame], offset: int
+) -> int:
+    """Where the first of the pending games starts."""
+    return min((game.offset for game in pending_games.values()), default=offset)
+
+
+def parse_build(line: str) -> dict | None:
+    line_split = line.split("|")
+    if len(line_split) < 5 or line_split[3] != "Build scraped":
+        return None
+    return json.loads(line_split[4])
+
+
+def post_chunk(chunk: list[dict], checkpoint_path: Path, offset: int) -> None:
+    print(f"Posting builds: {len(chunk)}")
+    post_builds(chunk)
+    save_checkpoint(checkpoint_path, offset)
+
+
+def load_checkpoint(checkpoint_path: Path) -> int:
+    if not checkpoint_path.exists():
+        return 0
+    checkpoint = json.loads(checkpoint_path.read_text(encoding="utf8"))
+    return checkpoint["offset"]
+
 
-    post_builds(builds, "FROM LOG")
+def save_checkpoint(checkpoint_path: Path, offset: int) -> None:
+    checkpoint_path.write_text(json.dumps({"offset": offset}), encoding="utf8")
 
 
 if __name__ == "__main__":
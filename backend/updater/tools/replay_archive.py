@@ -0,0 +1,146 @@
+"""
+Extracts the builds again from the pages archived by the updater (see
+archive_match_pages), e.g. after the parsing has changed. The pages are parsed with lxml
+instead of a browser, in all cores, so it needs no network and takes seconds even for
+a whole season. The builds are written as JSON lines, the failed matches are printed:
+python -m backend.updater.tools.replay_archive builds.jsonl
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import typing as t
+from pathlib import Path
+from urllib.parse import urljoin
+
+import lxml.html
+import zstandard
+
+from backend.shared import SCC, SPL
+from backend.updater.updater import (
+    PAGE_ARCHIVE_DIR,
+    Match,
+    convert_game_data,
+    get_archived_page_path,
+    split_on_last_slash,
+)
+
+LEAGUES = {league.name: league for league in [SPL, SCC]}
+# The same as getElementsByClassName.
+BY_CLASS_XPATH = (
+    "descendant::*[contains(concat(' ', normalize-space(@class), ' '), ' {} ')]"
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_path", type=Path)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="processes"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    match_paths = sorted((PAGE_ARCHIVE_DIR / "matches").glob("*.json"))
+    build_count = 0
+    failed_count = 0
+    with (
+        concurrent.futures.ProcessPoolExecutor(args.jobs) as executor,
+        open(args.output_path, "w", encoding="utf8") as f,
+    ):
+        results = executor.map(replay_match_logged, match_paths, chunksize=8)
+        for match_path, (builds, error) in zip(match_paths, results):
+            if error is not None:
+                print(f"{match_path.name}: {error}", file=sys.stderr)
+                failed_count += 1
+            for build in builds:
+                f.write(f"{json.dumps(build)}\n")
+            build_count += len(builds)
+
+    duration = time.perf_counter() - start
+    print(
+        f"Matches: {len(match_paths)}, failed: {failed_count}, builds: {build_count}, "
+        f"in {duration:.1f} s"
+    )
+
+
+def replay_match_logged(match_path: Path) -> tuple[list[dict], str | None]:
+    """Returns the builds, or the error (so that the other matches still finish)."""
+    try:
+        return replay_match(match_path), None
+    except Exception as e:
+        return [], repr(e)
+
+
+def replay_match(match_path: Path) -> list[dict]:
+    match_dict = json.loads(match_path.read_text(encoding="utf8"))
+    last_slash_i, _ = split_on_last_slash(match_dict["url"])
+    match = Match(
+        league=LEAGUES[match_dict["league"]],
+        phase=match_dict["phase"],
+        month=match_dict["month"],
+        day=match_dict["day"],
+        id=match_dict["id"],
+        url=match_dict["url"],
+        last_slash_i=last_slash_i,
+    )
+
+    builds: list[dict] = []
+    decompressor = zstandard.ZstdDecompressor()
+    for game_i, digest in enumerate(match_dict["pages"], 1):
+        page_bytes = decompressor.decompress(
+            get_archived_page_path(digest).read_bytes()
+        )
+        game_data = parse_game_data(page_bytes.decode("utf8"), match.url)
+        builds.extend(convert_game_data(game_data, match, game_i))
+    return builds
+
+
+def parse_game_data(page: str, page_url: str) -> dict:
+    """The same as GET_GAME_DATA_JS in the browser."""
+    root = lxml.html.document_fromstring(page)
+    infos = by_class(root, "content-wrapper")
+    info = infos[1] if len(infos) > 1 else None
+    tables = by_class(root, "c-PlayerStatsTable")
+
+    def first_text(class_name: str, strip: bool = False) -> str | None:
+        elems = by_class(info, class_name) if info is not None else []
+        if not elems:
+            return None
+        elem_text = elems[0].text_content()
+        return elem_text.strip() if strip else elem_text
+
+    return {
+        "teams": (
+            [elem.text_content() for elem in info.xpath("descendant::strong")]
+            if info is not None
+            else []
+        ),
+        "game_duration": first_text("game-duration"),
+        "team_score": first_text("team-score", strip=True),
+        "tables": [
+            [
+                {
+                    "text": cell.text_content(),
+                    # The browser resolves the image URLs too.
+                    "images": [
+                        [img.get("alt", ""), urljoin(page_url, img.get("src", ""))]
+                        for img in cell.xpath("descendant::img")
+                    ],
+                }
+                for cell in by_class(table, "item")
+            ]
+            for table in tables
+        ],
+    }
+
+
+def by_class(elem: t.Any, class_name: str) -> list:
+    return elem.xpath(BY_CLASS_XPATH.format(class_name))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,33 @@
+import collections
 import dataclasses
+import datetime
+import functools
+import gzip
 import hashlib
 import hmac
 import json
 import logging
 import math
+import queue
+import sqlite3
 import sys
+import threading
 import time
 import typing as t
+from pathlib import Path
 
+import psutil
 import requests
 import selenium.common.exceptions as sel_exc
 import tqdm
+import zstandard
+from requests.adapters import HTTPAdapter
 from selenium.webdriver import Chrome, ChromeOptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+from urllib3.util.retry import Retry
 
 from backend.config import get_updater_config, load_updater_config
 from backend.shared import (
@@ -26,17 +40,31 @@ from backend.shared import (
     raise_for_status_with_detail,
     setup_logging,
 )
+from backend.updater.timings import Timings
 
 logger = logging.getLogger(__name__)
 
+T = t.TypeVar("T")
+
 WebDriver = Chrome
 WebDriverOptions = ChromeOptions
 
 IMPLICIT_WAIT = 3
-FALLBACK_COOKIES_WAIT = 10
+JOB_POLL_INTERVAL = 5
+# Seconds without any progress of the job, e.g. when the ingest worker is down.
+JOB_TIMEOUT = 30 * 60
+COOKIES_TIMEOUT = 15
+# A banner which was already accepted is not shown again (unless the cookies expired).
+COOKIES_RECHECK_TIMEOUT = 2
+WAIT_POLL_FREQUENCY = 0.1
+ADAPTIVE_TIMEOUT_FACTOR = 3
 NO_STATS_MESSAGE = "There are no stats for this match"
 
 
+TIMINGS_FILE = STORAGE_DIR / "updater_timings.jsonl"
+TIMINGS = Timings()
+
+
 class NoStats(Exception):
     pass
 
@@ -45,27 +73,80 @@ def main() -> None:
     load_updater_config()
     setup_logging(logging.INFO if len(sys.argv) < 2 else logging.DEBUG)
 
+    TIMINGS.start_run(TIMINGS_FILE)
     try:
-        options = make_webdriver_options()
-        logger.info("Starting browser")
-        with WebDriver(options=options) as driver:
-            driver.implicitly_wait(IMPLICIT_WAIT)
-            logger.info("Scraping SPL schedule")
-            matches = scrape_league(driver, SPL)
-            logger.info("Scraping SCC schedule")
-            matches += scrape_league(driver, SCC)
-            logger.info(f"All found matches: {len(matches)}")
-            new_matches = [match for match in matches if not match.is_old]
-            logger.info(f"Scraping new matches: {len(new_matches)}")
-            builds = scrape_matches(driver, new_matches)
-            logger.info(f"Posting builds: {len(builds)}")
-            last_checked_tooltip = format_last_checked_tooltip(matches)
-            post_builds(builds, last_checked_tooltip)
-            logger.info("All done")
+        with ScrapeState(SCRAPE_STATE_FILE) as scrape_state, Browser() as browser:
+            update(browser, scrape_state, {})
+        logger.info("All done")
 
     except Exception:
         logger.exception("Crash|")
         raise
+    finally:
+        # Also after a crash, to see where it got stuck.
+        TIMINGS.log_summary()
+        TIMINGS.close()
+
+
+def update(
+    browser: "Browser",
+    scrape_state: "ScrapeState",
+    schedule: "Schedule",
+    only_phases: set[tuple[str, str]] | None = None,
+) -> None:
+    """
+    Scrapes the schedules and the new matches, and posts the builds. The walked phases
+    (all of them, or only_phases, by league name and phase) are updated in the schedule,
+    which the daemon keeps between the runs.
+    """
+    logger.info("Syncing known matches")
+    with TIMINGS.span("sync_known_matches"):
+        scrape_state.sync_known_matches(get_updater_config().backend_url)
+    builds_poster = BuildsPoster(SPOOL_DIR)
+    builds_poster.post_spooled()
+    try:
+        with builds_poster:
+            matches: list[Match] = []
+            for league in [SPL, SCC]:
+                league_phases = None
+                if only_phases is not None:
+                    league_phases = {
+                        phase
+                        for league_name, phase in only_phases
+                        if league_name == league.name
+                    }
+                    if not league_phases:
+                        continue
+                else:
+                    # The phases which are not on the website anymore are forgotten.
+                    for key in [key for key in schedule if key[0] == league.name]:
+                        del schedule[key]
+                logger.info(f"Scraping {league.name} schedule")
+                with TIMINGS.span("scrape_league", league=league.name):
+                    schedule_phases = scrape_league(
+                        browser, league, scrape_state, league_phases
+                    )
+                for schedule_phase in schedule_phases:
+                    schedule[league.name, schedule_phase.name] = schedule_phase
+                    matches += schedule_phase.matches
+            logger.info(f"All found matches: {len(matches)}")
+            new_matches = get_new_matches(matches, scrape_state)
+            logger.info(f"Scraping new matches: {len(new_matches)}")
+            scrape_matches(browser, new_matches, builds_poster.add)
+    finally:
+        scrape_state.add_scraped_matches(builds_poster.scraped_matches)
+    logger.info(f"Scraped builds: {builds_poster.build_count}")
+    scrape_state.add_no_stats_matches(new_matches)
+    # Of the whole schedule, also the phases which were not walked now.
+    all_matches = [
+        match
+        for schedule_phase in schedule.values()
+        for match in schedule_phase.matches
+    ]
+    last_checked_tooltip = format_last_checked_tooltip(all_matches)
+    builds_poster.job_ids.append(queue_builds([], last_checked_tooltip))
+    with TIMINGS.span("wait_for_jobs"):
+        builds_poster.wait_for_jobs()
 
 
 # --------------------------------------------------------------------------------------
@@ -73,29 +154,374 @@ def main() -> None:
 # --------------------------------------------------------------------------------------
 
 
-def get_all_match_ids(phases: list[str]) -> list[list[int]]:
-    all_match_ids_resp = requests.post(
-        f"{get_updater_config().backend_url}/api/phases", json=phases
+SPOOL_DIR = STORAGE_DIR / "updater_spool"
+# The builds of a few matches, every post is a job which publishes a new snapshot.
+POST_BATCH_SIZE = 200
+BACKEND_RETRIES = 5
+# Seconds, doubled with every retry.
+BACKEND_BACKOFF_FACTOR = 2
+
+
+@functools.cache
+def get_backend_session() -> requests.Session:
+    """Pooled connections, and retries with exponential backoff."""
+    retry = Retry(
+        total=BACKEND_RETRIES,
+        backoff_factor=BACKEND_BACKOFF_FACTOR,
+        status_forcelist=[429, 500, 502, 503, 504],
+        # Also posts, the backend skips the games which were already posted.
+        allowed_methods=None,
+        # The last response is then raised with its detail.
+        raise_on_status=False,
     )
-    raise_for_status_with_detail(all_match_ids_resp)
-    all_match_ids = all_match_ids_resp.json()
-    if len(phases) != len(all_match_ids):
-        raise RuntimeError(f"/api/phases returned wrong list: {all_match_ids}")
-    return all_match_ids
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
+def post_builds(builds: list[dict], last_checked_tooltip: str | None = None) -> None:
+    wait_for_job(queue_builds(builds, last_checked_tooltip))
 
-def post_builds(builds: list[dict], last_checked_tooltip: str) -> None:
+
+def queue_builds(builds: list[dict], last_checked_tooltip: str | None = None) -> int:
+    """Returns the ID of the job. The last check is updated only with the tooltip."""
     hmac_key = bytearray.fromhex(get_updater_config().hmac_key_hex)
-    request_dict = {"builds": builds, "last_checked_tooltip": last_checked_tooltip}
+    request_dict: dict[str, t.Any] = {"builds": builds}
+    if last_checked_tooltip is not None:
+        request_dict["last_checked_tooltip"] = last_checked_tooltip
     request_bytes = json.dumps(request_dict).encode("utf-8")
+    # Always of the uncompressed body.
     hmac_obj = hmac.new(hmac_key, request_bytes, hashlib.sha256)
     headers = {"X-HMAC-DIGEST-HEX": hmac_obj.hexdigest()}
-    resp = requests.post(
-        f"{get_updater_config().backend_url}/api/builds",
-        data=request_bytes,
-        headers=headers,
-    )
+    if compression := get_updater_config().builds_compression:
+        request_bytes = compress(request_bytes, compression)
+        headers["Content-Encoding"] = compression
+    with TIMINGS.span("post_builds", build_count=len(builds)):
+        resp = get_backend_session().post(
+            f"{get_updater_config().backend_url}/api/builds",
+            data=request_bytes,
+            headers=headers,
+        )
     raise_for_status_with_detail(resp)
+    return resp.json()["job_id"]
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data)
+    elif compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    raise RuntimeError(f"Unknown compression: {compression}")
+
+
+def wait_for_job(job_id: int) -> None:
+    """
+    The builds are posted asynchronously by the backend, so wait for the result. Gives
+    up when the job makes no progress for JOB_TIMEOUT (the builds may still be posted
+    later, once the ingest worker is running again).
+    """
+    logger.info(f"Waiting for job: {job_id}")
+    last_state = None
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while True:
+        time.sleep(JOB_POLL_INTERVAL)
+        resp = get_backend_session().get(
+            f"{get_updater_config().backend_url}/api/jobs/{job_id}"
+        )
+        raise_for_status_with_detail(resp)
+        job = resp.json()
+        if job["status"] == "done":
+            break
+        elif job["status"] == "failed":
+            raise RuntimeError(f"Job {job_id} failed: {job['error']}")
+        logger.debug(f"Job progress|{job['progress']}")
+        state = (job["status"], job["progress"])
+        if state != last_state:
+            last_state = state
+            deadline = time.monotonic() + JOB_TIMEOUT
+        elif time.monotonic() >= deadline:
+            raise RuntimeError(
+                f"Job {job_id} timed out, {job['status']} without progress for "
+                f"{JOB_TIMEOUT} s (is the ingest worker running?)"
+            )
+
+    logger.info(f"Job result|{json.dumps(job['result'])}")
+    for warning in job["warnings"]:
+        logger.warning(f"Job warning|{warning}")
+
+
+def is_rejected(e: Exception) -> bool:
+    """The backend will never accept the builds (e.g. invalid or too big)."""
+    if not isinstance(e, requests.HTTPError) or e.response is None:
+        return False
+    status_code = e.response.status_code
+    return 400 <= status_code < 500 and status_code not in [408, 429]
+
+
+class BuildsPoster:
+    """
+    Posts the builds in batches as soon as they are scraped, instead of all of them
+    at the end, so that a crash or a backend outage loses at most the current batch.
+    Posting runs in a thread, so the scraping doesn't wait for it. Batches which can't
+    be posted even after the retries are spooled into files, which are posted first
+    on the next run. Batches which the backend rejects, and the batches of the jobs
+    which failed, are kept in the rejected subdirectory instead, to be looked at (they
+    can be moved back to be posted again).
+    The builds of a match are always in the same batch. The batches are in the order
+    in which the matches were scraped (which is not the order of the schedule, when
+    using the browser pool), since the backend orders the builds by date and match.
+    """
+
+    def __init__(self, spool_dir: Path, batch_size: int = POST_BATCH_SIZE) -> None:
+        self.spool_dir = spool_dir
+        self.rejected_dir = spool_dir / "rejected"
+        self.batch_size = batch_size
+        self.job_ids: list[int] = []
+        # Of the jobs which are not known to be done yet.
+        self.job_builds: dict[int, list[dict]] = {}
+        self.build_count = 0
+        # Phase and match ID of every posted or spooled match.
+        self.scraped_matches: set[tuple[str, int]] = set()
+        self.match_builds_queue: queue.Queue[list[dict] | None] = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+
+    def __enter__(self) -> "BuildsPoster":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        """Posts the last batch, also after a crash."""
+        self.match_builds_queue.put(None)
+        self.thread.join()
+
+    def add(self, match_builds: list[dict]) -> None:
+        """The builds of one match. Can be called from any thread."""
+        self.match_builds_queue.put(match_builds)
+
+    def run(self) -> None:
+        batch: list[dict] = []
+        while (match_builds := self.match_builds_queue.get()) is not None:
+            batch.extend(match_builds)
+            if len(batch) >= self.batch_size:
+                self.post_or_spool(batch)
+                batch = []
+        if batch:
+            self.post_or_spool(batch)
+
+    def post_or_spool(self, builds: list[dict]) -> None:
+        self.build_count += len(builds)
+        self.scraped_matches.update(
+            (build["phase"], build["match_id"]) for build in builds
+        )
+        try:
+            self.queue(builds)
+            logger.info(f"Posted builds: {len(builds)}")
+        except Exception as e:
+            if is_rejected(e):
+                logger.exception(f"Builds rejected: {len(builds)}|")
+                self.spool(builds, self.rejected_dir)
+            else:
+                logger.exception(f"Failed to post builds, spooling: {len(builds)}|")
+                self.spool(builds, self.spool_dir)
+
+    def queue(self, builds: list[dict]) -> None:
+        job_id = queue_builds(builds)
+        self.job_ids.append(job_id)
+        self.job_builds[job_id] = builds
+
+    def spool(
+        self, builds: list[dict], spool_dir: Path, name: str | None = None
+    ) -> None:
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        path = spool_dir / (name or f"{time.time_ns()}.json")
+        # Written into a temporary file first, so that it's never read half-written.
+        tmp_path = path.with_name(f"{path.name}~")
+        tmp_path.write_text(json.dumps(builds), encoding="utf8")
+        tmp_path.rename(path)
+
+    def post_spooled(self) -> None:
+        """When the backend is still down, the rest stays spooled for the next run."""
+        for path in sorted(self.spool_dir.glob("*.json")):
+            builds = json.loads(path.read_text(encoding="utf8"))
+            try:
+                self.queue(builds)
+            except Exception as e:
+                if not is_rejected(e):
+                    logger.exception(f"Failed to post spooled builds: {path.name}|")
+                    return
+                logger.exception(f"Spooled builds rejected: {path.name}|")
+                self.rejected_dir.mkdir(parents=True, exist_ok=True)
+                path.rename(self.rejected_dir / path.name)
+                continue
+            logger.info(f"Posted spooled builds: {len(builds)}")
+            path.unlink()
+
+    def wait_for_jobs(self) -> None:
+        """Waits for all of them, even when some fail."""
+        failed_job_ids = []
+        for job_id in self.job_ids:
+            try:
+                wait_for_job(job_id)
+            except RuntimeError:
+                logger.exception(f"{job_id}|")
+                failed_job_ids.append(job_id)
+                if builds := self.job_builds.get(job_id):
+                    self.spool(builds, self.rejected_dir, f"job_{job_id}.json")
+            self.job_builds.pop(job_id, None)
+        if failed_job_ids:
+            raise RuntimeError(
+                f"Jobs failed (the builds are in {self.rejected_dir}): "
+                f"{failed_job_ids}"
+            )
+
+
+# --------------------------------------------------------------------------------------
+# SCRAPE STATE
+# --------------------------------------------------------------------------------------
+
+
+SCRAPE_STATE_FILE = STORAGE_DIR / "updater_state.db"
+# Stats are sometimes added only later, so matches without them are tried again.
+NO_STATS_RETRY_INTERVAL = datetime.timedelta(hours=12)
+
+SCRAPE_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS known_match (
+    phase TEXT NOT NULL, match_id INTEGER NOT NULL, PRIMARY KEY (phase, match_id)
+);
+CREATE TABLE IF NOT EXISTS no_stats_match (
+    match_id INTEGER PRIMARY KEY, checked_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedule_phase (
+    league TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    matches TEXT NOT NULL,
+    PRIMARY KEY (league, phase)
+);
+"""
+
+
+class ScrapeState:
+    """
+    Local SQLite file of what the updater already knows, so that it doesn't have to ask
+    the backend about every phase on every run: the matches which the backend already
+    has, the matches which had no stats, and the last seen schedule of every phase.
+    The known matches are synced from the backend incrementally, by the last build ID.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.executescript(SCRAPE_STATE_SCHEMA)
+
+    def __enter__(self) -> "ScrapeState":
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        self.conn.close()
+
+    def sync_known_matches(self, backend_url: str) -> None:
+        """
+        Only the matches of the builds posted since the last sync are added, the local
+        ones (e.g. spooled, or not ingested yet) are kept.
+        """
+        after_build_id = self.get_metadata("known_max_build_id")
+        resp = get_backend_session().get(
+            f"{backend_url}/api/known_matches",
+            params=(
+                {"after_build_id": after_build_id}
+                if after_build_id is not None
+                else None
+            ),
+        )
+        raise_for_status_with_detail(resp)
+        result = resp.json()
+        logger.debug(
+            "Known matches synced|"
+            f"{sum(len(match_ids) for match_ids in result['matches'].values())}"
+        )
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO known_match VALUES (?, ?)",
+                (
+                    (phase, match_id)
+                    for phase, match_ids in result["matches"].items()
+                    for match_id in match_ids
+                ),
+            )
+            if result["max_build_id"] is not None:
+                self.set_metadata("known_max_build_id", str(result["max_build_id"]))
+
+    def is_known(self, phase: str, match_id: int) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM known_match WHERE phase = ? AND match_id = ?",
+            [phase, match_id],
+        ).fetchone()
+        return row is not None
+
+    def add_scraped_matches(self, matches: t.Iterable[tuple[str, int]]) -> None:
+        """
+        Phases and IDs of the matches, so they are skipped even before the next sync
+        (e.g. when it fails, or when the builds are still spooled).
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO known_match VALUES (?, ?)", matches
+            )
+
+    def is_recent_no_stats(self, match_id: int, now: datetime.datetime) -> bool:
+        row = self.conn.execute(
+            "SELECT checked_at FROM no_stats_match WHERE match_id = ?", [match_id]
+        ).fetchone()
+        if row is None:
+            return False
+        return now - datetime.datetime.fromisoformat(row[0]) < NO_STATS_RETRY_INTERVAL
+
+    def add_no_stats_matches(self, scraped_matches: list["Match"]) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO no_stats_match VALUES (?, ?)",
+                [(match.id, now) for match in scraped_matches if match.has_no_stats],
+            )
+            # The stats were added in the end.
+            self.conn.executemany(
+                "DELETE FROM no_stats_match WHERE match_id = ?",
+                [(match.id,) for match in scraped_matches if not match.has_no_stats],
+            )
+
+    def get_schedule_phase(
+        self, league: League, phase: str, fingerprint: str
+    ) -> list[list] | None:
+        """The matches of the phase, if its schedule has not changed since."""
+        row = self.conn.execute(
+            "SELECT matches FROM schedule_phase"
+            " WHERE league = ? AND phase = ? AND fingerprint = ?",
+            [league.name, phase, fingerprint],
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set_schedule_phase(
+        self, league: League, phase: str, fingerprint: str, matches: list[list]
+    ) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO schedule_phase VALUES (?, ?, ?, ?)",
+                [league.name, phase, fingerprint, json.dumps(matches)],
+            )
+
+    def get_metadata(self, key: str) -> str | None:
+        row = self.conn.execute(
+            "SELECT value FROM metadata WHERE key = ?", [key]
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_metadata(self, key: str, value: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?)", [key, value])
 
 
 # --------------------------------------------------------------------------------------
@@ -103,21 +529,162 @@ def post_builds(builds: list[dict], last_checked_tooltip: str) -> None:
 # --------------------------------------------------------------------------------------
 
 
-def make_webdriver_options() -> WebDriverOptions:
+# Kept between runs, so that the scripts, styles etc. of the website are not downloaded
+# every time. Every browser in the pool has its own, since they cannot be shared.
+BROWSER_CACHE_DIR = STORAGE_DIR / "browser_cache"
+BROWSER_CACHE_SIZE = 200 * 1024 * 1024
+# Only the text and the image URLs are read, not the images themselves etc.
+BLOCKED_URLS = [
+    *(f"*.{ext}" for ext in ["woff", "woff2", "ttf", "otf", "eot"]),
+    *(f"*.{ext}" for ext in ["mp4", "webm", "ogg", "mp3", "m3u8"]),
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*connect.facebook.net*",
+    "*hotjar.com*",
+]
+
+
+def start_webdriver(browser_i: int = 0) -> WebDriver:
+    block_resources = get_updater_config().block_resources
+    options = make_webdriver_options(
+        BROWSER_CACHE_DIR / str(browser_i), block_resources
+    )
+    driver = WebDriver(options=options)
+    driver.implicitly_wait(IMPLICIT_WAIT)
+    if block_resources:
+        # Persists across page loads.
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+def make_webdriver_options(
+    cache_dir: Path | None = None, block_resources: bool = False
+) -> WebDriverOptions:
     options = WebDriverOptions()
     # https://help.pythonanywhere.com/pages/selenium/
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
     options.add_argument("--no-sandbox")
+    prefs: dict[str, t.Any] = {"intl.accept_languages": "en,en_US"}
+    if block_resources:
+        # All images, no matter the URL (the src attributes are still there).
+        # https://stackoverflow.com/a/31581387
+        prefs["profile.managed_default_content_settings.images"] = 2
     # https://stackoverflow.com/a/55254431
-    options.add_experimental_option("prefs", {"intl.accept_languages": "en,en_US"})
+    options.add_experimental_option("prefs", prefs)
     # https://stackoverflow.com/a/53970825
     options.add_argument("--disable-dev-shm-usage")
     # https://stackoverflow.com/a/59724330
     options.add_argument("window-size=1600,900")
+    if cache_dir is not None:
+        options.add_argument(f"--disk-cache-dir={cache_dir}")
+        options.add_argument(f"--disk-cache-size={BROWSER_CACHE_SIZE}")
     return options
 
 
+# The fields of the cookies which are copied into the recycled browser.
+COOKIE_PARAM_KEYS = [
+    "name",
+    "value",
+    "domain",
+    "path",
+    "secure",
+    "httpOnly",
+    "sameSite",
+]
+
+
+class Browser:
+    """
+    The memory of the browser keeps growing, until it's killed, during long runs
+    (e.g. when scraping a whole season). So the browser is restarted after some matches
+    or when it uses too much memory, with the same cookies (e.g. the accepted banner).
+    """
+
+    def __init__(self, browser_i: int = 0) -> None:
+        self.browser_i = browser_i
+        self.driver = start_webdriver(browser_i)
+        self.match_count = 0
+        self.peak_memory = 0
+        # The names of the leagues, whose cookie banner was accepted.
+        self.accepted_cookies: set[str] = set()
+
+    def __enter__(self) -> "Browser":
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.update_peak_memory()
+        logger.info(
+            f"Peak browser memory|{self.browser_i}|{format_mb(self.peak_memory)}"
+        )
+        self.driver.quit()
+
+    def after_match(self) -> None:
+        config = get_updater_config()
+        self.match_count += 1
+        memory = self.update_peak_memory()
+        if (
+            config.recycle_browser_after
+            and self.match_count >= config.recycle_browser_after
+        ):
+            logger.info(
+                f"Recycling browser after matches|{self.browser_i}|{self.match_count}"
+            )
+            self.recycle()
+        elif config.browser_memory_limit and memory > config.browser_memory_limit:
+            logger.info(f"Recycling browser using|{self.browser_i}|{format_mb(memory)}")
+            self.recycle()
+
+    def recycle(self) -> None:
+        cookies = self.driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        self.driver.quit()
+        self.driver = start_webdriver(self.browser_i)
+        self.driver.execute_cdp_cmd(
+            "Network.setCookies", {"cookies": make_cookie_params(cookies)}
+        )
+        self.match_count = 0
+
+    def update_peak_memory(self) -> int:
+        """Returns the current memory."""
+        memory = get_browser_memory(self.driver)
+        self.peak_memory = max(self.peak_memory, memory)
+        return memory
+
+
+def make_cookie_params(cookies: list[dict]) -> list[dict]:
+    """Network.getAllCookies returns more than Network.setCookies accepts."""
+    cookie_params = []
+    for cookie in cookies:
+        cookie_param = {key: cookie[key] for key in COOKIE_PARAM_KEYS if key in cookie}
+        # Session cookies have -1.
+        if not cookie.get("session") and cookie.get("expires", -1) >= 0:
+            cookie_param["expires"] = cookie["expires"]
+        cookie_params.append(cookie_param)
+    return cookie_params
+
+
+def get_browser_memory(driver: WebDriver) -> int:
+    """
+    The RSS of all the processes of the browser (so memory shared between them
+    is counted more than once), in bytes. 0 if it cannot be found out.
+    """
+    try:
+        driver_process = psutil.Process(driver.service.process.pid)
+        processes = driver_process.children(recursive=True)
+        return sum(process.memory_info().rss for process in processes)
+    except (psutil.Error, AttributeError):
+        return 0
+
+
+def format_mb(memory: int) -> str:
+    return f"{memory / 1024 / 1024:.0f} MB"
+
+
 @dataclasses.dataclass
 class Match:
     league: League
@@ -129,6 +696,7 @@ class Match:
     last_slash_i: int
     is_old: bool = False
     is_missing: bool = False
+    has_no_stats: bool = False
 
     def to_json(self) -> str:
         match_dict = dataclasses.asdict(self)
@@ -137,16 +705,28 @@ class Match:
         return json.dumps(match_dict, ensure_ascii=False)
 
 
-def scrape_league(driver: WebDriver, league: League) -> list[Match]:
-    driver.get(league.schedule_url)
+@dataclasses.dataclass
+class SchedulePhase:
+    league: League
+    name: str
+    # The month and day of every day with matches, also the ones not played yet.
+    days: list[tuple[int, int]]
+    matches: list[Match]
 
-    cookie_accept_button = driver.find_element(By.CLASS_NAME, "approve")
-    try:
-        cookie_accept_button.click()
-    except sel_exc.ElementNotInteractableException:
-        time.sleep(FALLBACK_COOKIES_WAIT)
-        cookie_accept_button.click()
-    time.sleep(0.1)
+
+# By league name and phase.
+Schedule = dict[tuple[str, str], SchedulePhase]
+
+
+def scrape_league(
+    browser: Browser,
+    league: League,
+    scrape_state: ScrapeState,
+    only_phases: t.Container[str] | None = None,
+) -> list[SchedulePhase]:
+    driver = browser.driver
+    driver.get(league.schedule_url)
+    accept_cookies(browser, league)
 
     phase_elems = driver.find_elements(By.CLASS_NAME, "phase")
     # The filtering is here because in SCC there is (or at least was at one point)
@@ -154,201 +734,284 @@ def scrape_league(driver: WebDriver, league: League) -> list[Match]:
     phase_elems = [phase_elem for phase_elem in phase_elems if text(phase_elem)]
     phases = [text(phase_elem) for phase_elem in phase_elems]
 
-    all_match_ids = get_all_match_ids(phases)
+    schedule_phases: list[SchedulePhase] = []
+    for phase_elem, phase in zip(phase_elems, phases):
+        if only_phases is not None and phase not in only_phases:
+            continue
+        with TIMINGS.span("phase", league=league.name, phase=phase):
+            phase_elem.click()
+            start = time.time()
+            phase_matches = get_phase_matches(driver, league, phase, scrape_state)
+            days = get_schedule_days(driver)
+
+        matches: list[Match] = []
+        for month, day, match_url in phase_matches:
+            last_slash_i, match_id_s = split_on_last_slash(match_url)
+            match_id = int(match_id_s)
+            match = Match(
+                league=league,
+                phase=phase,
+                month=month,
+                day=day,
+                id=match_id,
+                url=match_url,
+                last_slash_i=last_slash_i,
+            )
+            matches.append(match)
+            if scrape_state.is_known(phase, match_id):
+                match.is_old = True
+                logger.debug(f"Scraped previously|{match.to_json()}")
+        schedule_phases.append(SchedulePhase(league, phase, days, matches))
 
-    matches: list[Match] = []
-    for phase_elem, phase, match_ids in zip(phase_elems, phases, all_match_ids):
-        match_ids_set = set(match_ids)
-        phase_elem.click()
-        start = time.time()
+        delay(0.5, start)
 
-        day_elems = driver.find_elements(By.CLASS_NAME, "day")
-        for day_elem in day_elems:
-            date = text(day_elem.find_element(By.CLASS_NAME, "date"))
-            _, month_, day_s = date.split(" ")
-            month = MONTH_TO_I[month_]
-            day = int(day_s)
-
-            result_link_elems = day_elem.find_elements(By.CLASS_NAME, "results")
-            for result_link_elem in result_link_elems:
-                match_url = result_link_elem.get_attribute("href")
-                last_slash_i, match_id_s = split_on_last_slash(match_url)
-                match_id = int(match_id_s)
-                match = Match(
-                    league=league,
-                    phase=phase,
-                    month=month,
-                    day=day,
-                    id=match_id,
-                    url=match_url,
-                    last_slash_i=last_slash_i,
-                )
-                matches.append(match)
-                if match_id in match_ids_set:
-                    match.is_old = True
-                    logger.debug(f"Scraped previously|{match.to_json()}")
+    return schedule_phases
 
-        delay(0.5, start)
 
-    return matches
+def accept_cookies(browser: Browser, league: League) -> None:
+    accepted = league.name in browser.accepted_cookies
+    cookie_accept_button = wait_until(
+        browser.driver,
+        COOKIES_RECHECK_TIMEOUT if accepted else COOKIES_TIMEOUT,
+        EC.element_to_be_clickable((By.CLASS_NAME, "approve")),
+    )
+    if cookie_accept_button is None:
+        if accepted:
+            return
+        raise RuntimeError(f"Cookie banner not found|{league.name}")
+    cookie_accept_button.click()
+    # Otherwise the banner could be in the way of clicking the phases.
+    wait_until(
+        browser.driver,
+        COOKIES_TIMEOUT,
+        EC.invisibility_of_element(cookie_accept_button),
+    )
+    browser.accepted_cookies.add(league.name)
 
 
-def scrape_matches(driver: WebDriver, matches: list[Match]) -> list[dict]:
-    match_ids_with_no_stats = get_updater_config().matches_with_no_stats
+def get_phase_matches(
+    driver: WebDriver, league: League, phase: str, scrape_state: ScrapeState
+) -> list[list]:
+    fingerprint = get_schedule_fingerprint(driver)
+    phase_matches = scrape_state.get_schedule_phase(league, phase, fingerprint)
+    if phase_matches is not None:
+        logger.debug(f"Schedule not changed|{league.name}|{phase}")
+        return phase_matches
 
-    builds: list[dict] = []
-    for match in t.cast(t.Iterable[Match], tqdm.tqdm(matches)):
-        logger.debug(f"Scraping|{match.to_json()}")
+    phase_matches = scrape_phase_matches(driver)
+    # Otherwise it could be still loading, and the matches incomplete.
+    if get_schedule_fingerprint(driver) == fingerprint:
+        scrape_state.set_schedule_phase(league, phase, fingerprint, phase_matches)
+    return phase_matches
+
+
+GET_SCHEDULE_FINGERPRINT_JS = """
+const days = document.getElementsByClassName("day");
+return Array.from(days, (day) => day.outerHTML).join("\\n");
+"""
+
+
+def get_schedule_fingerprint(driver: WebDriver) -> str:
+    days_html = driver.execute_script(GET_SCHEDULE_FINGERPRINT_JS)
+    return hashlib.sha256(days_html.encode("utf8")).hexdigest()
+
+
+def scrape_phase_matches(driver: WebDriver) -> list[list]:
+    """Returns the month, day and URL of every match of the shown phase."""
+    phase_matches: list[list] = []
+    day_elems = driver.find_elements(By.CLASS_NAME, "day")
+    for day_elem in day_elems:
+        month, day = parse_schedule_date(
+            text(day_elem.find_element(By.CLASS_NAME, "date"))
+        )
+
+        result_link_elems = day_elem.find_elements(By.CLASS_NAME, "results")
+        for result_link_elem in result_link_elems:
+            match_url = result_link_elem.get_attribute("href")
+            phase_matches.append([month, day, match_url])
+    return phase_matches
+
+
+GET_SCHEDULE_DATES_JS = """
+const dates = document.querySelectorAll(".day .date");
+return Array.from(dates, (date) => date.textContent);
+"""
+
+
+def get_schedule_days(driver: WebDriver) -> list[tuple[int, int]]:
+    """The month and day of every day of the shown phase, also without results yet."""
+    dates = driver.execute_script(GET_SCHEDULE_DATES_JS)
+    return [parse_schedule_date(date) for date in dates]
+
+
+def parse_schedule_date(date: str) -> tuple[int, int]:
+    _, month_, day_s = date.split(" ")
+    return MONTH_TO_I[month_], int(day_s)
 
-        if not check_url_still_same(
-            match.league.match_url, match.url, match.last_slash_i
-        ):
-            logger.warning(f"Unknown match URL|{match.url}")
 
+def get_new_matches(matches: list[Match], scrape_state: ScrapeState) -> list[Match]:
+    """The matches to scrape, without the ones which recently had no stats."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    new_matches: list[Match] = []
+    for match in matches:
+        if match.is_old:
+            continue
+        if scrape_state.is_recent_no_stats(match.id, now):
+            logger.debug(f"Recently had no stats|{match.to_json()}")
+            set_no_stats(match)
+        else:
+            new_matches.append(match)
+    return new_matches
+
+
+OnBuilds = t.Callable[[list[dict]], None]
+
+
+def scrape_matches(browser: Browser, matches: list[Match], on_builds: OnBuilds) -> None:
+    """on_builds is called with the builds of every match as soon as it's scraped."""
+    config = get_updater_config()
+    matchstats = MatchstatsClient() if config.use_matchstats else None
+    rate_limiter = RateLimiter(config.match_page_interval)
+    if config.browser_pool_size > 1 and len(matches) > 1:
+        scrape_matches_in_pool(
+            browser,
+            matches,
+            config.browser_pool_size,
+            matchstats,
+            rate_limiter,
+            on_builds,
+        )
+        return
+
+    for match in t.cast(t.Iterable[Match], tqdm.tqdm(matches)):
+        builds = scrape_match_logged(browser.driver, matchstats, rate_limiter, match)
+        if builds:
+            on_builds(builds)
+        browser.after_match()
+
+
+def scrape_matches_in_pool(
+    browser: Browser,
+    matches: list[Match],
+    pool_size: int,
+    matchstats: "MatchstatsClient | None",
+    rate_limiter: "RateLimiter",
+    on_builds: OnBuilds,
+) -> None:
+    """
+    Every browser (the already running one and pool_size - 1 new ones) takes matches
+    from a queue. on_builds is called from the threads of the browsers.
+    """
+    match_queue: queue.Queue[Match] = queue.Queue()
+    for match in matches:
+        match_queue.put(match)
+    progress = tqdm.tqdm(total=len(matches))
+
+    def work(browser: Browser) -> None:
+        while True:
+            try:
+                match = match_queue.get_nowait()
+            except queue.Empty:
+                return
+            builds = scrape_match_logged(
+                browser.driver, matchstats, rate_limiter, match
+            )
+            if builds:
+                on_builds(builds)
+            browser.after_match()
+            progress.update()
+
+    def work_with_new_browser(browser_i: int) -> None:
         try:
-            new_builds = scrape_match(driver, match)
-            builds.extend(new_builds)
-        except NoStats:
-            if str(match.id) not in match_ids_with_no_stats:
-                match.is_missing = True
-                logger.info(f"{NO_STATS_MESSAGE}: {match.id}")
+            with Browser(browser_i) as new_browser:
+                work(new_browser)
+        # The other browsers take over the remaining matches.
         except Exception:
-            logger.exception(f"{match.id}|")
+            logger.exception("Browser in the pool crashed|")
+
+    logger.info(f"Starting browsers: {pool_size - 1}")
+    threads = [
+        threading.Thread(target=work_with_new_browser, args=[browser_i])
+        for browser_i in range(1, pool_size)
+    ]
+    for thread in threads:
+        thread.start()
+    work(browser)
+    for thread in threads:
+        thread.join()
+    progress.close()
+
+
+def scrape_match_logged(
+    driver: WebDriver,
+    matchstats: "MatchstatsClient | None",
+    rate_limiter: "RateLimiter",
+    match: Match,
+) -> list[dict]:
+    """Returns no builds, when the match can't be scraped."""
+    logger.debug(f"Scraping|{match.to_json()}")
+
+    if not check_url_still_same(match.league.match_url, match.url, match.last_slash_i):
+        logger.warning(f"Unknown match URL|{match.url}")
 
-    return builds
+    try:
+        with TIMINGS.span("match", match_id=match.id):
+            return scrape_match_with_fallback(driver, matchstats, rate_limiter, match)
+    except NoStats:
+        set_no_stats(match)
+    except Exception:
+        logger.exception(f"{match.id}|")
+    return []
 
 
-def scrape_match(driver: WebDriver, match: Match) -> list[dict]:
-    builds_all: list[dict] = []
-    games: list[WebElement] = []
+def set_no_stats(match: Match) -> None:
+    match.has_no_stats = True
+    if str(match.id) not in get_updater_config().matches_with_no_stats:
+        match.is_missing = True
+        logger.info(f"{NO_STATS_MESSAGE}: {match.id}")
 
-    driver.get(match.url)
-    for _ in range(3):
-        time.sleep(5)
 
-        # Sometimes the match page is just a single h1 element saying there are no
-        # stats, so this code attempts to idenfity this situation to avoid a false
-        # positive Scraped zero builds exception.
+def scrape_match_with_fallback(
+    driver: WebDriver,
+    matchstats: "MatchstatsClient | None",
+    rate_limiter: "RateLimiter",
+    match: Match,
+) -> list[dict]:
+    """The browser is used, when the matchstats API is disabled or doesn't work."""
+    if matchstats is not None:
         try:
-            match_details = driver.find_element(By.CLASS_NAME, "match-details")
-            no_stats = match_details.find_element(By.TAG_NAME, "h1")
-            if text(no_stats) == NO_STATS_MESSAGE:
-                raise NoStats()
-        except sel_exc.NoSuchElementException:
-            pass
-
-        games = driver.find_elements(By.CLASS_NAME, "game-btn")
-        if games:
-            break
+            if builds := matchstats.get_builds(match):
+                return builds
+            logger.info(f"No games in matchstats, using the browser: {match.id}")
+        except Exception:
+            logger.warning(f"Matchstats failed, using the browser: {match.id}|")
+            logger.debug("Matchstats failure|", exc_info=True)
+    return scrape_match(driver, match, rate_limiter)
 
-    for game_i, game in enumerate(games, 1):
-        game.click()
-        start = time.time()
 
-        # Find out teams, game length & which team won.
-        tmp = driver.find_elements(By.CLASS_NAME, "content-wrapper")[1]
-        team_elems = tmp.find_elements(By.TAG_NAME, "strong")
-        teams = (text(team_elems[0]), text(team_elems[1]))
-        game_length = text(tmp.find_element(By.CLASS_NAME, "game-duration"))
-        hours, minutes, seconds = parse_game_length(game_length)
-        win_or_loss = tmp.find_element(By.CLASS_NAME, "team-score").text
-        if win_or_loss == "W":
-            wins = (True, False)
-        elif win_or_loss == "L":
-            wins = (False, True)
-        else:
-            raise RuntimeError(f"Could not ascertain victory or loss: {win_or_loss}")
+def scrape_match(
+    driver: WebDriver, match: Match, rate_limiter: "RateLimiter | None" = None
+) -> list[dict]:
+    builds_all: list[dict] = []
 
-        # Get everything else.
-        tables = driver.find_elements(By.CLASS_NAME, "c-PlayerStatsTable")
-        if len(tables) != 2:
-            raise RuntimeError(
-                f"Wrong number of tables with player stats: {len(tables)}"
-            )
-        builds: tuple[list[dict], list[dict]] = ([], [])
-        roles: tuple[dict, dict] = ({}, {})
-        duplicated_roles: tuple[set, set] = (set(), set())
-        for table_i, table in enumerate(tables):
-            stats = table.find_elements(By.CLASS_NAME, "item")
-            if not stats or len(stats) % 9 != 0:
-                raise RuntimeError(
-                    f"Wrong number of player stats in a table: {len(stats)}"
-                )
-            stats = stats[:-9]
-
-            for player_i in range(len(stats) // 9):
-                (
-                    player_elem,
-                    role_elem,
-                    god_elem,
-                    kills_elem,
-                    deaths_elem,
-                    assists_elem,
-                    gpm_elem,
-                    relic_elems,
-                    item_elems,
-                ) = stats[player_i * 9 : (player_i + 1) * 9]
-                player, role, god, kills, deaths, assists = (
-                    text(player_elem),
-                    text(role_elem),
-                    text(god_elem),
-                    int(kills_elem.text),
-                    int(deaths_elem.text),
-                    int(assists_elem.text),
-                )
-                role = fix_role(role)
-                relics = [
-                    item(x) for x in relic_elems.find_elements(By.TAG_NAME, "img")
-                ]
-                items = [item(x) for x in item_elems.find_elements(By.TAG_NAME, "img")]
-                # Optional values: year, season.
-                new_build = {
-                    "league": match.league.name,
-                    "phase": match.phase,
-                    "month": match.month,
-                    "day": match.day,
-                    "game_i": game_i,
-                    "match_id": match.id,
-                    "win": wins[table_i],
-                    "hours": hours,
-                    "minutes": minutes,
-                    "seconds": seconds,
-                    "kda_ratio": kda_ratio(kills, deaths, assists),
-                    "kills": kills,
-                    "deaths": deaths,
-                    "assists": assists,
-                    "role": role,
-                    "team1": teams[table_i],
-                    "team2": teams[1 - table_i],
-                    "relics": relics,
-                    "items": items,
-                    "player1": player,
-                    "god1": god,
-                }
-                builds[table_i].append(new_build)
-                if role in roles[table_i]:
-                    duplicated_roles[table_i].add(role)
-                roles[table_i][role] = new_build
-
-        # Remove duplicated (or morecated) roles,
-        # so that opponent gets set to Missing data.
-        for table_i in range(2):
-            for duplicated_role in duplicated_roles[table_i]:
-                del roles[table_i][duplicated_role]
-
-        for table_i in range(2):
-            for build in builds[table_i]:
-                if opp := roles[1 - table_i].get(build["role"]):
-                    build["player2"] = opp["player1"]
-                    build["god2"] = opp["god1"]
-                else:
-                    build["player2"] = "Missing data"
-                    build["god2"] = "Missing data"
-                logger.debug(f"Build scraped|{json.dumps(build)}")
+    if rate_limiter is not None:
+        rate_limiter.wait()
+    with TIMINGS.span("match_page", match_id=match.id):
+        driver.get(match.url)
+        games = MATCH_PAGE_TIMEOUT.wait_until(driver, get_game_buttons) or []
 
-        builds_all.extend(builds[0])
-        builds_all.extend(builds[1])
-        delay(0.5, start)
+    game_data = None
+    pages: list[str] = []
+    try:
+        for game_i, game in enumerate(games, 1):
+            with TIMINGS.span("game", match_id=match.id, game_i=game_i):
+                game_data = scrape_game(driver, match, game_i, game, game_data)
+                pages.append(driver.page_source)
+                builds_all.extend(convert_game_data(game_data, match, game_i))
+    finally:
+        # Also when the conversion fails, so that it can be fixed and replayed.
+        if pages:
+            archive_match_pages(match, pages)
 
     if not builds_all:
         # For debugging in case it is not reproducible.
@@ -359,6 +1022,178 @@ def scrape_match(driver: WebDriver, match: Match) -> list[dict]:
     return builds_all
 
 
+def scrape_game(
+    driver: WebDriver,
+    match: Match,
+    game_i: int,
+    game: WebElement,
+    prev_game_data: dict | None,
+) -> dict:
+    game.click()
+    # Also makes sure that the tables already show the clicked game.
+    game_data = GAME_TIMEOUT.wait_until(
+        driver, lambda driver: get_loaded_game_data(driver, prev_game_data)
+    )
+    if game_data is None:
+        # The checks in convert_game_data then say what is wrong.
+        logger.warning(f"Game stats did not load in time: {match.id}, {game_i}")
+        game_data = get_game_data(driver)
+    return game_data
+
+
+def get_game_buttons(driver: WebDriver) -> list[WebElement] | None:
+    # Sometimes the match page is just a single h1 element saying there are no
+    # stats, so this code attempts to idenfity this situation to avoid a false
+    # positive Scraped zero builds exception.
+    for no_stats in driver.find_elements(By.CSS_SELECTOR, ".match-details h1"):
+        if text(no_stats) == NO_STATS_MESSAGE:
+            raise NoStats()
+    return driver.find_elements(By.CLASS_NAME, "game-btn") or None
+
+
+# Everything needed from the page of a game, so that it's all read in one round trip,
+# instead of a few for every stat.
+GET_GAME_DATA_JS = """
+const info = document.getElementsByClassName("content-wrapper")[1];
+const tables = document.getElementsByClassName("c-PlayerStatsTable");
+const byClass = (elem, className) => [...elem.getElementsByClassName(className)];
+const byTag = (elem, tagName) => [...elem.getElementsByTagName(tagName)];
+return {
+    teams: info ? byTag(info, "strong").map(elem => elem.textContent) : [],
+    game_duration: info && byClass(info, "game-duration")[0]?.textContent,
+    team_score: info && byClass(info, "team-score")[0]?.innerText.trim(),
+    tables: [...tables].map(table => byClass(table, "item").map(cell => ({
+        text: cell.textContent,
+        images: byTag(cell, "img").map(img => [img.alt, img.src]),
+    }))),
+};
+"""
+
+
+def get_game_data(driver: WebDriver) -> dict:
+    return driver.execute_script(GET_GAME_DATA_JS)
+
+
+def get_loaded_game_data(driver: WebDriver, prev_game_data: dict | None) -> dict | None:
+    """Once both tables are fully loaded and differ from the last game."""
+    game_data = get_game_data(driver)
+    tables = game_data["tables"]
+    if len(tables) != 2 or any(not stats or len(stats) % 9 for stats in tables):
+        return None
+    if prev_game_data is not None and tables == prev_game_data["tables"]:
+        return None
+    return game_data
+
+
+def convert_game_data(game_data: dict, match: Match, game_i: int) -> list[dict]:
+    # Find out teams, game length & which team won.
+    if len(game_data["teams"]) < 2 or game_data["game_duration"] is None:
+        raise RuntimeError(f"Could not find teams or game length: {game_data}")
+    teams = (game_data["teams"][0], game_data["teams"][1])
+    hours, minutes, seconds = parse_game_length(game_data["game_duration"])
+    win_or_loss = game_data["team_score"]
+    if win_or_loss == "W":
+        wins = (True, False)
+    elif win_or_loss == "L":
+        wins = (False, True)
+    else:
+        raise RuntimeError(f"Could not ascertain victory or loss: {win_or_loss}")
+
+    # Get everything else.
+    tables = game_data["tables"]
+    if len(tables) != 2:
+        raise RuntimeError(f"Wrong number of tables with player stats: {len(tables)}")
+    builds: tuple[list[dict], list[dict]] = ([], [])
+    for table_i, stats in enumerate(tables):
+        if not stats or len(stats) % 9 != 0:
+            raise RuntimeError(f"Wrong number of player stats in a table: {len(stats)}")
+        stats = stats[:-9]
+
+        for player_i in range(len(stats) // 9):
+            (
+                player_cell,
+                role_cell,
+                god_cell,
+                kills_cell,
+                deaths_cell,
+                assists_cell,
+                gpm_cell,
+                relic_cell,
+                item_cell,
+            ) = stats[player_i * 9 : (player_i + 1) * 9]
+            player, role, god, kills, deaths, assists = (
+                player_cell["text"],
+                role_cell["text"],
+                god_cell["text"],
+                int(kills_cell["text"]),
+                int(deaths_cell["text"]),
+                int(assists_cell["text"]),
+            )
+            role = fix_role(role)
+            relics = [item(*image) for image in relic_cell["images"]]
+            items = [item(*image) for image in item_cell["images"]]
+            # Optional values: year, season.
+            new_build = {
+                "league": match.league.name,
+                "phase": match.phase,
+                "month": match.month,
+                "day": match.day,
+                "game_i": game_i,
+                "match_id": match.id,
+                "win": wins[table_i],
+                "hours": hours,
+                "minutes": minutes,
+                "seconds": seconds,
+                "kda_ratio": kda_ratio(kills, deaths, assists),
+                "kills": kills,
+                "deaths": deaths,
+                "assists": assists,
+                "role": role,
+                "team1": teams[table_i],
+                "team2": teams[1 - table_i],
+                "relics": relics,
+                "items": items,
+                "player1": player,
+                "god1": god,
+            }
+            builds[table_i].append(new_build)
+
+    set_opponents(builds)
+    for build in builds[0] + builds[1]:
+        logger.debug(f"Build scraped|{json.dumps(build)}")
+
+    return builds[0] + builds[1]
+
+
+def set_opponents(builds: tuple[list[dict], list[dict]]) -> None:
+    """
+    Sets player2 and god2 of the builds of both teams to the opponent in the same role.
+    Used both for the scraped games and the games from the matchstats API.
+    """
+    roles: tuple[dict, dict] = ({}, {})
+    duplicated_roles: tuple[set, set] = (set(), set())
+    for team_i in range(2):
+        for build in builds[team_i]:
+            if build["role"] in roles[team_i]:
+                duplicated_roles[team_i].add(build["role"])
+            roles[team_i][build["role"]] = build
+
+    # Remove duplicated (or morecated) roles,
+    # so that opponent gets set to Missing data.
+    for team_i in range(2):
+        for duplicated_role in duplicated_roles[team_i]:
+            del roles[team_i][duplicated_role]
+
+    for team_i in range(2):
+        for build in builds[team_i]:
+            if opp := roles[1 - team_i].get(build["role"]):
+                build["player2"] = opp["player1"]
+                build["god2"] = opp["god1"]
+            else:
+                build["player2"] = "Missing data"
+                build["god2"] = "Missing data"
+
+
 def fix_role(role: str) -> str:
     return "ADC" if role in ["Carry", "Hunter"] else role
 
@@ -399,9 +1234,7 @@ def text(elem: WebElement) -> str:
     return elem.get_attribute("textContent")
 
 
-def item(elem: WebElement) -> tuple[str, str]:
-    name = elem.get_attribute("alt")
-    img_url = elem.get_attribute("src")
+def item(name: str, img_url: str) -> tuple[str, str]:
     last_slash_i, image_name = split_on_last_slash(img_url)
     if not check_url_still_same(IMG_URL, img_url, last_slash_i):
         logger.warning(f"Unknown image URL|{img_url}")
@@ -426,11 +1259,333 @@ def parse_game_length(game_length: str) -> tuple[int, int, int]:
     return hours, minutes, seconds
 
 
+# --------------------------------------------------------------------------------------
+# PAGE ARCHIVE
+# --------------------------------------------------------------------------------------
+
+
+# The rendered page of every scraped game, so that the builds can be extracted again
+# without the browser, see tools/replay_archive.py.
+PAGE_ARCHIVE_DIR = STORAGE_DIR / "page_archive"
+
+
+def archive_match_pages(match: Match, pages: list[str]) -> None:
+    """
+    Every page is compressed and stored under its SHA-256, so identical pages are
+    stored only once, and the match lists the pages of its games. Failures are only
+    logged, the builds are posted anyway.
+    """
+    try:
+        digests = [archive_page(page) for page in pages]
+        match_dict = {
+            "league": match.league.name,
+            "phase": match.phase,
+            "month": match.month,
+            "day": match.day,
+            "id": match.id,
+            "url": match.url,
+            "pages": digests,
+        }
+        match_path = get_archived_match_path(match.league.name, match.id)
+        write_atomically(match_path, json.dumps(match_dict).encode("utf8"))
+    except Exception:
+        logger.exception(f"Failed to archive pages: {match.id}|")
+
+
+def archive_page(page: str) -> str:
+    """Returns the digest of the page."""
+    page_bytes = page.encode("utf8")
+    digest = hashlib.sha256(page_bytes).hexdigest()
+    page_path = get_archived_page_path(digest)
+    if not page_path.exists():
+        write_atomically(page_path, zstandard.ZstdCompressor().compress(page_bytes))
+    return digest
+
+
+def get_archived_match_path(league_name: str, match_id: int) -> Path:
+    return PAGE_ARCHIVE_DIR / "matches" / f"{league_name}_{match_id}.json"
+
+
+def get_archived_page_path(digest: str) -> Path:
+    return PAGE_ARCHIVE_DIR / "pages" / digest[:2] / f"{digest}.html.zst"
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Per thread, since browsers in the pool can scrape the same page at once.
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}~")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+
+
+# --------------------------------------------------------------------------------------
+# MATCHSTATS API
+# --------------------------------------------------------------------------------------
+
+# The same data as on the match pages, but as JSON and without waiting for the browser.
+MATCHSTATS_URL = "https://esports.hirezstudios.com/esportsAPI/smite/matchstats"
+ITEMS_URL = "https://cms.smitegame.com/wp-json/smite-api/getItems/1"
+WRONG_EVENT_ERROR = "Match does not belong to this event."
+# The event IDs are not on the schedule, so they are found by trying them one by one,
+# starting a bit before the last found one, and remembered per league and phase.
+MATCHSTATS_EVENT_IDS_FILE = STORAGE_DIR / "matchstats_event_ids.json"
+FIRST_EVENT_ID = 7250
+EVENT_ID_SEARCH_BACK = 20
+EVENT_ID_SEARCH_RANGE = 300
+MATCHSTATS_DELAY = 0.1
+# Items which are no longer returned by the items API.
+REMOVED_ITEM_IMAGE_NAMES = {
+    "Jotunn's Ferocity": "jotunns-ferocity.jpg",
+    "Nimble Rod of Tahuti": "nimble-rod-of-tahuti.jpg",
+}
+
+
+class MatchstatsClient:
+    """Can be shared by threads, but then it makes only one request at a time."""
+
+    def __init__(
+        self,
+        matchstats_url: str = MATCHSTATS_URL,
+        items_url: str = ITEMS_URL,
+        event_ids_file: Path = MATCHSTATS_EVENT_IDS_FILE,
+        request_delay: float = MATCHSTATS_DELAY,
+    ) -> None:
+        self.matchstats_url = matchstats_url
+        self.items_url = items_url
+        self.event_ids_file = event_ids_file
+        self.request_delay = request_delay
+        # Keeps the connections open between the requests.
+        self.session = requests.Session()
+        self.event_ids: dict[str, int] = {}
+        if event_ids_file.exists():
+            self.event_ids = json.loads(event_ids_file.read_text(encoding="utf8"))
+        # So that an unknown event is searched for only once.
+        self.unknown_events: set[str] = set()
+        self.item_image_names: dict[str, str] | None = None
+        self.lock = threading.Lock()
+
+    def get_builds(self, match: Match) -> list[dict]:
+        with self.lock:
+            return self.get_builds_inner(match)
+
+    def get_builds_inner(self, match: Match) -> list[dict]:
+        event_key = f"{match.league.name}|{match.phase}"
+        data = None
+        if (event_id := self.event_ids.get(event_key)) is not None:
+            data = self.get_match_stats(event_id, match.id)
+            # The phase names are the same every season.
+            if data.get("error") == WRONG_EVENT_ERROR:
+                data = None
+        if data is None:
+            event_id, data = self.find_event(event_key, match.id)
+        if "error" in data:
+            raise RuntimeError(f"Matchstats error: {data['error']}")
+
+        if self.item_image_names is None:
+            self.item_image_names = self.get_item_image_names()
+        builds = convert_match_stats(
+            data["games"],
+            match.league.name,
+            match.phase,
+            match.month,
+            match.day,
+            match.id,
+            self.item_image_names,
+        )
+        for build in builds:
+            logger.debug(f"Build scraped|{json.dumps(build)}")
+        return builds
+
+    def find_event(self, event_key: str, match_id: int) -> tuple[int, dict]:
+        if event_key in self.unknown_events:
+            raise RuntimeError(f"Unknown matchstats event: {event_key}")
+        last_event_id = max(self.event_ids.values(), default=FIRST_EVENT_ID)
+        start_event_id = max(last_event_id - EVENT_ID_SEARCH_BACK, FIRST_EVENT_ID)
+        logger.info(f"Searching for matchstats event: {event_key}")
+        for event_id in range(start_event_id, start_event_id + EVENT_ID_SEARCH_RANGE):
+            data = self.get_match_stats(event_id, match_id)
+            if data.get("error") != WRONG_EVENT_ERROR:
+                # Can also be e.g. {"error":"Match not found."}, which is not saved.
+                if "error" not in data:
+                    self.event_ids[event_key] = event_id
+                    self.event_ids_file.write_text(
+                        json.dumps(self.event_ids, indent=2), encoding="utf8"
+                    )
+                return event_id, data
+        self.unknown_events.add(event_key)
+        raise RuntimeError(f"Unknown matchstats event: {event_key}")
+
+    def get_match_stats(self, event_id: int, match_id: int) -> dict:
+        start = time.time()
+        resp = self.session.get(f"{self.matchstats_url}/{event_id}/{match_id}")
+        raise_for_status_with_detail(resp)
+        delay(self.request_delay, start)
+        return resp.json()
+
+    def get_item_image_names(self) -> dict[str, str]:
+        resp = self.session.get(self.items_url)
+        raise_for_status_with_detail(resp)
+        return parse_item_image_names(resp.json())
+
+
+def parse_item_image_names(all_items: list[dict]) -> dict[str, str]:
+    item_image_names = {}
+    for item_dict in all_items:
+        img_url = item_dict["itemIcon_URL"]
+        last_slash_i, image_name = split_on_last_slash(img_url)
+        if not check_url_still_same(IMG_URL, img_url, last_slash_i):
+            raise RuntimeError(f"Unknown image URL: {img_url}")
+        item_image_names[item_dict["DeviceName"]] = image_name
+    return item_image_names
+
+
+def convert_match_stats(
+    games: list[dict],
+    league: str,
+    phase: str,
+    month: int,
+    day: int,
+    match_id: int,
+    item_image_names: dict[str, str],
+) -> list[dict]:
+    """Converts the games from the matchstats API into the builds from scrape_match."""
+    builds_all = []
+    for game_i, game in enumerate(games, 1):
+        hours, minutes, seconds = parse_game_length(game["game_duration"])
+        teams = (game["team_totals"][0]["team"], game["team_totals"][1]["team"])
+        if game["winning_team"] not in [0, 1]:
+            raise RuntimeError(f"Unknown winning_team: {game['winning_team']}")
+
+        builds: tuple[list[dict], list[dict]] = ([], [])
+        for player in game["players"]:
+            team_i = teams.index(player["team"])
+            kills, deaths, assists = (
+                player["kills"],
+                player["deaths"],
+                player["assists"],
+            )
+            role = fix_role(player["role"])
+            new_build = {
+                "league": league,
+                "phase": phase,
+                "month": month,
+                "day": day,
+                "game_i": game_i,
+                "match_id": match_id,
+                "win": game["winning_team"] == team_i,
+                "hours": hours,
+                "minutes": minutes,
+                "seconds": seconds,
+                "kda_ratio": kda_ratio(kills, deaths, assists),
+                "kills": kills,
+                "deaths": deaths,
+                "assists": assists,
+                "role": role,
+                "team1": teams[team_i],
+                "team2": teams[1 - team_i],
+                "relics": convert_items(player["relics"], item_image_names),
+                "items": convert_items(player["build"], item_image_names),
+                "player1": player["name"],
+                "god1": player["god"],
+            }
+            builds[team_i].append(new_build)
+
+        set_opponents(builds)
+        builds_all.extend(builds[0])
+        builds_all.extend(builds[1])
+    return builds_all
+
+
+def convert_items(
+    names: list[str], item_image_names: dict[str, str]
+) -> list[tuple[str, str]]:
+    items = []
+    for name in names:
+        if name == "null":
+            continue
+        elif name in item_image_names:
+            image_name = item_image_names[name]
+        elif name in REMOVED_ITEM_IMAGE_NAMES:
+            image_name = REMOVED_ITEM_IMAGE_NAMES[name]
+        else:
+            raise RuntimeError(f"Unknown item: {name}")
+        items.append((name, image_name))
+    return items
+
+
 # --------------------------------------------------------------------------------------
 # OTHER
 # --------------------------------------------------------------------------------------
 
 
+def wait_until(
+    driver: WebDriver, timeout: float, condition: t.Callable[[WebDriver], T | None]
+) -> T | None:
+    """Returns the first truthy result of condition, or None after the timeout."""
+    # Otherwise every find_elements, which finds nothing, would take IMPLICIT_WAIT.
+    driver.implicitly_wait(0)
+    try:
+        return WebDriverWait(
+            driver,
+            timeout,
+            poll_frequency=WAIT_POLL_FREQUENCY,
+            ignored_exceptions=[sel_exc.StaleElementReferenceException],
+        ).until(condition)
+    except sel_exc.TimeoutException:
+        return None
+    finally:
+        driver.implicitly_wait(IMPLICIT_WAIT)
+
+
+class AdaptiveTimeout:
+    """
+    Waits at most a few times longer than the slowest recent successful wait,
+    so that a page which never gets ready doesn't always take the whole max_timeout.
+    Can be shared by threads.
+    """
+
+    def __init__(self, min_timeout: float, max_timeout: float) -> None:
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.durations: collections.deque[float] = collections.deque(maxlen=20)
+
+    def get(self) -> float:
+        if not self.durations:
+            return self.max_timeout
+        timeout = ADAPTIVE_TIMEOUT_FACTOR * max(self.durations)
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+    def wait_until(
+        self, driver: WebDriver, condition: t.Callable[[WebDriver], T | None]
+    ) -> T | None:
+        start = time.monotonic()
+        result = wait_until(driver, self.get(), condition)
+        if result is not None:
+            self.durations.append(time.monotonic() - start)
+        return result
+
+
+# Previously a fixed 3 x 5 seconds for the match page and 0.5 seconds for every game.
+MATCH_PAGE_TIMEOUT = AdaptiveTimeout(min_timeout=5, max_timeout=15)
+GAME_TIMEOUT = AdaptiveTimeout(min_timeout=2, max_timeout=10)
+
+
+class RateLimiter:
+    """Spaces out the calls of wait (from all threads) by at least interval seconds."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_time, now)
+            self.next_time = wait_until + self.interval
+        time.sleep(wait_until - now)
+
+
 @dataclasses.dataclass
 class MatchCount:
     old = 0
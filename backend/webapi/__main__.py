@@ -1,7 +1,9 @@
 import os
 import sys
+import threading
 
 from backend.config import load_webapi_config
+from backend.webapi.post_builds.ingest_worker import run_ingest_worker
 from backend.webapi.tools.migrate_db import migrate_db
 from backend.webapi.tools.prepare_storage import prepare_storage
 from backend.webapi.webapi import app, logger, setup_webapi_logging
@@ -12,10 +14,15 @@ migrate_db()
 load_webapi_config()
 setup_webapi_logging()
 host, port = "localhost", 4000
+reloader = len(sys.argv) < 2
 
 if not os.environ.get("BOTTLE_CHILD"):
     logger.info(f"Starting server: http://{host}:{port}/")
 else:
     logger.info("Reloader detected")
 
-app.run(host=host, port=port, reloader=len(sys.argv) < 2, debug=True)
+# With the reloader, only the child process serves requests.
+if not reloader or os.environ.get("BOTTLE_CHILD"):
+    threading.Thread(target=run_ingest_worker, daemon=True).start()
+
+app.run(host=host, port=port, reloader=reloader, debug=True)
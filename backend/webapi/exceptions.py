@@ -2,3 +2,9 @@ class MyValidationError(Exception):
     """Used to signify validation errors (which can't be caught by pydantic)."""
 
     pass
+
+
+class BodyTooLargeError(Exception):
+    """Request body is too large, even though it can be small before decompression."""
+
+    pass
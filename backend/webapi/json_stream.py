@@ -0,0 +1,132 @@
+"""
+Incremental parsing of a JSON object, whose one (big) array is handed over item by item
+as the chunks of the body arrive, instead of having to be all in memory at once.
+The other values are parsed normally, with the standard json decoder.
+"""
+
+import codecs
+import json
+import re
+import typing as t
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_CHARS = "0123456789+-.eE"
+# Any single value (including whitespace) bigger than this is considered invalid,
+# since it's re-parsed on every new chunk until it's complete.
+MAX_VALUE_SIZE = 1024 * 1024
+
+
+class _Reader:
+    def __init__(self, chunks: t.Iterator[bytes]) -> None:
+        self.chunks = chunks
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self) -> bool:
+        """Returns False at the end of the input."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            new_text = self.decoder.decode(b"", final=True)
+        else:
+            new_text = self.decoder.decode(chunk)
+        # The parsed text is dropped, so the buffer stays small.
+        self.text = self.text[self.pos :] + new_text
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character, or "" at the end of the input."""
+        while True:
+            match = WHITESPACE.match(self.text, self.pos)
+            assert match is not None
+            self.pos = match.end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            expected = " or ".join(repr(c) for c in chars)
+            raise json.JSONDecodeError(f"Expecting {expected}", self.text, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self) -> t.Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.text, self.pos)
+                if not self.might_continue(value, end):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if len(self.text) - self.pos > MAX_VALUE_SIZE:
+                raise json.JSONDecodeError("Value too big", self.text, self.pos)
+            self.read_more()
+
+    def might_continue(self, value: t.Any, end: int) -> bool:
+        """E.g. "1.5e3" split into chunks can be parsed as 1 or 1.5."""
+        if self.eof:
+            return False
+        if end == len(self.text):
+            return True
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        return is_number and self.text[end] in NUMBER_CHARS
+
+
+def parse_object_stream(
+    chunks: t.Iterator[bytes], array_key: str, on_item: t.Callable[[t.Any], None]
+) -> dict[str, t.Any]:
+    """
+    Calls on_item for every item of the array under array_key and returns the rest
+    of the object. The array itself is replaced by the number of its items.
+    Raises the same errors as json.loads (on invalid JSON or UTF-8).
+    """
+    reader = _Reader(chunks)
+    result: dict[str, t.Any] = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError(
+                    "Expecting property name enclosed in double quotes",
+                    reader.text,
+                    reader.pos,
+                )
+            reader.expect(":")
+            if key == array_key:
+                result[key] = parse_array(reader, on_item)
+            else:
+                result[key] = reader.value()
+            if reader.expect(",}") == "}":
+                break
+
+    if reader.peek():
+        raise json.JSONDecodeError("Extra data", reader.text, reader.pos)
+    return result
+
+
+def parse_array(reader: _Reader, on_item: t.Callable[[t.Any], None]) -> int:
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return 0
+    item_count = 0
+    while True:
+        on_item(reader.value())
+        item_count += 1
+        if reader.expect(",]") == "]":
+            return item_count
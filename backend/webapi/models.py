@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import datetime
 import enum
+import os
 import typing as t
+from pathlib import Path
 
 import sqlalchemy as sa
 import sqlalchemy.orm as sao
@@ -17,6 +19,8 @@ class DbVersion(enum.Enum):
     ADD_GOD_CLASS = "3.add_god_class"
     ADD_IMAGE_TABLE = "4.add_image_table"
     CASCADE_DEL_BUILD_ITEMS = "5.cascade_del_build_items"
+    ADD_IMAGE_DHASH = "6.add_image_dhash"
+    ADD_BUILD_PHASE_INDEX = "7.add_build_phase_index"
 
     def __init__(self, value: str) -> None:
         self.index = int(value.split(".", 1)[0])
@@ -24,7 +28,8 @@ class DbVersion(enum.Enum):
 
 CURRENT_DB_VERSION = list(DbVersion)[-1]
 
-db_path = STORAGE_DIR / "backend.db"
+# Can be overridden, e.g. for benchmarks with a generated database.
+db_path = Path(os.environ.get("BACKEND_DB_PATH", STORAGE_DIR / "backend.db"))
 db_engine = sa.create_engine(url=f"sqlite+pysqlite:///{db_path}")
 session_maker = sao.sessionmaker(bind=db_engine)
 # Thread-local session automatically created on first use.
@@ -67,6 +72,8 @@ class Image(Base):
     id: sao.Mapped[int] = sao.mapped_column(primary_key=True, init=False)
     # Uniqueness is enforced on the application side, to save on database size.
     data: sao.Mapped[bytes] = sao.mapped_column(sa.LargeBinary)
+    # Perceptual hash, so that visually identical images can be reused too.
+    dhash: sao.Mapped[int | None] = sao.mapped_column(sa.BigInteger(), default=None)
 
 
 class Item(Base):
@@ -140,6 +147,8 @@ indices = [
         Build.player1,
         unique=True,
     ),
+    # Covers the known matches of the updater, so they are read only from the index.
+    sa.Index("ix_build_phase_match_id", Build.phase, Build.match_id),
 ]
 
 
@@ -44,3 +44,25 @@ def log_curr_game(build: dict) -> t.Iterator[None]:
         raise
     finally:
         auto_fixes_game_context.set(auto_fixes_game_context_default)
+
+
+class WarningsCollector(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.warnings: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Filters of other handlers might not have run yet, so no record.game.
+        game = auto_fixes_game_context.get()
+        self.warnings.append(f"{game}|{record.getMessage()}")
+
+
+@contextlib.contextmanager
+def collect_auto_fixes_warnings() -> t.Iterator[list[str]]:
+    """Collects warnings (i.e. inconsistencies which require manual fixing)."""
+    collector = WarningsCollector()
+    auto_fixes_logger.addHandler(collector)
+    try:
+        yield collector.warnings
+    finally:
+        auto_fixes_logger.removeHandler(collector)
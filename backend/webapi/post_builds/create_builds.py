@@ -1,7 +1,9 @@
+import collections
 import datetime as dt
 import unicodedata
 
 import sqlalchemy as sa
+import sqlalchemy.dialects.sqlite as sqlite
 
 from backend.webapi.exceptions import MyValidationError
 from backend.webapi.models import Build, db_session
@@ -12,8 +14,60 @@ from backend.webapi.post_builds.fix_gods import add_god_classes, fix_gods
 from backend.webapi.post_builds.fix_roles import fix_roles
 from backend.webapi.post_builds.hirez_api import GodInfo
 
+BuildKey = tuple[int, int, str]
+# SQLite has a limit on the number of bound parameters.
+MATCH_IDS_PER_QUERY = 500
 
-def create_builds(god_info: GodInfo, build_dicts: list[BuildDict]) -> list[Build]:
+
+def skip_stored_games(build_dicts: list[BuildDict]) -> tuple[list[BuildDict], int]:
+    """
+    Makes reposting (e.g. replaying a log) cheap, by skipping games which are already
+    stored before any images are downloaded. Games which are stored only partially
+    (i.e. there are new builds in them) are kept whole, since fixing roles needs
+    the whole game. Their stored builds are then skipped when inserting.
+    """
+    stored_build_keys = get_stored_build_keys({b["match_id"] for b in build_dicts})
+
+    game_to_builds = collections.defaultdict(list)
+    for build_dict in build_dicts:
+        game_to_builds[(build_dict["match_id"], build_dict["game_i"])].append(
+            build_dict
+        )
+
+    new_build_dicts: list[BuildDict] = []
+    skipped_games = 0
+    for game_builds in game_to_builds.values():
+        if all(get_build_key(b) in stored_build_keys for b in game_builds):
+            skipped_games += 1
+        else:
+            new_build_dicts.extend(game_builds)
+
+    return new_build_dicts, skipped_games
+
+
+def get_stored_build_keys(match_ids: set[int]) -> set[BuildKey]:
+    match_ids_lst = sorted(match_ids)
+    stored_build_keys = set()
+    for i in range(0, len(match_ids_lst), MATCH_IDS_PER_QUERY):
+        rows = db_session.execute(
+            sa.select(Build.match_id, Build.game_i, Build.player1).where(
+                Build.match_id.in_(match_ids_lst[i : i + MATCH_IDS_PER_QUERY])
+            )
+        ).all()
+        for match_id, game_i, player1 in rows:
+            stored_build_keys.add((match_id, game_i, player1.upper()))
+    return stored_build_keys
+
+
+def get_build_key(build_dict: BuildDict) -> BuildKey:
+    # Same as the unique index, with the player name normalized like in
+    # fix_player_name.
+    player1 = remove_accents(build_dict["player1"]).upper()
+    return build_dict["match_id"], build_dict["game_i"], player1
+
+
+def create_builds(god_info: GodInfo, build_dicts: list[BuildDict]) -> list[int | None]:
+    """Returns the IDs of the new builds (None for builds which were already stored)."""
     player_names = {
         player_name.upper(): player_name
         for player_name in db_session.scalars(sa.select(Build.player1).distinct()).all()
@@ -61,13 +115,26 @@ def create_builds(god_info: GodInfo, build_dicts: list[BuildDict]) -> list[Build
     fix_gods(build_dicts, god_info.newest_god)
     add_god_classes(build_dicts, god_info.god_classes)
 
-    builds = [Build(**build_dict) for build_dict in build_dicts]
+    return insert_builds(build_dicts)
 
-    for build in builds:
-        db_session.add(build)
-    db_session.flush()
 
-    return builds
+def insert_builds(build_dicts: list[BuildDict]) -> list[int | None]:
+    if not build_dicts:
+        return []
+    rows = db_session.execute(
+        sqlite.insert(Build)
+        .on_conflict_do_nothing()
+        .returning(Build.id, Build.match_id, Build.game_i, Build.player1),
+        build_dicts,
+    ).all()
+    key_to_id = {
+        (match_id, game_i, player1): id_ for id_, match_id, game_i, player1 in rows
+    }
+    # Pop, so that duplicated builds in the same batch are skipped too.
+    return [
+        key_to_id.pop((b["match_id"], b["game_i"], b["player1"]), None)
+        for b in build_dicts
+    ]
 
 
 def fix_player_name(player_names: dict[str, str], player_name_with_accents: str) -> str:
@@ -1,22 +1,30 @@
 import base64
+import concurrent.futures as cf
 import dataclasses as dc
+import os
+import threading
 import typing as t
 
 import sqlalchemy as sa
 
 from backend.config import get_webapi_config
 from backend.webapi.get_builds import EVOLVED_PREFIX, GREATER_PREFIX, UPGRADE_SUFFIX
-from backend.webapi.models import Build, BuildItem, Image, Item, db_session
+from backend.webapi.models import BuildItem, Image, Item, db_session
 from backend.webapi.post_builds.auto_fixes_logger import auto_fixes_logger as logger
 from backend.webapi.post_builds.auto_fixes_logger import log_curr_game
+from backend.webapi.post_builds.image_hashes import BkTree
 from backend.webapi.post_builds.images import (
-    compress_image_ignore_errors,
+    compress_and_hash_image,
+    get_compressed_image_ignore_errors,
     get_image_or_none,
     save_icon_to_archive,
 )
 
 BuildDict = dict[str, t.Any]
 
+_compress_pool: cf.ProcessPoolExecutor | None = None
+_compress_pool_lock = threading.Lock()
+
 
 @dc.dataclass(frozen=True)
 class ItemKey:
@@ -64,22 +72,73 @@ class ItemWip:
     key: ItemKey
     image_name: str
     image_data: bytes | None
+    compressed_image_data: bytes | None
+    was_compressed: bool
+    image_dhash: int | None
 
 
 def create_item_wips(item_keys: list[ItemKey]) -> list[ItemWip]:
     """
-    Downloads item images from the Hi-Rez CDN.
+    Downloads item images from the Hi-Rez CDN and compresses them.
     Done separately here, so that the database inserts/locks are not intertwined with
     the image downloading / sleeping.
+    Compression is CPU-bound, so it runs in a process pool, while the next images are
+    being downloaded.
+    """
+    downloads = [download_image(item_key) for item_key in item_keys]
+    return [create_item_wip(*download) for download in downloads]
+
+
+def submit_compression(image_data: bytes) -> cf.Future[tuple[bytes, bool, int]]:
     """
-    item_wips = [create_item_wip(item_key) for item_key in item_keys]
-    return item_wips
+    The pool is started only once there is an image to compress, and then kept for
+    as long as the process (e.g. the ingest worker) runs, since starting it is slow.
+    """
+    global _compress_pool
+    with _compress_pool_lock:
+        if _compress_pool is None:
+            _compress_pool = cf.ProcessPoolExecutor(max_workers=os.cpu_count())
+        try:
+            return _compress_pool.submit(compress_and_hash_image, image_data)
+        except cf.process.BrokenProcessPool:
+            # E.g. one of its processes was killed, then it cannot be used anymore.
+            _compress_pool.shutdown(wait=False)
+            _compress_pool = cf.ProcessPoolExecutor(max_workers=os.cpu_count())
+            return _compress_pool.submit(compress_and_hash_image, image_data)
+
 
+Download = tuple[ItemKey, str, bytes | None, cf.Future[tuple[bytes, bool, int]] | None]
 
-def create_item_wip(item_key: ItemKey) -> ItemWip:
+
+def download_image(item_key: ItemKey) -> Download:
     image_name, image_data = get_image_data(item_key.name, item_key.image_name)
-    item_wip = ItemWip(item_key, image_name, image_data)
-    return item_wip
+    if image_data is None:
+        return item_key, image_name, None, None
+    future = submit_compression(image_data)
+    return item_key, image_name, image_data, future
+
+
+def create_item_wip(
+    item_key: ItemKey,
+    image_name: str,
+    image_data: bytes | None,
+    future: cf.Future[tuple[bytes, bool, int]] | None,
+) -> ItemWip:
+    if image_data is None or future is None:
+        return ItemWip(item_key, image_name, None, None, False, None)
+    (
+        compressed_image_data,
+        was_compressed,
+        image_dhash,
+    ) = get_compressed_image_ignore_errors(image_name, image_data, future)
+    return ItemWip(
+        item_key,
+        image_name,
+        image_data,
+        compressed_image_data,
+        was_compressed,
+        image_dhash,
+    )
 
 
 def get_image_data(name: str, image_name: str) -> tuple[str, bytes | None]:
@@ -138,23 +197,34 @@ def fix_image_name(name: str, image_name: str) -> str:
 
 
 def get_or_create_items(item_wips: list[ItemWip]) -> list[Item]:
-    items = [get_or_create_item(item_wip) for item_wip in item_wips]
+    image_tree = load_image_tree()
+    items = [get_or_create_item(item_wip, image_tree) for item_wip in item_wips]
     return items
 
 
-def get_or_create_item(item_wip: ItemWip) -> Item:
-    if item_wip.image_data is None:
-        logger.warning(f"Missing image: {item_wip.image_name}")
-        image_id = None
-    else:
-        image_id, was_new_image = get_or_create_image(
-            item_wip.image_name, item_wip.image_data
-        )
+def load_image_tree() -> BkTree:
+    image_tree = BkTree()
+    image_hashes = db_session.execute(
+        sa.select(Image.id, Image.dhash).where(Image.dhash.is_not(None))
+    )
+    for image_id, image_dhash in image_hashes:
+        image_tree.add(image_dhash, image_id)
+    return image_tree
+
 
+def get_or_create_item(item_wip: ItemWip, image_tree: BkTree) -> Item:
     modified_name, name_was_modified = modify_item_name(
         item_wip.key.is_relic, item_wip.key.name
     )
 
+    if item_wip.image_data is None or item_wip.compressed_image_data is None:
+        logger.warning(f"Missing image: {item_wip.image_name}")
+        image_id, was_new_image = None, False
+    else:
+        image_id, was_new_image = get_or_create_image(
+            item_wip, modified_name, name_was_modified, image_tree
+        )
+
     item = db_session.scalars(
         sa.select(Item).where(
             Item.is_relic == item_wip.key.is_relic,
@@ -185,40 +255,80 @@ def get_or_create_item(item_wip: ItemWip) -> Item:
         new_image = db_session.scalars(
             sa.select(Image).where(Image.id == image_id)
         ).one()
+        # The item has to be unlinked first, otherwise the foreign key check fails.
+        new_item.image_id = None
+        db_session.flush()
         new_image.id = new_item.id
         new_item.image_id = new_item.id
         db_session.flush()
 
-    return new_item
-
-
-def get_or_create_image(image_name: str, image_data: bytes) -> tuple[int, bool]:
-    compressed_image_data, was_compressed = compress_image_ignore_errors(
-        image_name, image_data
-    )
+    if was_new_image and item_wip.image_dhash is not None:
+        assert new_item.image_id is not None
+        image_tree.add(item_wip.image_dhash, new_item.image_id)
 
-    b64_image_data = base64.b64encode(compressed_image_data)
+    return new_item
 
-    image_id, was_new = get_or_create_image_inner(b64_image_data)
 
-    if was_compressed and was_new:
-        save_icon_to_archive(image_id, image_name, image_data)
+def find_similar_image(
+    item_wip: ItemWip, modified_name: str, name_was_modified: int, image_tree: BkTree
+) -> int | None:
+    """
+    Finds an already stored image, which looks the same as the new one (e.g. the same
+    icon re-encoded by the CDN). Only images of the same item are considered, because
+    different items can have icons which differ only slightly (e.g. relic upgrades).
+    """
+    assert item_wip.image_dhash is not None
+    max_distance = get_webapi_config().image_dhash_max_distance
+    for distance, image_id in image_tree.find(item_wip.image_dhash, max_distance):
+        same_item = db_session.scalars(
+            sa.select(Item.id)
+            .where(
+                Item.is_relic == item_wip.key.is_relic,
+                Item.name == modified_name,
+                Item.name_was_modified == name_was_modified,
+                Item.image_id == image_id,
+            )
+            .limit(1)
+        ).one_or_none()
+        if same_item is not None:
+            msg = f"Image (similar, {distance}): {item_wip.image_name} -> {image_id}"
+            logger.info(msg)
+            return image_id
+    return None
+
+
+def get_or_create_image(
+    item_wip: ItemWip, modified_name: str, name_was_modified: int, image_tree: BkTree
+) -> tuple[int, bool]:
+    assert item_wip.image_data is not None
+    assert item_wip.compressed_image_data is not None
+    b64_image_data = base64.b64encode(item_wip.compressed_image_data)
+
+    image_id = find_image(b64_image_data)
+    if image_id is None and item_wip.image_dhash is not None:
+        image_id = find_similar_image(
+            item_wip, modified_name, name_was_modified, image_tree
+        )
+    if image_id is not None:
+        return image_id, False
 
-    return image_id, was_new
+    image_id = create_image(b64_image_data, item_wip.image_dhash)
+    if item_wip.was_compressed:
+        save_icon_to_archive(image_id, item_wip.image_name, item_wip.image_data)
+    return image_id, True
 
 
-def get_or_create_image_inner(image_data: bytes) -> tuple[int, bool]:
-    image = db_session.scalars(
-        sa.select(Image).where(Image.data == image_data)
+def find_image(image_data: bytes) -> int | None:
+    return db_session.scalars(
+        sa.select(Image.id).where(Image.data == image_data)
     ).one_or_none()
 
-    if image:
-        return image.id, False
-    else:
-        new_image = Image(image_data)
-        db_session.add(new_image)
-        db_session.flush()
-        return new_image.id, True
+
+def create_image(image_data: bytes, image_dhash: int | None) -> int:
+    new_image = Image(image_data, image_dhash)
+    db_session.add(new_image)
+    db_session.flush()
+    return new_image.id
 
 
 def modify_item_name(is_relic: bool, name: str) -> tuple[str, int]:
@@ -233,17 +343,20 @@ def modify_item_name(is_relic: bool, name: str) -> tuple[str, int]:
 
 
 def create_build_items(
-    builds: list[Build], items: list[Item], build_item_wips: list[BuildItemWip]
+    build_ids: list[int | None], items: list[Item], build_item_wips: list[BuildItemWip]
 ) -> None:
     for build_item_wip in build_item_wips:
-        create_build_item(builds, items, build_item_wip)
+        create_build_item(build_ids, items, build_item_wip)
     db_session.flush()
 
 
 def create_build_item(
-    builds: list[Build], items: list[Item], build_item_wip: BuildItemWip
+    build_ids: list[int | None], items: list[Item], build_item_wip: BuildItemWip
 ) -> None:
-    build_id = builds[build_item_wip.build_i].id
+    build_id = build_ids[build_item_wip.build_i]
+    if build_id is None:
+        # The build was already stored.
+        return
     item_id = items[build_item_wip.item_i].id
     build_item = BuildItem(build_id, item_id, build_item_wip.index)
     db_session.add(build_item)
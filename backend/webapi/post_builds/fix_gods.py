@@ -1,6 +1,6 @@
 from backend.webapi.post_builds.auto_fixes_logger import auto_fixes_logger as logger
 from backend.webapi.post_builds.create_items import BuildDict
-from backend.webapi.post_builds.hirez_api import GodClasses, NewestGod
+from backend.webapi.post_builds.hirez_api import GodClasses, GodInfo, NewestGod
 
 
 def fix_gods(builds: list[BuildDict], newest_god: NewestGod | None) -> None:
@@ -35,6 +35,18 @@ def contains_digits(s: str) -> bool:
     return any("0" <= c <= "9" for c in s)
 
 
+def has_unknown_gods(builds: list[BuildDict], god_info: GodInfo) -> bool:
+    """Whether the (cached) god info might be outdated, e.g. due to a new god."""
+    if god_info.god_classes is None:
+        return True
+    for build in builds:
+        if contains_digits(build["god1"]) or contains_digits(build["god2"]):
+            return True
+        if build["god1"] not in god_info.god_classes:
+            return True
+    return False
+
+
 def add_god_classes(builds: list[BuildDict], god_classes: GodClasses | None) -> None:
     if god_classes is None:
         logger.warning("God classes are unknown, cannot add them")
@@ -1,7 +1,10 @@
 import dataclasses as dc
+import datetime as dt
 import enum
 import json
+import threading
 import typing as t
+from pathlib import Path
 
 import charybdis
 
@@ -10,6 +13,12 @@ from backend.shared import STORAGE_DIR
 from backend.webapi.post_builds.auto_fixes_logger import auto_fixes_logger as logger
 
 GODS_PATH = STORAGE_DIR / "gods.json"
+GOD_INFO_PATH = STORAGE_DIR / "god_info.json"
+
+# Forced refreshes are triggered by unknown gods, which can also be just typos on
+# the SPL website, so all refreshes are rate limited by the last attempt (also a
+# failed one), to not call the API on every post (e.g. while the API is down).
+REFRESH_MIN_INTERVAL = dt.timedelta(minutes=10)
 
 
 class GodClass(enum.Enum):
@@ -31,30 +40,102 @@ class GodInfo:
     god_classes: GodClasses | None
 
 
-def get_god_info() -> GodInfo:
-    api = get_api()
+@dc.dataclass
+class CachedGodInfo:
+    god_info: GodInfo
+    fetched_at: dt.datetime
+
+
+_cached_god_info: CachedGodInfo | None = None
+_last_refresh_attempt: dt.datetime | None = None
+_refresh_lock = threading.Lock()
+
+
+def get_god_info(force_refresh: bool = False) -> GodInfo:
+    """
+    Returns the cached god info, so that posting builds does not have to wait for
+    the Hi-Rez API. Stale god info is refreshed in the background.
+    """
+    cached = get_cached_god_info()
+    if cached is None:
+        # Nothing to return in the meantime, so this has to block.
+        if not can_refresh():
+            return get_fallback_god_info()
+        return refresh_god_info()
+
+    age = now_utc() - cached.fetched_at
+    if force_refresh and age >= REFRESH_MIN_INTERVAL and can_refresh():
+        logger.info("Forced god info refresh")
+        return refresh_god_info()
+    if age >= get_webapi_config().god_info_ttl and can_refresh():
+        refresh_god_info_in_background()
+    return cached.god_info
+
+
+def can_refresh() -> bool:
+    return (
+        _last_refresh_attempt is None
+        or now_utc() - _last_refresh_attempt >= REFRESH_MIN_INTERVAL
+    )
+
+
+def refresh_god_info_in_background() -> None:
+    if _refresh_lock.locked():
+        return
+    threading.Thread(target=refresh_god_info, daemon=True).start()
 
-    try:
-        gods = api.call_method("getgods", "1")
-    except Exception:
-        logger.warning("Failed to get gods from Hi-Rez API", exc_info=True)
 
-        if GODS_PATH.exists():
-            gods = load_gods_from_file()
-        else:
-            logger.warning("There is no gods file that can be used as backup")
-            return GodInfo(None, None)
+def refresh_god_info() -> GodInfo:
+    global _last_refresh_attempt
+    with _refresh_lock:
+        _last_refresh_attempt = now_utc()
+        try:
+            gods = get_gods_from_api()
+        except Exception:
+            logger.warning("Failed to get gods from Hi-Rez API", exc_info=True)
+            return get_fallback_god_info()
+
+        try:
+            god_info = parse_god_info(gods)
+        except Exception:
+            logger.warning("Failed to parse god info from Hi-Rez API", exc_info=True)
+            return get_fallback_god_info()
 
-    else:
         save_gods_to_file(gods)
+        set_cached_god_info(CachedGodInfo(god_info, now_utc()))
+        return god_info
+
+
+def get_fallback_god_info() -> GodInfo:
+    if (cached := get_cached_god_info()) is not None:
+        return cached.god_info
+
+    # Gods file from before god info was cached.
+    if not GODS_PATH.exists():
+        logger.warning("There is no gods file that can be used as backup")
+        return GodInfo(None, None)
 
     try:
-        god_info = parse_god_info(gods)
+        return parse_god_info(load_gods_from_file())
     except Exception:
-        logger.warning("Failed to parse god info from Hi-Rez API", exc_info=True)
+        logger.warning("Failed to parse god info from gods file", exc_info=True)
         return GodInfo(None, None)
 
-    return god_info
+
+def get_cached_god_info() -> CachedGodInfo | None:
+    global _cached_god_info
+    ttl = get_webapi_config().god_info_ttl
+    if _cached_god_info is None or now_utc() - _cached_god_info.fetched_at >= ttl:
+        # Other processes (e.g. gunicorn workers) could have refreshed it already.
+        if (from_file := load_god_info_from_file()) is not None:
+            _cached_god_info = from_file
+    return _cached_god_info
+
+
+def set_cached_god_info(cached: CachedGodInfo) -> None:
+    global _cached_god_info
+    _cached_god_info = cached
+    save_god_info_to_file(cached)
 
 
 def get_api() -> charybdis.Api:
@@ -65,6 +146,46 @@ def get_api() -> charybdis.Api:
     )
 
 
+def get_gods_from_api() -> Gods:
+    """
+    Creates a new session every time, refreshes are rare enough (see
+    REFRESH_MIN_INTERVAL) that a session would be expired by the next one anyway.
+    """
+    gods = get_api().call_method_list("getgods", "1")
+    # Errors are returned as a single item with a message.
+    if len(gods) == 1 and gods[0].get("ret_msg"):
+        raise RuntimeError(f"Hi-Rez API error: {gods[0]['ret_msg']}")
+    return gods
+
+
+def load_god_info_from_file() -> CachedGodInfo | None:
+    if not GOD_INFO_PATH.exists():
+        return None
+    try:
+        god_info_dict = json.loads(GOD_INFO_PATH.read_text(encoding="utf8"))
+        god_classes = {
+            god: GodClass(god_class)
+            for god, god_class in god_info_dict["god_classes"].items()
+        }
+        god_info = GodInfo(god_info_dict["newest_god"], god_classes)
+        fetched_at = dt.datetime.fromisoformat(god_info_dict["fetched_at"])
+    except (ValueError, KeyError, AttributeError):
+        logger.warning("Failed to load god info file", exc_info=True)
+        return None
+    return CachedGodInfo(god_info, fetched_at)
+
+
+def save_god_info_to_file(cached: CachedGodInfo) -> None:
+    god_classes = cached.god_info.god_classes or {}
+    god_info_dict = {
+        "fetched_at": cached.fetched_at.isoformat(),
+        "newest_god": cached.god_info.newest_god,
+        "god_classes": {god: god_class.value for god, god_class in god_classes.items()},
+    }
+    god_info_str = json.dumps(god_info_dict, indent=2, ensure_ascii=False)
+    write_text_atomically(GOD_INFO_PATH, god_info_str)
+
+
 def load_gods_from_file() -> Gods:
     gods_str = GODS_PATH.read_text(encoding="utf8")
     gods = json.loads(gods_str)
@@ -73,7 +194,18 @@ def load_gods_from_file() -> Gods:
 
 def save_gods_to_file(gods: Gods) -> None:
     gods_str = json.dumps(gods, indent=2, ensure_ascii=False)
-    GODS_PATH.write_text(gods_str, encoding="utf8")
+    write_text_atomically(GODS_PATH, gods_str)
+
+
+def write_text_atomically(path: Path, text: str) -> None:
+    # Multiple gunicorn workers can be reading the file at the same time.
+    tmp_path = path.with_name(f"{path.name}~{threading.get_native_id()}")
+    tmp_path.write_text(text, encoding="utf8")
+    tmp_path.replace(path)
+
+
+def now_utc() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc)
 
 
 def parse_god_info(gods: Gods) -> GodInfo:
@@ -98,4 +230,4 @@ def get_god_classes(gods: Gods) -> GodClasses:
 
 if __name__ == "__main__":
     load_webapi_config()
-    get_god_info()
+    refresh_god_info()
@@ -0,0 +1,84 @@
+"""
+Perceptual hashes of item images, since Hi-Rez sometimes re-encodes the icons,
+which makes them different byte-wise, but not visually.
+"""
+
+from __future__ import annotations
+
+import dataclasses as dc
+import io
+
+import PIL.Image
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+HASH_MASK = (1 << HASH_BITS) - 1
+
+
+def dhash_image(image_data: bytes) -> int:
+    """
+    Difference hash - each bit says whether a pixel is brighter than the next one
+    in a downscaled grayscale image. The result is signed, so that it fits into
+    an SQLite integer.
+    """
+    image = PIL.Image.open(io.BytesIO(image_data)).convert("L")
+    image = image.resize((HASH_SIZE + 1, HASH_SIZE), PIL.Image.Resampling.LANCZOS)
+    pixels = image.tobytes()
+
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            i = row * (HASH_SIZE + 1) + col
+            bits = (bits << 1) | (pixels[i] > pixels[i + 1])
+
+    if bits >= 1 << (HASH_BITS - 1):
+        bits -= 1 << HASH_BITS
+    return bits
+
+
+def hash_distance(hash1: int, hash2: int) -> int:
+    return ((hash1 ^ hash2) & HASH_MASK).bit_count()
+
+
+@dc.dataclass
+class BkNode:
+    hash_: int
+    image_id: int
+    children: dict[int, BkNode] = dc.field(default_factory=dict)
+
+
+class BkTree:
+    """Burkhard-Keller tree for finding hashes within a distance of a given hash."""
+
+    def __init__(self) -> None:
+        self.root: BkNode | None = None
+
+    def add(self, hash_: int, image_id: int) -> None:
+        new_node = BkNode(hash_, image_id)
+        if self.root is None:
+            self.root = new_node
+            return
+
+        node = self.root
+        while True:
+            distance = hash_distance(hash_, node.hash_)
+            if (child := node.children.get(distance)) is None:
+                node.children[distance] = new_node
+                return
+            node = child
+
+    def find(self, hash_: int, max_distance: int) -> list[tuple[int, int]]:
+        """Returns (distance, image_id) pairs sorted by distance."""
+        result = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            distance = hash_distance(hash_, node.hash_)
+            if distance <= max_distance:
+                result.append((distance, node.image_id))
+            # Triangle inequality - other children can't be close enough.
+            for child_distance, child in node.children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        result.sort()
+        return result
@@ -1,3 +1,4 @@
+import concurrent.futures as cf
 import io
 import time
 import urllib.error
@@ -7,6 +8,7 @@ import PIL.Image
 
 from backend.shared import IMG_URL, ITEM_ICONS_ARCHIVE_DIR, delay
 from backend.webapi.post_builds.auto_fixes_logger import auto_fixes_logger as logger
+from backend.webapi.post_builds.image_hashes import dhash_image
 
 
 def get_image_or_none(image_name: str) -> bytes | None:
@@ -29,15 +31,31 @@ def get_image(image_name: str) -> bytes:
         return f.read()
 
 
-def compress_image_ignore_errors(
-    image_name: str, image_data: bytes
-) -> tuple[bytes, bool]:
+def get_compressed_image_ignore_errors(
+    image_name: str,
+    image_data: bytes,
+    future: cf.Future[tuple[bytes, bool, int]],
+) -> tuple[bytes, bool, int | None]:
+    """The future is for compress_and_hash_image, which runs in a process pool."""
     try:
-        return compress_image(image_data)
+        try:
+            return future.result()
+        except cf.process.BrokenProcessPool:
+            # E.g. one of its processes was killed, the next submit_compression starts
+            # a new pool, so only this image is compressed here.
+            logger.warning(f"Compression pool broken: {image_name}", exc_info=True)
+            return compress_and_hash_image(image_data)
     # OSError can be thrown while saving as JPEG.
     except (PIL.UnidentifiedImageError, OSError):
         logger.warning(f"Failed to compress: {image_name}", exc_info=True)
-        return image_data, False
+        return image_data, False, None
+
+
+def compress_and_hash_image(image_data: bytes) -> tuple[bytes, bool, int]:
+    compressed_image_data, was_compressed = compress_image(image_data)
+    # Hash of what is stored in the database.
+    dhash = dhash_image(compressed_image_data)
+    return compressed_image_data, was_compressed, dhash
 
 
 def compress_image(image_data: bytes) -> tuple[bytes, bool]:
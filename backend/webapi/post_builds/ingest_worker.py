@@ -0,0 +1,210 @@
+"""
+Processes the jobs queued by POST /api/builds (see jobs.py) one at a time.
+Runs as a separate process, or in a thread when running the web api for development.
+"""
+
+import dataclasses as dc
+import logging
+import time
+import typing as t
+
+import pydantic as pd
+
+from backend.config import load_webapi_config
+from backend.webapi.exceptions import MyValidationError
+from backend.webapi.models import db_session
+from backend.webapi.post_builds.auto_fixes_logger import collect_auto_fixes_warnings
+from backend.webapi.post_builds.jobs import (
+    JobStatus,
+    claim_next_job,
+    current_job_id,
+    delete_abandoned_jobs,
+    delete_job_chunk,
+    finish_job,
+    has_queued_jobs,
+    jobs_db_session,
+    load_job,
+    load_job_chunk,
+    progress_prefix,
+    requeue_running_jobs,
+)
+from backend.webapi.post_builds.post_builds import PostBuildsResult, post_builds
+from backend.webapi.prerender import prerender_after_job
+from backend.webapi.simple_queries import update_last_checked, update_last_modified
+from backend.webapi.snapshots import publish_snapshot_ignore_errors
+from backend.webapi.webapi import (
+    PostBuildRequest,
+    format_last_checked,
+    setup_webapi_logging,
+    what_time_is_it,
+)
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0
+# Seconds, new builds are published sooner when no more jobs are queued.
+NEW_BUILDS_MAX_DELAY = 60.0
+LAST_CHECKED_MAX_DELAY = 60.0 * 60
+# Seconds, doubled with every consecutive error (e.g. while the jobs db is locked).
+ERROR_BACKOFF = 1.0
+MAX_ERROR_BACKOFF = 60.0
+
+
+def main() -> None:
+    load_webapi_config()
+    setup_webapi_logging()
+    run_ingest_worker()
+
+
+def run_ingest_worker() -> None:
+    if job_ids := requeue_running_jobs():
+        logger.warning(f"Requeued interrupted jobs: {job_ids}")
+    if job_ids := delete_abandoned_jobs():
+        logger.warning(f"Deleted jobs which were never fully received: {job_ids}")
+    # E.g. the database could have been migrated since the last snapshot.
+    publish_snapshot_ignore_errors()
+    logger.info("Ingest worker started")
+
+    snapshot_publisher = SnapshotPublisher()
+    error_count = 0
+    while True:
+        try:
+            run_next_job(snapshot_publisher)
+        except Exception:
+            # The failures of the jobs themselves are handled by run_job.
+            error_count += 1
+            backoff = min(ERROR_BACKOFF * 2 ** (error_count - 1), MAX_ERROR_BACKOFF)
+            logger.exception(f"Ingest worker error, retrying in {backoff} s")
+            time.sleep(backoff)
+        else:
+            error_count = 0
+
+
+def run_next_job(snapshot_publisher: "SnapshotPublisher") -> None:
+    try:
+        job_id = claim_next_job()
+        if job_id is None:
+            if snapshot_publisher.publish_if_due():
+                prerender_after_job()
+            time.sleep(POLL_INTERVAL)
+            return
+        run_job(job_id, snapshot_publisher)
+    finally:
+        # Also calls close, which also calls rollback.
+        db_session.remove()
+        jobs_db_session.remove()
+
+
+class SnapshotPublisher:
+    """
+    A snapshot is a full copy of the database, so it's published only after the jobs
+    which changed something, and not after every one of them. New builds are published
+    once no more jobs are queued (e.g. after all the batches of the updater), or at the
+    latest after NEW_BUILDS_MAX_DELAY. A new last check alone (e.g. the polls of the
+    updater daemon, which mostly find nothing new) after LAST_CHECKED_MAX_DELAY. The
+    basic searches are pre-rendered along with the snapshots with new builds.
+    """
+
+    def __init__(self) -> None:
+        # Monotonic time, None when everything is published.
+        self.deadline: float | None = None
+        self.has_new_builds = False
+
+    def add_change(self, new_builds: bool) -> None:
+        delay = NEW_BUILDS_MAX_DELAY if new_builds else LAST_CHECKED_MAX_DELAY
+        deadline = time.monotonic() + delay
+        self.deadline = (
+            deadline if self.deadline is None else min(self.deadline, deadline)
+        )
+        self.has_new_builds |= new_builds
+
+    def publish_if_due(self) -> bool:
+        """Returns whether new builds were published."""
+        if self.deadline is None:
+            return False
+        if time.monotonic() < self.deadline and (
+            not self.has_new_builds or has_queued_jobs()
+        ):
+            return False
+        publish_snapshot_ignore_errors()
+        has_new_builds = self.has_new_builds
+        self.deadline = None
+        self.has_new_builds = False
+        return has_new_builds
+
+
+def run_job(job_id: int, snapshot_publisher: SnapshotPublisher) -> None:
+    logger.info(f"Running job: {job_id}")
+    token = current_job_id.set(job_id)
+    published_new_builds = False
+    with collect_auto_fixes_warnings() as warnings:
+        try:
+            result = run_job_inner(job_id, snapshot_publisher)
+        except (MyValidationError, pd.ValidationError) as e:
+            db_session.rollback()
+            logger.warning(f"Job {job_id} is invalid: {e}")
+            # The chunks before the invalid one are still posted.
+            published_new_builds = snapshot_publisher.publish_if_due()
+            finish_job(job_id, JobStatus.FAILED, warnings, error=str(e))
+        except Exception as e:
+            db_session.rollback()
+            logger.exception(f"Job {job_id} crashed")
+            published_new_builds = snapshot_publisher.publish_if_due()
+            finish_job(job_id, JobStatus.FAILED, warnings, error=repr(e))
+        else:
+            logger.info(f"Job {job_id} done: {result}")
+            # Before the job is done, so that the builds can be read once it is
+            # (if it's the last queued one).
+            published_new_builds = snapshot_publisher.publish_if_due()
+            finish_job(job_id, JobStatus.DONE, warnings, result=result)
+        finally:
+            current_job_id.reset(token)
+            progress_prefix.set("")
+    # After the job is done, so that the updater doesn't wait for it.
+    if published_new_builds:
+        prerender_after_job()
+
+
+def run_job_inner(
+    job_id: int, snapshot_publisher: SnapshotPublisher
+) -> dict[str, t.Any]:
+    """When a chunk fails, the chunks before it stay posted."""
+    last_checked_tooltip, chunk_is = load_job(job_id)
+
+    result = PostBuildsResult()
+    for chunk_cnt, chunk_i in enumerate(chunk_is, 1):
+        progress_prefix.set(f"Chunk {chunk_cnt}/{len(chunk_is)}|")
+        chunk_result = run_job_chunk(job_id, chunk_i, snapshot_publisher)
+        result.new_builds += chunk_result.new_builds
+        result.skipped_builds += chunk_result.skipped_builds
+        result.skipped_games += chunk_result.skipped_games
+
+    # The updater posts the builds in batches, and the last check only at the end.
+    if last_checked_tooltip:
+        update_last_checked(
+            format_last_checked(what_time_is_it()), last_checked_tooltip
+        )
+        db_session.commit()
+        snapshot_publisher.add_change(new_builds=False)
+    return dc.asdict(result)
+
+
+def run_job_chunk(
+    job_id: int, chunk_i: int, snapshot_publisher: SnapshotPublisher
+) -> PostBuildsResult:
+    build_dicts = load_job_chunk(job_id, chunk_i)
+    builds = [PostBuildRequest.parse_obj(build_dict) for build_dict in build_dicts]
+    result = post_builds(builds)
+    if result.new_builds:
+        update_last_modified(what_time_is_it())
+    db_session.commit()
+    if result.new_builds:
+        snapshot_publisher.add_change(new_builds=True)
+    # If the worker crashes right before this, the chunk is posted again,
+    # which only skips the already stored games.
+    delete_job_chunk(job_id, chunk_i)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Durable queue of POST /api/builds requests, which are processed by the ingest worker
+instead of inside the request. Kept in a separate database from the builds, so that
+queueing a job never has to wait for the (long) ingest transaction.
+"""
+
+from __future__ import annotations
+
+import collections
+import datetime
+import enum
+import json
+import typing as t
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+import sqlalchemy.orm as sao
+
+from backend.shared import STORAGE_DIR
+from backend.webapi.exceptions import BodyTooLargeError, MyValidationError
+from backend.webapi.models import STR_MAX_LEN
+
+jobs_db_path = STORAGE_DIR / "jobs.db"
+jobs_db_engine = sa.create_engine(url=f"sqlite+pysqlite:///{jobs_db_path}")
+jobs_session_maker = sao.sessionmaker(bind=jobs_db_engine)
+jobs_db_session = sao.scoped_session(session_factory=jobs_session_maker)
+
+# Each chunk is posted in its own transaction.
+CHUNK_BUILD_COUNT = 500
+# The chunks are written before the HMAC can be checked (at the end of the body),
+# so this limits how much anyone can make the server write.
+MAX_JOB_CHUNKS = 200
+# Jobs still receiving after this long were interrupted (e.g. by a restart).
+RECEIVING_TIMEOUT = datetime.timedelta(hours=1)
+
+
+@sa.event.listens_for(jobs_db_engine, "connect")
+def do_connect(dbapi_connection: t.Any, _: t.Any) -> t.Any:
+    # The webapi workers insert jobs while the ingest worker updates them.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+class JobBase(sao.MappedAsDataclass, sao.DeclarativeBase):
+    pass
+
+
+class JobStatus(enum.Enum):
+    # The builds are still being received, see JobReceiver.
+    RECEIVING = "receiving"
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(JobBase):
+    __tablename__ = "job"
+
+    id: sao.Mapped[int] = sao.mapped_column(primary_key=True, init=False)
+    status: sao.Mapped[JobStatus] = sao.mapped_column(
+        sa.Enum(
+            JobStatus,
+            native_enum=False,
+            length=STR_MAX_LEN,
+            values_callable=lambda x: [status.value for status in x],
+        )
+    )
+    # All datetimes are in UTC.
+    created_at: sao.Mapped[datetime.datetime]
+    # Empty, when the job doesn't update the last check.
+    last_checked_tooltip: sao.Mapped[str] = sao.mapped_column(sa.Text())
+    build_count: sao.Mapped[int]
+    started_at: sao.Mapped[datetime.datetime | None] = sao.mapped_column(default=None)
+    finished_at: sao.Mapped[datetime.datetime | None] = sao.mapped_column(default=None)
+    progress: sao.Mapped[str | None] = sao.mapped_column(sa.Text(), default=None)
+    # JSON list of messages from the auto fixes logger.
+    warnings: sao.Mapped[str] = sao.mapped_column(sa.Text(), default="[]")
+    # JSON object with counts of what was done.
+    result: sao.Mapped[str | None] = sao.mapped_column(sa.Text(), default=None)
+    error: sao.Mapped[str | None] = sao.mapped_column(sa.Text(), default=None)
+
+
+class JobChunk(JobBase):
+    """
+    Builds are stored separately from the job, so that they don't have to be loaded
+    when only the status is needed. Chunks are deleted once they are posted, so that
+    an interrupted job continues with the remaining ones.
+    """
+
+    __tablename__ = "job_chunk"
+
+    job_id: sao.Mapped[int] = sao.mapped_column(
+        sa.ForeignKey("job.id", ondelete="CASCADE"), primary_key=True
+    )
+    chunk_i: sao.Mapped[int] = sao.mapped_column(primary_key=True)
+    # JSON list of builds (as validated by PostBuildRequest).
+    builds: sao.Mapped[str] = sao.mapped_column(sa.Text())
+
+
+def create_jobs_db() -> None:
+    JobBase.metadata.create_all(jobs_db_engine)
+
+
+class JobReceiver:
+    """
+    Writes the builds of a new job into chunks as they arrive (e.g. while the request
+    body is still being parsed), so that they never have to be all in memory at once.
+    Until it's queued, the job is ignored by the ingest worker.
+    """
+
+    def __init__(self) -> None:
+        with jobs_db_session.begin():
+            job = Job(
+                status=JobStatus.RECEIVING,
+                created_at=utc_now(),
+                last_checked_tooltip="",
+                build_count=0,
+            )
+            jobs_db_session.add(job)
+            jobs_db_session.flush()
+            self.job_id = job.id
+        self.build_count = 0
+        self.chunk_count = 0
+        self.pending_builds: list[dict[str, t.Any]] = []
+        self.pending_games: set[tuple[int, int]] = set()
+        self.written_games: set[tuple[int, int]] = set()
+
+    def add_build(self, build: dict[str, t.Any]) -> None:
+        """
+        Builds of a game don't have to be next to each other, but they have to be
+        at most CHUNK_BUILD_COUNT builds apart, since fix_roles needs whole games.
+        """
+        game = (build["match_id"], build["game_i"])
+        if game in self.written_games:
+            raise MyValidationError(f"Builds of a game are too far apart: {game}")
+        if game not in self.pending_games:
+            if len(self.pending_builds) >= CHUNK_BUILD_COUNT:
+                self.write_pending_builds()
+            self.pending_games.add(game)
+        self.pending_builds.append(build)
+        self.build_count += 1
+
+    def write_pending_builds(self) -> None:
+        chunks = split_into_chunks(self.pending_builds)
+        if self.chunk_count + len(chunks) > MAX_JOB_CHUNKS:
+            raise BodyTooLargeError(
+                f"Too many builds, more than {MAX_JOB_CHUNKS} chunks"
+            )
+        with jobs_db_session.begin():
+            for chunk in chunks:
+                chunk_json = json.dumps(chunk)
+                jobs_db_session.add(JobChunk(self.job_id, self.chunk_count, chunk_json))
+                self.chunk_count += 1
+        self.written_games |= self.pending_games
+        self.pending_builds.clear()
+        self.pending_games.clear()
+
+    def queue(self, last_checked_tooltip: str | None) -> int:
+        self.write_pending_builds()
+        with jobs_db_session.begin():
+            jobs_db_session.execute(
+                sa.update(Job)
+                .where(Job.id == self.job_id)
+                .values(
+                    status=JobStatus.QUEUED,
+                    created_at=utc_now(),
+                    last_checked_tooltip=last_checked_tooltip or "",
+                    build_count=self.build_count,
+                )
+            )
+        return self.job_id
+
+    def discard(self) -> None:
+        with jobs_db_session.begin():
+            # Also deletes the chunks.
+            jobs_db_session.execute(sa.delete(Job).where(Job.id == self.job_id))
+
+
+def split_into_chunks(builds: list[dict[str, t.Any]]) -> list[list[dict[str, t.Any]]]:
+    """Chunks are split only between games, since fix_roles needs whole games."""
+    game_to_builds = collections.defaultdict(list)
+    for build in builds:
+        game_to_builds[(build["match_id"], build["game_i"])].append(build)
+
+    chunks: list[list[dict[str, t.Any]]] = []
+    for game_builds in game_to_builds.values():
+        if not chunks or len(chunks[-1]) + len(game_builds) > CHUNK_BUILD_COUNT:
+            chunks.append([])
+        chunks[-1].extend(game_builds)
+    return chunks
+
+
+def claim_next_job() -> int | None:
+    with jobs_db_session.begin():
+        job_id = jobs_db_session.scalars(
+            sa.select(Job.id)
+            .where(Job.status == JobStatus.QUEUED)
+            .order_by(Job.id.asc())
+            .limit(1)
+        ).one_or_none()
+        if job_id is None:
+            return None
+        jobs_db_session.execute(
+            sa.update(Job)
+            .where(Job.id == job_id)
+            .values(status=JobStatus.RUNNING, started_at=utc_now())
+        )
+        return job_id
+
+
+def has_queued_jobs() -> bool:
+    with jobs_db_session.begin():
+        job_id = jobs_db_session.scalars(
+            sa.select(Job.id).where(Job.status == JobStatus.QUEUED).limit(1)
+        ).one_or_none()
+        return job_id is not None
+
+
+def requeue_running_jobs() -> list[int]:
+    """Jobs interrupted by a crash/restart of the ingest worker are run again."""
+    with jobs_db_session.begin():
+        job_ids = jobs_db_session.scalars(
+            sa.update(Job)
+            .where(Job.status == JobStatus.RUNNING)
+            .values(status=JobStatus.QUEUED, started_at=None, progress=None)
+            .returning(Job.id)
+        ).all()
+        return list(job_ids)
+
+
+def delete_abandoned_jobs() -> list[int]:
+    with jobs_db_session.begin():
+        job_ids = jobs_db_session.scalars(
+            sa.delete(Job)
+            .where(
+                Job.status == JobStatus.RECEIVING,
+                Job.created_at < utc_now() - RECEIVING_TIMEOUT,
+            )
+            .returning(Job.id)
+        ).all()
+        return list(job_ids)
+
+
+def load_job(job_id: int) -> tuple[str, list[int]]:
+    with jobs_db_session.begin():
+        job = jobs_db_session.get_one(Job, job_id)
+        chunk_is = jobs_db_session.scalars(
+            sa.select(JobChunk.chunk_i)
+            .where(JobChunk.job_id == job_id)
+            .order_by(JobChunk.chunk_i.asc())
+        ).all()
+        return job.last_checked_tooltip, list(chunk_is)
+
+
+def load_job_chunk(job_id: int, chunk_i: int) -> list[dict[str, t.Any]]:
+    with jobs_db_session.begin():
+        chunk = jobs_db_session.get_one(JobChunk, (job_id, chunk_i))
+        return json.loads(chunk.builds)
+
+
+def delete_job_chunk(job_id: int, chunk_i: int) -> None:
+    with jobs_db_session.begin():
+        jobs_db_session.execute(
+            sa.delete(JobChunk).where(
+                JobChunk.job_id == job_id, JobChunk.chunk_i == chunk_i
+            )
+        )
+
+
+def finish_job(
+    job_id: int,
+    status: JobStatus,
+    warnings: list[str],
+    result: dict[str, t.Any] | None = None,
+    error: str | None = None,
+) -> None:
+    with jobs_db_session.begin():
+        jobs_db_session.execute(
+            sa.update(Job)
+            .where(Job.id == job_id)
+            .values(
+                status=status,
+                finished_at=utc_now(),
+                progress=None,
+                warnings=json.dumps(warnings, ensure_ascii=False),
+                result=json.dumps(result) if result is not None else None,
+                error=error,
+            )
+        )
+
+
+def get_job_dict(job_id: int) -> dict[str, t.Any] | None:
+    job = jobs_db_session.get(Job, job_id)
+    if job is None:
+        return None
+    return {
+        "id": job.id,
+        "status": job.status.value,
+        "created_at": format_utc(job.created_at),
+        "started_at": format_utc(job.started_at),
+        "finished_at": format_utc(job.finished_at),
+        "build_count": job.build_count,
+        "progress": job.progress,
+        "warnings": json.loads(job.warnings),
+        "result": json.loads(job.result) if job.result is not None else None,
+        "error": job.error,
+    }
+
+
+current_job_id: ContextVar[int | None] = ContextVar("current_job_id", default=None)
+progress_prefix: ContextVar[str] = ContextVar("progress_prefix", default="")
+
+
+def report_progress(progress: str) -> None:
+    """Does nothing when builds are not posted from a job (e.g. from tools)."""
+    if (job_id := current_job_id.get()) is None:
+        return
+    progress = progress_prefix.get() + progress
+    with jobs_db_session.begin():
+        jobs_db_session.execute(
+            sa.update(Job).where(Job.id == job_id).values(progress=progress)
+        )
+
+
+def utc_now() -> datetime.datetime:
+    # SQLite doesn't store timezones, so naive UTC is used.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def format_utc(d: datetime.datetime | None) -> str | None:
+    if d is None:
+        return None
+    return d.replace(tzinfo=datetime.timezone.utc).isoformat()
@@ -1,38 +1,66 @@
 from __future__ import annotations
 
+import dataclasses as dc
 import typing as t
 
 from backend.webapi.post_builds.auto_fixes_logger import auto_fixes_logger as logger
-from backend.webapi.post_builds.create_builds import create_builds
+from backend.webapi.post_builds.create_builds import create_builds, skip_stored_games
 from backend.webapi.post_builds.create_items import (
     create_build_items,
     create_item_keys,
     create_item_wips,
     get_or_create_items,
 )
+from backend.webapi.post_builds.fix_gods import has_unknown_gods
 from backend.webapi.post_builds.hirez_api import get_god_info
+from backend.webapi.post_builds.jobs import report_progress
 
 if t.TYPE_CHECKING:
     from backend.webapi.webapi import PostBuildRequest
 
 
-def post_builds(builds: list[PostBuildRequest]) -> None:
+@dc.dataclass
+class PostBuildsResult:
+    new_builds: int = 0
+    skipped_builds: int = 0
+    skipped_games: int = 0
+
+
+def post_builds(builds: list[PostBuildRequest]) -> PostBuildsResult:
     """Logging wrapper."""
     try:
         logger.info("Start")
-        post_builds_inner(builds)
+        result = post_builds_inner(builds)
     except Exception:
         logger.info("End (FAIL)")
         raise
     else:
-        logger.info("End")
+        logger.info(f"End {result}")
+        return result
 
 
-def post_builds_inner(build_models: list["PostBuildRequest"]) -> None:
-    god_info = get_god_info()
+def post_builds_inner(build_models: list["PostBuildRequest"]) -> PostBuildsResult:
     build_dicts = [build_model.dict() for build_model in build_models]
+    report_progress("Skipping stored games")
+    build_dicts, skipped_games = skip_stored_games(build_dicts)
+    result = PostBuildsResult(skipped_games=skipped_games)
+    if not build_dicts:
+        result.skipped_builds = len(build_models)
+        return result
+
+    report_progress("Getting god info")
+    god_info = get_god_info()
+    if has_unknown_gods(build_dicts, god_info):
+        god_info = get_god_info(force_refresh=True)
     item_keys, build_item_wips = create_item_keys(build_dicts)
+    report_progress(f"Downloading images for items: {len(item_keys)}")
     item_wips = create_item_wips(item_keys)
+    report_progress("Creating items")
     items = get_or_create_items(item_wips)
-    builds = create_builds(god_info, build_dicts)
-    create_build_items(builds, items, build_item_wips)
+    report_progress(f"Creating builds: {len(build_dicts)}")
+    build_ids = create_builds(god_info, build_dicts)
+    create_build_items(build_ids, items, build_item_wips)
+
+    result.new_builds = sum(build_id is not None for build_id in build_ids)
+    result.skipped_builds = len(build_models) - result.new_builds
+    return result
@@ -0,0 +1,113 @@
+import datetime as dt
+import typing as t
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+import sqlalchemy as sa
+
+from backend.webapi.models import Base, Build, db_engine, db_session
+from backend.webapi.post_builds.create_builds import (
+    insert_builds,
+    remove_accents,
+    skip_stored_games,
+)
+
+
+def make_build(match_id: int, game_i: int, player1: str) -> dict:
+    return {"match_id": match_id, "game_i": game_i, "player1": player1}
+
+
+builds = [
+    make_build(1, 1, "Alpha"),
+    make_build(1, 1, "Beta"),
+    make_build(1, 2, "Alpha"),
+    make_build(1, 2, "Beta"),
+    make_build(2, 1, "Gammá"),
+]
+
+
+@patch("backend.webapi.post_builds.create_builds.get_stored_build_keys")
+def test_nothing_stored(mock: Mock) -> None:
+    mock.return_value = set()
+    assert skip_stored_games(builds) == (builds, 0)
+
+
+@patch("backend.webapi.post_builds.create_builds.get_stored_build_keys")
+def test_whole_game_stored(mock: Mock) -> None:
+    mock.return_value = {(1, 1, "ALPHA"), (1, 1, "BETA"), (2, 1, "GAMMA")}
+    assert skip_stored_games(builds) == (builds[2:4], 2)
+
+
+@patch("backend.webapi.post_builds.create_builds.get_stored_build_keys")
+def test_partially_stored_game(mock: Mock) -> None:
+    mock.return_value = {(1, 2, "ALPHA")}
+    assert skip_stored_games(builds) == (builds, 0)
+
+
+@pytest.fixture
+def tmp_db(tmp_path: Path) -> t.Iterator[None]:
+    engine = sa.create_engine(f"sqlite+pysqlite:///{tmp_path / 'backend.db'}")
+    Base.metadata.create_all(engine)
+    db_session.remove()
+    db_session.configure(bind=engine)
+    yield
+    db_session.remove()
+    db_session.configure(bind=db_engine)
+    engine.dispose()
+
+
+def make_stored_build(match_id: int, game_i: int, player1: str) -> dict:
+    """Like the builds after create_builds fixed them."""
+    return {
+        **make_build(match_id, game_i, remove_accents(player1)),
+        "season": 10,
+        "league": "SPL",
+        "phase": "Phase 1",
+        "date": dt.date(2023, 5, 6),
+        "win": True,
+        "game_length": dt.time(minute=30),
+        "kda_ratio": 2.0,
+        "kills": 1,
+        "deaths": 1,
+        "assists": 1,
+        "role": "Mid",
+        "god_class": "Mage",
+        "god1": "Agni",
+        "team1": "Team A",
+        "god2": "Zeus",
+        "player2": "Opponent",
+        "team2": "Team B",
+    }
+
+
+def post(build_dicts: list[dict]) -> list[int | None]:
+    """Like post_builds, but only the parts which touch the builds table."""
+    new_build_dicts, _ = skip_stored_games(build_dicts)
+    build_ids = insert_builds([dict(b) for b in new_build_dicts])
+    db_session.commit()
+    return build_ids
+
+
+def test_insert_builds(tmp_db: None) -> None:
+    stored_builds = [make_stored_build(*build.values()) for build in builds]
+    build_ids = post(stored_builds)
+    assert None not in build_ids and len(set(build_ids)) == len(build_ids)
+
+    # Reposted, also with duplicates in the same batch.
+    assert post(stored_builds) == []
+    assert post(stored_builds + stored_builds) == []
+    assert insert_builds([dict(b) for b in stored_builds]) == [None] * len(builds)
+
+    # The other builds of the game are skipped when inserting, and the returned IDs
+    # line up with the builds.
+    deleted_id = build_ids[3]
+    db_session.execute(sa.delete(Build).where(Build.id == deleted_id))
+    db_session.commit()
+    game_builds = stored_builds[2:4]
+    new_ids = post(game_builds + game_builds)
+    assert new_ids[0] is None and new_ids[2:] == [None, None]
+    assert new_ids[1] is not None
+    player1 = db_session.scalars(sa.select(Build.player1).where(Build.id == new_ids[1]))
+    assert player1.one() == "Beta"
+    assert db_session.scalars(sa.select(sa.func.count(Build.id))).one() == len(builds)
@@ -4,7 +4,13 @@ import typing as t
 
 import pytest
 
-from backend.webapi.post_builds.fix_gods import BuildDict, contains_digits, fix_gods
+from backend.webapi.post_builds.fix_gods import (
+    BuildDict,
+    contains_digits,
+    fix_gods,
+    has_unknown_gods,
+)
+from backend.webapi.post_builds.hirez_api import GodClass, GodInfo
 
 contains_digits_params = [
     ("", False),
@@ -61,3 +67,27 @@ def fix_gods_params_gen() -> t.Iterator[FixGodsParam]:
 def test_fix_gods(p: FixGodsParam) -> None:
     fix_gods(p.builds, p.newest_god)
     assert p.builds == builds_orig
+
+
+god_classes = {
+    "god-one": GodClass.MAGE,
+    "god-two": GodClass.HUNTER,
+    "god-three": GodClass.GUARDIAN,
+}
+
+has_unknown_gods_params = [
+    (GodInfo("god-three", god_classes), False),  # all known
+    (GodInfo("god-three", None), True),  # no god classes
+    (GodInfo("god-three", {"god-one": GodClass.MAGE}), True),  # missing god1
+]
+
+
+@pytest.mark.parametrize("god_info,result", has_unknown_gods_params)
+def test_has_unknown_gods(god_info: GodInfo, result: bool) -> None:
+    assert has_unknown_gods(copy_builds(), god_info) == result
+
+
+def test_has_unknown_gods_digits() -> None:
+    builds = copy_builds()
+    builds[2]["god2"] = "god5"
+    assert has_unknown_gods(builds, GodInfo("god-three", god_classes))
@@ -0,0 +1,95 @@
+import datetime as dt
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+import pytest
+
+from backend.webapi.post_builds import hirez_api
+from backend.webapi.post_builds.hirez_api import (
+    CachedGodInfo,
+    GodClass,
+    GodInfo,
+    get_god_info,
+    now_utc,
+)
+
+gods = [
+    {"Name": "Agni", "Roles": "Mage", "latestGod": "n"},
+    {"Name": "Ares", "Roles": "Guardian", "latestGod": "y"},
+]
+god_info = GodInfo("Ares", {"Agni": GodClass.MAGE, "Ares": GodClass.GUARDIAN})
+
+
+@pytest.fixture(autouse=True)
+def storage(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(hirez_api, "GODS_PATH", tmp_path / "gods.json")
+    monkeypatch.setattr(hirez_api, "GOD_INFO_PATH", tmp_path / "god_info.json")
+    monkeypatch.setattr(hirez_api, "_cached_god_info", None)
+    monkeypatch.setattr(hirez_api, "_last_refresh_attempt", None)
+    config = Mock(god_info_ttl=dt.timedelta(hours=24))
+    monkeypatch.setattr(hirez_api, "get_webapi_config", lambda: config)
+
+
+def save_cache(age: dt.timedelta) -> None:
+    hirez_api.save_god_info_to_file(CachedGodInfo(god_info, now_utc() - age))
+
+
+@patch("backend.webapi.post_builds.hirez_api.get_gods_from_api")
+def test_no_cache(mock: Mock) -> None:
+    mock.return_value = gods
+    assert get_god_info() == god_info
+    assert hirez_api.load_god_info_from_file() is not None
+    assert mock.call_count == 1
+
+
+@patch("backend.webapi.post_builds.hirez_api.get_gods_from_api")
+def test_fresh_cache(mock: Mock) -> None:
+    save_cache(dt.timedelta(minutes=1))
+    assert get_god_info() == god_info
+    assert get_god_info(force_refresh=True) == god_info
+    assert mock.call_count == 0
+
+
+@patch("backend.webapi.post_builds.hirez_api.get_gods_from_api")
+def test_forced_refresh(mock: Mock) -> None:
+    mock.return_value = gods
+    save_cache(dt.timedelta(hours=1))
+    assert get_god_info(force_refresh=True) == god_info
+    assert mock.call_count == 1
+
+
+@patch("backend.webapi.post_builds.hirez_api.refresh_god_info_in_background")
+@patch("backend.webapi.post_builds.hirez_api.get_gods_from_api")
+def test_stale_cache(mock: Mock, background_mock: Mock) -> None:
+    save_cache(dt.timedelta(hours=25))
+    assert get_god_info() == god_info
+    assert mock.call_count == 0
+    assert background_mock.call_count == 1
+
+
+@patch("backend.webapi.post_builds.hirez_api.get_gods_from_api")
+def test_api_failure(mock: Mock) -> None:
+    mock.side_effect = RuntimeError()
+    save_cache(dt.timedelta(hours=1))
+    assert get_god_info(force_refresh=True) == god_info
+
+
+@patch("backend.webapi.post_builds.hirez_api.get_gods_from_api")
+def test_api_failure_rate_limited(mock: Mock) -> None:
+    mock.side_effect = RuntimeError()
+    # Without any cache, the forced refresh of the same post doesn't call it again.
+    assert get_god_info() == GodInfo(None, None)
+    assert get_god_info(force_refresh=True) == GodInfo(None, None)
+    assert mock.call_count == 1
+
+    save_cache(dt.timedelta(hours=25))
+    hirez_api._cached_god_info = None
+    assert get_god_info(force_refresh=True) == god_info
+    assert mock.call_count == 1
+
+    # Until the next attempt is due.
+    hirez_api._last_refresh_attempt = now_utc() - hirez_api.REFRESH_MIN_INTERVAL
+    mock.side_effect = None
+    mock.return_value = gods
+    assert get_god_info(force_refresh=True) == god_info
+    assert mock.call_count == 2
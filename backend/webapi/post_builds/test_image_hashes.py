@@ -0,0 +1,57 @@
+import io
+import random
+
+import PIL.Image
+import pytest
+
+from backend.webapi.post_builds.image_hashes import BkTree, dhash_image, hash_distance
+
+
+def make_image(seed: int, quality: int = 95) -> bytes:
+    rng = random.Random(seed)
+    image = PIL.Image.new("RGB", (64, 64))
+    for x in range(0, 64, 8):
+        for y in range(0, 64, 8):
+            color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            image.paste(color, (x, y, x + 8, y + 8))
+    b = io.BytesIO()
+    image.save(b, "JPEG", quality=quality)
+    return b.getvalue()
+
+
+def test_dhash_image() -> None:
+    hash1 = dhash_image(make_image(1))
+    assert -(1 << 63) <= hash1 < 1 << 63
+    # Re-encoded image is close, different image is not.
+    assert hash_distance(hash1, dhash_image(make_image(1, quality=70))) <= 4
+    assert hash_distance(hash1, dhash_image(make_image(2))) > 4
+
+
+hash_distance_params = [
+    (0, 0, 0),
+    (0b1011, 0b0001, 2),
+    (-1, 0, 64),
+    (-1, 1 << 63, 63),
+]
+
+
+@pytest.mark.parametrize("hash1,hash2,result", hash_distance_params)
+def test_hash_distance(hash1: int, hash2: int, result: int) -> None:
+    assert hash_distance(hash1, hash2) == result
+
+
+def test_bk_tree() -> None:
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    tree = BkTree()
+    for image_id, hash_ in enumerate(hashes):
+        tree.add(hash_, image_id)
+
+    query = hashes[7] ^ 0b101
+    expected = sorted(
+        (hash_distance(query, hash_), image_id)
+        for image_id, hash_ in enumerate(hashes)
+        if hash_distance(query, hash_) <= 20
+    )
+    assert tree.find(query, 20) == expected
+    assert tree.find(query, 2)[0] == (2, 7)
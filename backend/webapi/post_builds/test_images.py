@@ -0,0 +1,37 @@
+import os
+
+from backend.webapi.post_builds import create_items
+from backend.webapi.post_builds.images import (
+    compress_and_hash_image,
+    get_compressed_image_ignore_errors,
+)
+from backend.webapi.post_builds.test_image_hashes import make_image
+
+
+def kill_process(image_data: bytes) -> tuple[bytes, bool, int]:
+    os._exit(1)
+
+
+def test_broken_compression_pool() -> None:
+    image_data = make_image(1)
+    expected = compress_and_hash_image(image_data)
+    # The first future breaks the pool, as if one of its processes was killed.
+    create_items.submit_compression(image_data)
+    assert create_items._compress_pool is not None
+    broken_future = create_items._compress_pool.submit(kill_process, image_data)
+    try:
+        broken_pool = create_items._compress_pool
+        assert (
+            get_compressed_image_ignore_errors("a.jpg", image_data, broken_future)
+            == expected
+        )
+
+        # The next image gets a new pool.
+        future = create_items.submit_compression(image_data)
+        assert create_items._compress_pool is not broken_pool
+        assert get_compressed_image_ignore_errors("a.jpg", image_data, future) == (
+            expected
+        )
+    finally:
+        create_items._compress_pool.shutdown()
+        create_items._compress_pool = None
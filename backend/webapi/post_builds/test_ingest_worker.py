@@ -0,0 +1,80 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from backend.webapi.post_builds.ingest_worker import (
+    ERROR_BACKOFF,
+    LAST_CHECKED_MAX_DELAY,
+    NEW_BUILDS_MAX_DELAY,
+    SnapshotPublisher,
+    run_ingest_worker,
+)
+
+MODULE = "backend.webapi.post_builds.ingest_worker"
+
+
+@patch(f"{MODULE}.time.monotonic")
+@patch(f"{MODULE}.has_queued_jobs")
+@patch(f"{MODULE}.publish_snapshot_ignore_errors")
+def test_snapshot_publisher(
+    publish: MagicMock, has_queued_jobs: MagicMock, monotonic: MagicMock
+) -> None:
+    monotonic.return_value = 1000.0
+    has_queued_jobs.return_value = True
+    snapshot_publisher = SnapshotPublisher()
+
+    # Nothing changed.
+    assert not snapshot_publisher.publish_if_due()
+    publish.assert_not_called()
+
+    # New builds wait for the queued jobs, but not for too long.
+    snapshot_publisher.add_change(new_builds=True)
+    snapshot_publisher.publish_if_due()
+    publish.assert_not_called()
+    monotonic.return_value += NEW_BUILDS_MAX_DELAY
+    assert snapshot_publisher.publish_if_due()
+    publish.assert_called_once()
+
+    snapshot_publisher.add_change(new_builds=True)
+    has_queued_jobs.return_value = False
+    assert snapshot_publisher.publish_if_due()
+    assert publish.call_count == 2
+
+    # Only the last check waits even when nothing is queued.
+    snapshot_publisher.add_change(new_builds=False)
+    snapshot_publisher.publish_if_due()
+    monotonic.return_value += LAST_CHECKED_MAX_DELAY / 2
+    snapshot_publisher.add_change(new_builds=False)
+    monotonic.return_value += LAST_CHECKED_MAX_DELAY / 2
+    assert not snapshot_publisher.publish_if_due()
+    assert publish.call_count == 3
+    snapshot_publisher.publish_if_due()
+    assert publish.call_count == 3
+
+
+@patch(f"{MODULE}.time.sleep")
+@patch(f"{MODULE}.run_next_job")
+def test_run_ingest_worker_errors(run_next_job: MagicMock, sleep: MagicMock) -> None:
+    class Stop(BaseException):
+        pass
+
+    run_next_job.side_effect = [
+        OSError("database is locked"),
+        OSError("database is locked"),
+        None,
+        OSError("database is locked"),
+        Stop(),
+    ]
+    with (
+        patch(f"{MODULE}.requeue_running_jobs", return_value=[]),
+        patch(f"{MODULE}.delete_abandoned_jobs", return_value=[]),
+        patch(f"{MODULE}.publish_snapshot_ignore_errors"),
+        pytest.raises(Stop),
+    ):
+        run_ingest_worker()
+    # The worker keeps running, backing off while the errors repeat.
+    assert [c.args[0] for c in sleep.call_args_list] == [
+        ERROR_BACKOFF,
+        ERROR_BACKOFF * 2,
+        ERROR_BACKOFF,
+    ]
@@ -0,0 +1,24 @@
+from unittest.mock import patch
+
+from backend.webapi.post_builds.jobs import split_into_chunks
+
+
+def make_game(match_id: int, game_i: int) -> list[dict]:
+    return [{"match_id": match_id, "game_i": game_i} for _ in range(10)]
+
+
+@patch("backend.webapi.post_builds.jobs.CHUNK_BUILD_COUNT", 25)
+def test_split_into_chunks() -> None:
+    game1, game2, game3 = make_game(1, 1), make_game(1, 2), make_game(2, 1)
+    assert split_into_chunks(game1 + game2 + game3) == [game1 + game2, game3]
+
+
+@patch("backend.webapi.post_builds.jobs.CHUNK_BUILD_COUNT", 5)
+def test_split_into_chunks_big_game() -> None:
+    game1, game2 = make_game(1, 1), make_game(1, 2)
+    # Interleaved builds are still grouped by game.
+    assert split_into_chunks(game1[:5] + game2 + game1[5:]) == [game1, game2]
+
+
+def test_split_into_chunks_empty() -> None:
+    assert split_into_chunks([]) == []
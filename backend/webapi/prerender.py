@@ -0,0 +1,238 @@
+"""
+Pre-renders the results of all basic searches (god x role x god class, each with at
+most one value) into static, precompressed JSON files, so that they can be served
+by nginx without touching the web api. Runs in the ingest worker after jobs add new
+builds (if PRERENDER_PAGES is set), when only the searches which have new builds are
+rendered again. Or manually (everything) with:
+python -m backend.webapi.prerender [page_count]
+
+The files are named after the query string the frontend sends, so nginx can serve
+them with something like (the map also makes sure that $args has no slashes):
+
+map $args $prerendered_builds {
+    "~^[A-Za-z0-9=&+%_.*-]*$" /builds/$args.json;
+    default /none;
+}
+location = /api/builds {
+    root /app/storage/prerendered/current;
+    gzip_static on;
+    default_type application/json;
+    try_files $prerendered_builds @webapi;
+}
+"""
+
+import gzip
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import typing as t
+import urllib.parse
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from backend.config import get_webapi_config, load_webapi_config
+from backend.shared import STORAGE_DIR
+from backend.webapi.get_builds import get_builds
+from backend.webapi.models import Build, db_session
+from backend.webapi.simple_queries import get_last_modified
+from backend.webapi.webapi import GetBuildsRequest, encode_json, setup_webapi_logging
+
+logger = logging.getLogger(__name__)
+
+PRERENDERED_DIR = STORAGE_DIR / "prerendered"
+CURRENT_LINK = PRERENDERED_DIR / "current"
+# The previous version can still be being served, while the current one is switched.
+KEPT_VERSIONS = 2
+# In the same order as the basic search controls on the frontend.
+BASIC_SEARCH_KEYS = ["god1", "role", "god_class"]
+BASIC_SEARCH_COLUMNS = [Build.god1, Build.role, Build.god_class]
+PAGE_SIZE = 10
+# In the version directory, what the version was rendered from.
+VERSION_INFO_FILE = "version.json"
+
+BasicSearch = tuple[str | None, ...]
+
+
+def main() -> None:
+    load_webapi_config()
+    setup_webapi_logging()
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    with db_session():
+        prerender_basic_searches(page_count, incremental=False)
+
+
+def prerender_basic_searches(page_count: int, incremental: bool = True) -> None:
+    """
+    The versions are keyed by last modified, so nothing is done if it's the same.
+    Builds are only ever added (by the ingest worker), so when incremental, only the
+    basic searches which match the builds added since the current version are rendered
+    again, and the other files are hard linked from it.
+    """
+    last_modified = get_last_modified()
+    if last_modified is None:
+        logger.warning("Cannot pre-render without last modified")
+        return
+    version = last_modified.strftime("%Y%m%dT%H%M%SZ")
+    version_dir = PRERENDERED_DIR / version
+    if version_dir.exists():
+        logger.info(f"Already pre-rendered: {version}")
+        return
+
+    # Everything is written into a temporary directory first,
+    # so that nginx never sees a half-written version.
+    tmp_dir = PRERENDERED_DIR / f"{version}~"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    (tmp_dir / "builds").mkdir(parents=True)
+    version_info = get_version_info(page_count)
+    current = get_current_version(version_info) if incremental else None
+    if current is None:
+        basic_searches: t.Iterable[BasicSearch] = get_basic_searches()
+    else:
+        current_dir, max_build_id = current
+        for path in (current_dir / "builds").iterdir():
+            os.link(path, tmp_dir / "builds" / path.name)
+        basic_searches = get_changed_basic_searches(max_build_id)
+    file_count = 0
+    for basic_search in basic_searches:
+        file_count += prerender_basic_search(tmp_dir, basic_search, page_count)
+    (tmp_dir / VERSION_INFO_FILE).write_text(json.dumps(version_info))
+    tmp_dir.rename(version_dir)
+
+    switch_current_version(version)
+    delete_old_versions()
+    linked = f", the rest linked from {current[0].name}" if current else ""
+    logger.info(f"Pre-rendered {version}: {file_count} files{linked}")
+
+
+def get_version_info(page_count: int) -> dict[str, t.Any]:
+    return {
+        "page_count": page_count,
+        "max_build_id": db_session.scalars(sa.select(sa.func.max(Build.id))).one(),
+        "values": get_basic_search_values(),
+    }
+
+
+def get_current_version(version_info: dict[str, t.Any]) -> tuple[Path, int] | None:
+    """
+    The directory of the current version and its max build ID. None when everything
+    has to be rendered, e.g. when a god (or a role etc.) was added, since then there
+    are new basic searches (also in combination with the old values).
+    """
+    try:
+        current_dir = PRERENDERED_DIR / os.readlink(CURRENT_LINK)
+        current_info = json.loads((current_dir / VERSION_INFO_FILE).read_text())
+    except FileNotFoundError:
+        return None
+    if current_info["max_build_id"] is None or any(
+        current_info[key] != version_info[key] for key in ["page_count", "values"]
+    ):
+        return None
+    return current_dir, current_info["max_build_id"]
+
+
+def get_basic_searches() -> t.Iterator[BasicSearch]:
+    """Also the ones which have no builds, since they can be still searched for."""
+    values = get_basic_search_values()
+    return itertools.product(*([None, *column_values] for column_values in values))
+
+
+def get_basic_search_values() -> list[list[str]]:
+    return [
+        list(
+            db_session.scalars(
+                sa.select(column).where(column.is_not(None)).distinct().order_by(column)
+            ).all()
+        )
+        for column in BASIC_SEARCH_COLUMNS
+    ]
+
+
+def get_changed_basic_searches(max_build_id: int) -> set[BasicSearch]:
+    """The basic searches, whose results include any build after max_build_id."""
+    rows = db_session.execute(
+        sa.select(*BASIC_SEARCH_COLUMNS).where(Build.id > max_build_id).distinct()
+    ).all()
+    return {
+        tuple(value if is_used else None for value, is_used in zip(row, used_keys))
+        for row in rows
+        for used_keys in itertools.product([True, False], repeat=len(row))
+    }
+
+
+def prerender_basic_search(
+    version_dir: Path, basic_search: BasicSearch, page_count: int
+) -> int:
+    """Returns the number of written pages."""
+    params = [
+        (key, value)
+        for key, value in zip(BASIC_SEARCH_KEYS, basic_search)
+        if value is not None
+    ]
+    query = {key: [value] for key, value in params}
+
+    last_page = 1
+    for page in range(1, page_count + 1):
+        if page > last_page:
+            break
+        result = get_builds(GetBuildsRequest.parse_obj({**query, "page": [page]}))
+        if page == 1:
+            last_page = max((result["count"] + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+        write_page(version_dir / "builds" / get_file_name(page, params), result)
+    return min(page_count, last_page)
+
+
+def get_file_name(page: int, params: list[tuple[str, str]]) -> str:
+    """
+    Same as the query string sent by the frontend (including the trailing & when there
+    are no params). With safe="*", urlencode escapes the same characters as
+    URLSearchParams, except for ~, which is not in any of the names.
+    """
+    return f"page={page}&{urllib.parse.urlencode(params, safe='*')}.json"
+
+
+def write_page(path: Path, result: dict[str, t.Any]) -> None:
+    data = encode_json(result).encode("utf8")
+    gz_path = path.with_name(f"{path.name}.gz")
+    # They can be hard links to the previous version, which must stay the same.
+    path.unlink(missing_ok=True)
+    gz_path.unlink(missing_ok=True)
+    path.write_bytes(data)
+    # For nginx gzip_static, mtime=0 so the output is reproducible.
+    gz_path.write_bytes(gzip.compress(data, mtime=0))
+
+
+def switch_current_version(version: str) -> None:
+    # Symlinks cannot be overwritten, but they can be atomically replaced.
+    tmp_link = PRERENDERED_DIR / "current~"
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(version, target_is_directory=True)
+    os.replace(tmp_link, CURRENT_LINK)
+
+
+def delete_old_versions() -> None:
+    versions = sorted(
+        path
+        for path in PRERENDERED_DIR.iterdir()
+        if path.is_dir() and not path.is_symlink() and not path.name.endswith("~")
+    )
+    for old_version in versions[:-KEPT_VERSIONS]:
+        shutil.rmtree(old_version)
+
+
+def prerender_after_job() -> None:
+    """Failures are only logged, since the builds are already posted."""
+    page_count = get_webapi_config().prerender_pages
+    if page_count <= 0:
+        return
+    try:
+        prerender_basic_searches(page_count)
+    except Exception:
+        logger.exception("Failed to pre-render basic searches")
+
+
+if __name__ == "__main__":
+    main()
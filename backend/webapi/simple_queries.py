@@ -15,6 +15,25 @@ def get_match_ids(phase: str) -> list[int]:
     return lst(match_ids)
 
 
+def get_known_matches(after_build_id: int | None = None) -> dict[str, list[int]]:
+    """
+    The match IDs of every phase (from the ix_build_phase_match_id index), or only of
+    the builds after after_build_id.
+    """
+    known_matches: dict[str, list[int]] = {}
+    query = sa.select(Build.phase, Build.match_id).distinct()
+    if after_build_id is not None:
+        query = query.where(Build.id > after_build_id)
+    rows = db_session.execute(query.order_by(Build.phase, Build.match_id))
+    for phase, match_id in rows:
+        known_matches.setdefault(phase, []).append(match_id)
+    return known_matches
+
+
+def get_max_build_id() -> int | None:
+    return db_session.scalars(sa.select(sa.func.max(Build.id))).one()
+
+
 VERSION_KEY = "version"
 
 
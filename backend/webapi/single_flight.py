@@ -0,0 +1,67 @@
+import dataclasses as dc
+import threading
+import typing as t
+
+T = t.TypeVar("T")
+
+
+@dc.dataclass
+class SingleFlightStats:
+    # Calls which computed the result.
+    computed: int = 0
+    # Calls which waited for the result computed by another (concurrent) call.
+    coalesced: int = 0
+    failed: int = 0
+
+
+@dc.dataclass
+class _Flight(t.Generic[T]):
+    done: threading.Event = dc.field(default_factory=threading.Event)
+    result: T | None = None
+    error: BaseException | None = None
+
+
+class SingleFlight(t.Generic[T]):
+    """
+    Concurrent calls with the same key wait for the first one to finish and share its
+    result (or exception), instead of all computing the same thing. Results are not
+    cached, so calls after the first one has finished compute them again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: dict[t.Hashable, _Flight[T]] = {}
+        self.stats = SingleFlightStats()
+
+    def do(self, key: t.Hashable, func: t.Callable[[], T]) -> T:
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.stats.computed += 1
+            else:
+                self.stats.coalesced += 1
+
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return t.cast(T, flight.result)
+
+        try:
+            flight.result = func()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self.stats.failed += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return dc.asdict(self.stats)
@@ -0,0 +1,145 @@
+"""
+The web api reads from an immutable snapshot of the database, instead of from the
+database itself, which is only written to by the ingest worker (and the tools).
+After the jobs which changed something (see SnapshotPublisher), the ingest worker takes
+a consistent copy of the database with the SQLite backup API and atomically switches
+the current snapshot. Readers notice the new
+generation on their next request and reopen it. The previous snapshots are kept,
+to serve requests which are still using them, and as rollback points. Can also be
+run manually (e.g. after editing the database with the tools):
+python -m backend.webapi.snapshots [rollback]
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from backend.shared import setup_logging
+from backend.webapi.models import db_engine, db_path
+
+logger = logging.getLogger(__name__)
+
+# Next to the database, so that e.g. a benchmark database has its own snapshots.
+SNAPSHOTS_DIR = db_path.with_name(f"{db_path.stem}.snapshots")
+CURRENT_LINK = SNAPSHOTS_DIR / "current"
+KEPT_SNAPSHOTS = 3
+
+_lock = threading.Lock()
+_read_generation: str | None = None
+_read_engine: sa.Engine | None = None
+
+
+def main() -> None:
+    setup_logging()
+    if sys.argv[1:] == ["rollback"]:
+        rollback_snapshot()
+    else:
+        publish_snapshot()
+
+
+def publish_snapshot(source_path: Path = db_path) -> str:
+    """Returns the new generation."""
+    SNAPSHOTS_DIR.mkdir(parents=True, exist_ok=True)
+    generations = get_generations()
+    generation = f"{int(Path(generations[-1]).stem) + 1 if generations else 1:06}.db"
+
+    # Copied into a temporary file first, so that it's never seen half-written.
+    tmp_path = SNAPSHOTS_DIR / f"{generation}~"
+    tmp_path.unlink(missing_ok=True)
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(tmp_path)
+    try:
+        # All pages at once, so the copy is consistent even if the source is written to.
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    tmp_path.rename(SNAPSHOTS_DIR / generation)
+
+    switch_current_snapshot(generation)
+    delete_old_snapshots()
+    logger.info(f"Published snapshot: {generation}")
+    return generation
+
+
+def rollback_snapshot() -> str:
+    """Switches to the snapshot before the current one and returns its generation."""
+    current = os.readlink(CURRENT_LINK)
+    previous = [generation for generation in get_generations() if generation < current]
+    if not previous:
+        raise RuntimeError(f"No snapshot to roll back to from: {current}")
+    switch_current_snapshot(previous[-1])
+    # Otherwise the next publish would switch back to the newer snapshots.
+    for generation in get_generations():
+        if generation > previous[-1]:
+            (SNAPSHOTS_DIR / generation).unlink()
+    logger.info(f"Rolled back snapshot: {current} -> {previous[-1]}")
+    return previous[-1]
+
+
+def get_generations() -> list[str]:
+    return sorted(
+        path.name
+        for path in SNAPSHOTS_DIR.glob("*.db")
+        if path.is_file() and not path.is_symlink()
+    )
+
+
+def switch_current_snapshot(generation: str) -> None:
+    # Symlinks cannot be overwritten, but they can be atomically replaced.
+    tmp_link = SNAPSHOTS_DIR / "current~"
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(generation)
+    os.replace(tmp_link, CURRENT_LINK)
+
+
+def delete_old_snapshots() -> None:
+    # Readers which still have an old snapshot open keep reading it just fine.
+    for generation in get_generations()[:-KEPT_SNAPSHOTS]:
+        (SNAPSHOTS_DIR / generation).unlink()
+
+
+def publish_snapshot_ignore_errors() -> None:
+    """Failures are only logged, the readers just keep reading the previous snapshot."""
+    try:
+        publish_snapshot()
+    except Exception:
+        logger.exception("Failed to publish snapshot")
+
+
+def get_read_engine() -> sa.Engine:
+    """
+    The engine of the current snapshot, or of the database itself,
+    when no snapshot was published yet (e.g. when developing).
+    """
+    global _read_generation, _read_engine
+    try:
+        generation = os.readlink(CURRENT_LINK)
+    except FileNotFoundError:
+        return db_engine
+
+    with _lock:
+        if generation != _read_generation or _read_engine is None:
+            # The old engine isn't disposed, since the requests in other threads can
+            # still be using it. It's garbage collected (with its connections) once
+            # they are done.
+            _read_engine = create_snapshot_engine(SNAPSHOTS_DIR / generation)
+            _read_generation = generation
+        return _read_engine
+
+
+def create_snapshot_engine(path: Path) -> sa.Engine:
+    # Immutable, so SQLite doesn't lock the file or check whether it has changed.
+    # https://www.sqlite.org/uri.html#uriimmutable
+    return sa.create_engine(
+        url=f"sqlite+pysqlite:///file:{path.resolve()}?immutable=1&uri=true"
+    )
+
+
+if __name__ == "__main__":
+    main()
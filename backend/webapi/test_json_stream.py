@@ -0,0 +1,57 @@
+import json
+import typing as t
+
+import pytest
+
+from backend.webapi.json_stream import parse_object_stream
+
+
+def parse(body: str, chunk_size: int) -> tuple[dict[str, t.Any], list[t.Any]]:
+    body_bytes = body.encode("utf8")
+    chunks = (
+        body_bytes[i : i + chunk_size] for i in range(0, len(body_bytes), chunk_size)
+    )
+    items: list[t.Any] = []
+    return parse_object_stream(chunks, "builds", items.append), items
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_parse_object_stream(chunk_size: int) -> None:
+    builds = [{"kills": 12345, "god": "Ah Muzen Cab", "win": True}, 1.5e3, "žluťoučký"]
+    body = {"tooltip": 'A"b\\u00e1', "builds": builds, "x": [None, 100]}
+    rest, items = parse(json.dumps(body, ensure_ascii=False, indent=1), chunk_size)
+    assert items == builds
+    assert rest == {**body, "builds": 3}
+
+
+@pytest.mark.parametrize("body", ['{"builds": []}', ' { "builds" : [ ] } \n', "{}"])
+def test_parse_object_stream_empty(body: str) -> None:
+    rest, items = parse(body, 1)
+    assert items == []
+    assert rest == json.loads(body) | ({"builds": 0} if "builds" in body else {})
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        "",
+        "[]",
+        '{"builds": [1, 2}',
+        '{"builds": [1, 2]',
+        '{"builds": [1, 2]} {}',
+        '{"builds": {}}',
+        "{1: 2}",
+        '{"builds": [1 2]}',
+        '{"builds": [1, tru]}',
+        '{"builds": [1,]}',
+    ],
+)
+def test_parse_object_stream_invalid(body: str) -> None:
+    with pytest.raises(json.JSONDecodeError):
+        parse(body, 3)
+
+
+def test_parse_object_stream_invalid_utf8() -> None:
+    items: list[t.Any] = []
+    with pytest.raises(UnicodeDecodeError):
+        parse_object_stream(iter([b'{"builds": ["\xff"]}']), "builds", items.append)
@@ -0,0 +1,134 @@
+import datetime
+import gzip
+import itertools
+import json
+import os
+import typing as t
+import urllib.parse
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+
+from backend.webapi import prerender
+from backend.webapi.get_builds import get_builds
+from backend.webapi.models import Build, db_engine, db_session
+from backend.webapi.prerender import get_file_name, prerender_basic_searches
+from backend.webapi.simple_queries import update_last_modified
+from backend.webapi.tools.generate_db import generate_db
+from backend.webapi.webapi import GetBuildsRequest, encode_json
+
+# Expected values are from URLSearchParams in a browser.
+get_file_name_params = [
+    (1, [], "page=1&.json"),
+    (2, [("god1", "Agni")], "page=2&god1=Agni.json"),
+    (1, [("god1", "Chang'e"), ("role", "Mid")], "page=1&god1=Chang%27e&role=Mid.json"),
+    (
+        1,
+        [("god1", "Ah Puch"), ("god_class", "Mage")],
+        "page=1&god1=Ah+Puch&god_class=Mage.json",
+    ),
+]
+
+
+@pytest.mark.parametrize("page,params,result", get_file_name_params)
+def test_get_file_name(page: int, params: list[tuple[str, str]], result: str) -> None:
+    assert get_file_name(page, params) == result
+
+
+@pytest.fixture
+def small_db(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> t.Iterator[None]:
+    db_path = tmp_path / "backend.db"
+    generate_db(db_path, 0.005)
+    engine = sa.create_engine(f"sqlite+pysqlite:///{db_path}")
+    # A few builds, so that there are only a few basic searches.
+    with engine.begin() as conn:
+        conn.execute(sa.text("DELETE FROM build_item WHERE build_id > 3"))
+        conn.execute(sa.text("DELETE FROM build WHERE id > 3"))
+    db_session.remove()
+    db_session.configure(bind=engine)
+    monkeypatch.setattr(prerender, "PRERENDERED_DIR", tmp_path / "prerendered")
+    monkeypatch.setattr(prerender, "CURRENT_LINK", tmp_path / "prerendered" / "current")
+    yield
+    db_session.remove()
+    db_session.configure(bind=db_engine)
+    engine.dispose()
+
+
+def add_build_like(build_id: int) -> None:
+    """A build in a new match, which matches the same basic searches."""
+    columns = [column.name for column in Build.__table__.columns if column.name != "id"]
+    values = [
+        "match_id + 1000" if column == "match_id" else column for column in columns
+    ]
+    db_session.execute(
+        sa.text(
+            f"INSERT INTO build ({', '.join(columns)}) "
+            f"SELECT {', '.join(values)} FROM build WHERE id = :build_id"
+        ),
+        {"build_id": build_id},
+    )
+    db_session.execute(
+        sa.text(
+            "INSERT INTO build_item (build_id, item_id, [index]) "
+            "SELECT (SELECT MAX(id) FROM build), item_id, [index] "
+            "FROM build_item WHERE build_id = :build_id"
+        ),
+        {"build_id": build_id},
+    )
+    last_modified = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+    update_last_modified(last_modified)
+    db_session.commit()
+
+
+def check_pages(version_dir: Path) -> None:
+    """Every page is the same as what the web api would return."""
+    for path in (version_dir / "builds").glob("*.json"):
+        query = urllib.parse.parse_qs(path.name.removesuffix(".json"))
+        result = get_builds(GetBuildsRequest.parse_obj(query))
+        data = encode_json(result).encode("utf8")
+        assert path.read_bytes() == data, path.name
+        gz_path = path.with_name(f"{path.name}.gz")
+        assert gzip.decompress(gz_path.read_bytes()) == data
+
+
+def test_prerender_basic_searches(small_db: None) -> None:
+    prerendered_dir = prerender.PRERENDERED_DIR
+    prerender_basic_searches(page_count=1)
+    first_version = os.readlink(prerender.CURRENT_LINK)
+    first_dir = prerendered_dir / first_version
+    check_pages(first_dir)
+    # All the combinations, also of the values with no builds together.
+    page_count = len(list(prerender.get_basic_searches()))
+    assert len(list((first_dir / "builds").glob("*.json"))) == page_count
+    first_pages = {
+        path.name: path.read_bytes() for path in (first_dir / "builds").iterdir()
+    }
+
+    build = db_session.get_one(Build, 1)
+    add_build_like(1)
+    prerender_basic_searches(page_count=1)
+    second_version = os.readlink(prerender.CURRENT_LINK)
+    assert second_version != first_version
+    second_dir = prerendered_dir / second_version
+    check_pages(second_dir)
+    version_info = json.loads((second_dir / prerender.VERSION_INFO_FILE).read_text())
+    assert version_info["max_build_id"] == 4
+
+    changed_names = {
+        get_file_name(1, [(key, value) for key, value in params if value is not None])
+        for params in itertools.product(
+            [("god1", None), ("god1", build.god1)],
+            [("role", None), ("role", build.role)],
+            [("god_class", None), ("god_class", build.god_class)],
+        )
+    }
+    for path in (second_dir / "builds").glob("*.json"):
+        is_linked = (
+            path.stat().st_ino == (first_dir / "builds" / path.name).stat().st_ino
+        )
+        assert is_linked == (path.name not in changed_names), path.name
+    # The previous version is still the same, it can still be being served.
+    assert {
+        path.name: path.read_bytes() for path in (first_dir / "builds").iterdir()
+    } == first_pages
@@ -0,0 +1,75 @@
+import threading
+import time
+import typing as t
+
+import pytest
+
+from backend.webapi.single_flight import SingleFlight
+
+THREAD_COUNT = 5
+
+
+def run_concurrently(
+    single_flight: SingleFlight, key: str, func: t.Callable[[], t.Any]
+) -> list:
+    results: list = []
+
+    def target() -> None:
+        try:
+            results.append(single_flight.do(key, func))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=target) for _ in range(THREAD_COUNT)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def wait_for_other_threads(single_flight: SingleFlight) -> None:
+    deadline = time.monotonic() + 5
+    while single_flight.get_stats()["coalesced"] < THREAD_COUNT - 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_coalesces_concurrent_calls() -> None:
+    single_flight: SingleFlight[list[int]] = SingleFlight()
+    calls = []
+
+    def func() -> list[int]:
+        calls.append(1)
+        wait_for_other_threads(single_flight)
+        return [len(calls)]
+
+    results = run_concurrently(single_flight, "key", func)
+    assert len(calls) == 1
+    assert results == [[1]] * 5
+    # The result is shared, not copied.
+    assert all(result is results[0] for result in results)
+    assert single_flight.get_stats() == {"computed": 1, "coalesced": 4, "failed": 0}
+
+
+def test_shares_exceptions() -> None:
+    single_flight: SingleFlight[None] = SingleFlight()
+
+    def func() -> None:
+        wait_for_other_threads(single_flight)
+        raise RuntimeError("fail")
+
+    results = run_concurrently(single_flight, "key", func)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert single_flight.get_stats() == {"computed": 1, "coalesced": 4, "failed": 1}
+
+
+def test_does_not_cache() -> None:
+    single_flight: SingleFlight[int] = SingleFlight()
+    assert single_flight.do("key", lambda: 1) == 1
+    assert single_flight.do("key", lambda: 2) == 2
+    assert single_flight.do("other", lambda: 3) == 3
+    with pytest.raises(ZeroDivisionError):
+        single_flight.do("key", lambda: 1 // 0)
+    assert single_flight.do("key", lambda: 4) == 4
+    assert single_flight.get_stats() == {"computed": 5, "coalesced": 0, "failed": 1}
@@ -0,0 +1,86 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm as sao
+
+from backend.webapi import snapshots
+from backend.webapi.models import db_engine
+
+
+@pytest.fixture
+def db(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    snapshots_dir = tmp_path / "backend.snapshots"
+    monkeypatch.setattr(snapshots, "SNAPSHOTS_DIR", snapshots_dir)
+    monkeypatch.setattr(snapshots, "CURRENT_LINK", snapshots_dir / "current")
+    monkeypatch.setattr(snapshots, "_read_generation", None)
+    monkeypatch.setattr(snapshots, "_read_engine", None)
+    db_path = tmp_path / "backend.db"
+    set_value(db_path, 1)
+    return db_path
+
+
+def set_value(db_path: Path, value: int) -> None:
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS test (value INTEGER)")
+        conn.execute("DELETE FROM test")
+        conn.execute("INSERT INTO test VALUES (?)", [value])
+    conn.close()
+
+
+def read_value() -> int | None:
+    with snapshots.get_read_engine().connect() as conn:
+        return conn.scalar(sa.text("SELECT value FROM test"))
+
+
+def test_reads_database_without_snapshot(db: Path) -> None:
+    assert snapshots.get_read_engine() is db_engine
+
+
+def test_reads_current_snapshot(db: Path) -> None:
+    assert snapshots.publish_snapshot(db) == "000001.db"
+    set_value(db, 2)
+    assert read_value() == 1
+    engine = snapshots.get_read_engine()
+    assert snapshots.get_read_engine() is engine
+
+    # A request in another thread, which is still reading the old snapshot.
+    with sao.Session(engine) as session:
+        assert session.scalar(sa.text("SELECT value FROM test")) == 1
+        pool = engine.pool
+        assert snapshots.publish_snapshot(db) == "000002.db"
+        assert read_value() == 2
+        assert snapshots.get_read_engine() is not engine
+        session.commit()
+        assert session.scalar(sa.text("SELECT value FROM test")) == 1
+        # Not disposed, which would have closed the connections it has pooled.
+        assert engine.pool is pool
+
+
+def test_keeps_only_some_snapshots(db: Path) -> None:
+    for _ in range(snapshots.KEPT_SNAPSHOTS + 2):
+        snapshots.publish_snapshot(db)
+    generations = snapshots.get_generations()
+    assert generations == ["000003.db", "000004.db", "000005.db"]
+    assert sorted(path.name for path in snapshots.SNAPSHOTS_DIR.iterdir()) == [
+        *generations,
+        "current",
+    ]
+
+
+def test_rollback(db: Path) -> None:
+    snapshots.publish_snapshot(db)
+    set_value(db, 2)
+    snapshots.publish_snapshot(db)
+    assert read_value() == 2
+
+    assert snapshots.rollback_snapshot() == "000001.db"
+    assert read_value() == 1
+    # The rolled back snapshot is not reused.
+    assert snapshots.publish_snapshot(db) == "000002.db"
+    assert read_value() == 2
+
+    snapshots.rollback_snapshot()
+    with pytest.raises(RuntimeError):
+        snapshots.rollback_snapshot()
@@ -1,9 +1,31 @@
 import datetime
+import gzip
+import hashlib
+import hmac
+import io
+import json
 import logging
+import typing as t
+import wsgiref.util
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
 
 import pytest
+import sqlalchemy as sa
+import zstandard
 
-from backend.webapi.webapi import format_rfc, is_cached
+from backend.webapi import webapi
+from backend.webapi.post_builds import jobs
+from backend.webapi.post_builds.jobs import Job, JobBase, JobChunk, JobStatus
+from backend.webapi.tools.generate_db import generate_db
+from backend.webapi.webapi import (
+    GetBuildsRequest,
+    app,
+    format_rfc,
+    get_builds_key,
+    is_cached,
+)
 
 last_modified = datetime.datetime(2012, 12, 12, tzinfo=datetime.timezone.utc)
 
@@ -23,3 +45,265 @@ def test_is_cached(
     caplog.set_level(logging.INFO)
     assert is_cached(last_modified, arg) == result
     assert bool(caplog.records) == logs
+
+
+def test_get_builds_key() -> None:
+    def get_key(query: dict, last_modified_: datetime.datetime | None) -> str:
+        return get_builds_key(GetBuildsRequest.parse_obj(query), last_modified_)
+
+    query = {"page": ["1"], "god1": ["Zeus", "Agni"], "item": ["A", "B"]}
+    key = get_key(query, last_modified)
+    same_query = {"item": ["B", "A"], "god1": ["Agni", "Zeus"], "page": [1]}
+    assert get_key(same_query, last_modified) == key
+    assert get_key({**query, "page": ["2"]}, last_modified) != key
+    assert get_key({**query, "god1": ["Agni"]}, last_modified) != key
+    assert get_key(query, last_modified.replace(day=13)) != key
+    assert get_key(query, None) != key
+
+
+HMAC_KEY_HEX = "1234"
+
+
+@pytest.fixture
+def jobs_db(tmp_path: Path) -> t.Iterator[None]:
+    engine = sa.create_engine(f"sqlite+pysqlite:///{tmp_path / 'jobs.db'}")
+    JobBase.metadata.create_all(engine)
+    jobs.jobs_db_session.remove()
+    jobs.jobs_db_session.configure(bind=engine)
+    config = SimpleNamespace(hmac_key_hex=HMAC_KEY_HEX)
+    with patch.object(webapi, "get_webapi_config", lambda: config):
+        yield
+    jobs.jobs_db_session.remove()
+    jobs.jobs_db_session.configure(bind=jobs.jobs_db_engine)
+    engine.dispose()
+
+
+def sign(body: bytes) -> str:
+    key = bytearray.fromhex(HMAC_KEY_HEX)
+    return hmac.new(key, body, hashlib.sha256).hexdigest()
+
+
+def call_app(
+    method: str,
+    path: str,
+    query: str = "",
+    body: bytes = b"",
+    headers: dict[str, str] | None = None,
+) -> tuple[int, str]:
+    """Through the whole bottle app, returns the status code and the response."""
+    environ: dict[str, t.Any] = {}
+    wsgiref.util.setup_testing_defaults(environ)
+    environ.update(
+        {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+        }
+    )
+    for key, value in (headers or {}).items():
+        environ[f"HTTP_{key.upper().replace('-', '_')}"] = value
+    statuses = []
+
+    def start_response(status: str, *args: t.Any) -> None:
+        statuses.append(status)
+
+    response = b"".join(app(environ, start_response))
+    return int(statuses[0].split()[0]), response.decode("utf8")
+
+
+def post_builds(
+    body: bytes, digest: str | None = None, headers: dict[str, str] | None = None
+) -> tuple[int, str]:
+    headers = dict(headers or {})
+    if digest is not None:
+        headers["X-HMAC-DIGEST-HEX"] = digest
+    return call_app("POST", "/api/builds", body=body, headers=headers)
+
+
+def make_build(match_id: int, game_i: int = 1) -> dict:
+    return {
+        "season": None,
+        "league": "SPL",
+        "phase": "Phase 1",
+        "year": 2023,
+        "month": 5,
+        "day": 6,
+        "match_id": match_id,
+        "game_i": game_i,
+        "win": True,
+        "hours": 0,
+        "minutes": 30,
+        "seconds": 0,
+        "kda_ratio": 2.0,
+        "kills": 1,
+        "deaths": 1,
+        "assists": 1,
+        "role": "Mid",
+        "player1": "Player",
+        "god1": "Agni",
+        "team1": "Team A",
+        "player2": "Other",
+        "god2": "Zeus",
+        "team2": "Team B",
+        "relics": [],
+        "items": [],
+    }
+
+
+def make_body(builds: list[dict]) -> bytes:
+    return json.dumps({"builds": builds, "last_checked_tooltip": None}).encode("utf8")
+
+
+def get_job_statuses() -> list[JobStatus]:
+    with jobs.jobs_db_session.begin():
+        return list(jobs.jobs_db_session.scalars(sa.select(Job.status)).all())
+
+
+def get_chunk_count() -> int:
+    with jobs.jobs_db_session.begin():
+        return jobs.jobs_db_session.scalars(
+            sa.select(sa.func.count(JobChunk.job_id))
+        ).one()
+
+
+def test_post_builds(jobs_db: None) -> None:
+    body = make_body([make_build(1), make_build(2)])
+    status_code, response = post_builds(body, sign(body))
+    assert status_code == 202
+    assert json.loads(response) == {"job_id": 1}
+    assert get_job_statuses() == [JobStatus.QUEUED]
+
+
+def test_post_builds_errors(jobs_db: None) -> None:
+    body = make_body([make_build(1)])
+    assert post_builds(body)[0] == 400
+    assert post_builds(body, sign(b"other body"))[0] == 403
+
+    invalid_body = make_body([{**make_build(1), "win": "maybe"}])
+    status_code, response = post_builds(invalid_body, sign(invalid_body))
+    assert status_code == 400
+    assert "builds -> 0" in response
+    # Wrong HMAC takes precedence.
+    assert post_builds(invalid_body, sign(body))[0] == 403
+    assert post_builds(b"{", sign(b"{"))[0] == 400
+
+    # Nothing is left behind by the failed requests.
+    assert get_job_statuses() == []
+    assert get_chunk_count() == 0
+
+
+def test_post_builds_too_large(jobs_db: None) -> None:
+    invalid_body = make_body([{**make_build(1), "win": "maybe"}] + [make_build(2)] * 9)
+    # The body is still being read after it was found invalid.
+    with patch.object(webapi, "MAX_BODY_SIZE", len(invalid_body) - 10):
+        status_code, _ = post_builds(invalid_body, sign(invalid_body))
+        assert status_code == 413
+
+    body = make_body([make_build(match_id) for match_id in range(1, 8)])
+    with (
+        patch.object(jobs, "CHUNK_BUILD_COUNT", 2),
+        patch.object(jobs, "MAX_JOB_CHUNKS", 3),
+    ):
+        status_code, response = post_builds(body, sign(body))
+        assert status_code == 413
+        assert "Too many builds" in response
+
+    assert get_job_statuses() == []
+    assert get_chunk_count() == 0
+
+
+compressions = [
+    ("gzip", gzip.compress),
+    ("zstd", lambda data: zstandard.ZstdCompressor().compress(data)),
+]
+
+
+@pytest.mark.parametrize("encoding,compress", compressions)
+def test_post_builds_compressed(
+    jobs_db: None, encoding: str, compress: t.Callable[[bytes], bytes]
+) -> None:
+    body = make_body([make_build(1), make_build(2)])
+    headers = {"Content-Encoding": encoding}
+    # The HMAC is of the uncompressed body.
+    status_code, _ = post_builds(compress(body), sign(body), headers)
+    assert status_code == 202
+    assert get_job_statuses() == [JobStatus.QUEUED]
+
+    # Then the HMAC cannot match, which takes precedence over the invalid body.
+    assert post_builds(body, sign(body), headers)[0] == 403
+
+    # Small when compressed, but too large when decompressed.
+    big_body = make_body([make_build(1)] * 1000)
+    compressed_body = compress(big_body)
+    with patch.object(webapi, "MAX_BODY_SIZE", len(big_body) // 2):
+        assert len(compressed_body) < webapi.MAX_BODY_SIZE
+        status_code, _ = post_builds(compressed_body, sign(big_body), headers)
+        assert status_code == 413
+    assert get_job_statuses() == [JobStatus.QUEUED]
+
+
+def test_post_builds_unsupported_encoding(jobs_db: None) -> None:
+    body = make_body([make_build(1)])
+    headers = {"Content-Encoding": "br"}
+    status_code, response = post_builds(body, sign(body), headers)
+    assert status_code == 415
+    assert "br" in response
+    assert get_job_statuses() == []
+
+
+@pytest.fixture
+def builds_db(tmp_path: Path) -> t.Iterator[sa.Engine]:
+    db_path = tmp_path / "backend.db"
+    generate_db(db_path, 0.005)
+    engine = sa.create_engine(f"sqlite+pysqlite:///{db_path}")
+    with patch.object(webapi, "get_read_engine", lambda: engine):
+        yield engine
+    engine.dispose()
+
+
+def get_known_matches(query: str = "") -> dict:
+    status, response = call_app("GET", "/api/known_matches", query)
+    assert status == 200
+    return json.loads(response)
+
+
+def test_get_known_matches(builds_db: sa.Engine) -> None:
+    with builds_db.connect() as conn:
+        rows = conn.execute(sa.text("SELECT id, phase, match_id FROM build")).all()
+    max_build_id = max(build_id for build_id, _, _ in rows)
+    all_matches = get_known_matches()
+    assert all_matches["max_build_id"] == max_build_id
+    assert {
+        (phase, match_id)
+        for phase, match_ids in all_matches["matches"].items()
+        for match_id in match_ids
+    } == {(phase, match_id) for _, phase, match_id in rows}
+
+    # Only the matches of the builds after the given one.
+    after = max_build_id - 3
+    new_matches = get_known_matches(f"after_build_id={after}")
+    assert new_matches["max_build_id"] == max_build_id
+    assert {
+        (phase, match_id)
+        for phase, match_ids in new_matches["matches"].items()
+        for match_id in match_ids
+    } == {(phase, match_id) for build_id, phase, match_id in rows if build_id > after}
+    assert get_known_matches(f"after_build_id={max_build_id}")["matches"] == {}
+
+    # E.g. the database was recreated, so everything again.
+    recreated = get_known_matches(f"after_build_id={max_build_id + 1}")
+    assert recreated == all_matches
+    status, _ = call_app("GET", "/api/known_matches", "after_build_id=x")
+    assert status == 400
+
+
+@pytest.mark.parametrize("path", ["/api/builds", "/api/options"])
+def test_last_modified_read_once(builds_db: sa.Engine, path: str) -> None:
+    with patch.object(
+        webapi, "get_last_modified", wraps=webapi.get_last_modified
+    ) as get_last_modified:
+        status, _ = call_app("GET", path, "page=1")
+        assert status == 200
+        assert get_last_modified.call_count == 1
@@ -0,0 +1,328 @@
+"""
+HTTP load test of the webapi running under gunicorn against a fixture database
+(generated by generate_db, if it doesn't exist yet). Replays a reproducible mix of
+requests at the given concurrency and reports latency percentiles, throughput and
+response sizes as JSON, which can be compared against a stored baseline, e.g.:
+./run.sh bench --scale 10 -o storage/bench/now.json --baseline storage/bench/base.json
+"""
+import argparse
+import concurrent.futures as cf
+import contextlib
+import dataclasses as dc
+import json
+import os
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import typing as t
+import urllib.parse
+from pathlib import Path
+
+import requests
+
+from backend.shared import STORAGE_DIR
+from backend.webapi.tools.generate_db import generate_db
+
+BENCH_DIR = STORAGE_DIR / "bench"
+# Request kind -> weight.
+REQUEST_MIX = {
+    "options": 1,
+    "last_check": 1,
+    "builds_basic": 5,
+    "builds_deep_page": 1.5,
+    "builds_items": 1.5,
+}
+PAGE_SIZE = 10
+# Builds, whose items are used by the builds_items requests.
+ITEM_BUILDS_SAMPLE = 500
+SERVER_START_TIMEOUT = 30
+
+
+@dc.dataclass
+class Sample:
+    kind: str
+    latency: float
+    status: int
+    size: int
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=float, default=1, help="see generate_db")
+    parser.add_argument("--db", type=Path, help="fixture database")
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-n", "--requests", type=int, default=2000)
+    parser.add_argument("-w", "--workers", type=int, default=2, help="gunicorn")
+    parser.add_argument("-t", "--threads", type=int, default=4, help="gunicorn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path, help="save results here")
+    parser.add_argument("--baseline", type=Path, help="compare with these results")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="fail if a p95 latency is this much worse than the baseline",
+    )
+    args = parser.parse_args()
+
+    db_path = args.db or BENCH_DIR / f"backend-{args.scale:g}x.db"
+    if not db_path.exists():
+        print(f"Generating fixture database: {db_path}", file=sys.stderr)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        generate_db(db_path, args.scale, args.seed)
+
+    with run_gunicorn(db_path, args.workers, args.threads) as base_url:
+        rng = random.Random(args.seed)
+        plan = create_plan(rng, base_url, db_path, args.requests)
+        # Also warms up the workers (and the SQLite page cache).
+        run_plan(base_url, plan[: args.concurrency * 5], args.concurrency)
+        start = time.perf_counter()
+        samples = run_plan(base_url, plan, args.concurrency)
+        duration = time.perf_counter() - start
+        metrics = get_metrics(base_url, args.workers)
+
+    results = summarize(samples, duration)
+    results["metrics"] = metrics
+    results["config"] = {
+        "db": str(db_path),
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "workers": args.workers,
+        "threads": args.threads,
+        "seed": args.seed,
+    }
+    results_str = json.dumps(results, indent=2)
+    print(results_str)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(results_str, encoding="utf8")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf8"))
+        if not compare_with_baseline(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+@contextlib.contextmanager
+def run_gunicorn(db_path: Path, workers: int, threads: int) -> t.Iterator[str]:
+    port = get_free_port()
+    env = {
+        # The benchmark doesn't post anything, so the keys don't matter.
+        "HMAC_KEY_HEX": "00",
+        "SMITE_DEV_ID": "bench",
+        "SMITE_AUTH_KEY": "bench",
+        **os.environ,
+        "BACKEND_DB_PATH": str(db_path.resolve()),
+    }
+    cmd = [
+        *[sys.executable, "-m", "gunicorn"],
+        *["--bind", f"127.0.0.1:{port}"],
+        *["--workers", str(workers), "--threads", str(threads)],
+        *["--log-level", "warning", "backend.webapi.gunicorn:application"],
+    ]
+    process = subprocess.Popen(cmd, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_server(base_url, process)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_server(base_url: str, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Gunicorn exited with: {process.returncode}")
+        try:
+            requests.get(f"{base_url}/api/last_check", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("Gunicorn did not start in time")
+
+
+# --------------------------------------------------------------------------------------
+# REQUESTS
+# --------------------------------------------------------------------------------------
+
+Request = tuple[str, str]  # kind, path with query
+BuildItems = tuple[list[str], list[str]]  # items, relics
+
+
+def create_plan(
+    rng: random.Random, base_url: str, db_path: Path, count: int
+) -> list[Request]:
+    options = requests.get(f"{base_url}/api/options").json()
+    build_count = requests.get(f"{base_url}/api/builds?page=1").json()["count"]
+    last_page = max((build_count + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    builds_items = get_builds_items(rng, db_path)
+    kinds = rng.choices(list(REQUEST_MIX), weights=list(REQUEST_MIX.values()), k=count)
+    return [
+        create_request(rng, kind, options, last_page, builds_items) for kind in kinds
+    ]
+
+
+def get_builds_items(rng: random.Random, db_path: Path) -> list[BuildItems]:
+    """
+    The items of a sample of the builds in the database, so that the item filters
+    match some builds (two random items mostly match none).
+    """
+    uri = f"file:{db_path.resolve()}?mode=ro"
+    with contextlib.closing(sqlite3.connect(uri, uri=True)) as conn:
+        build_ids = [row[0] for row in conn.execute("SELECT id FROM build")]
+        sample = rng.sample(build_ids, min(ITEM_BUILDS_SAMPLE, len(build_ids)))
+        rows = conn.execute(
+            "SELECT build_item.build_id, item.name, item.is_relic FROM build_item "
+            "JOIN item ON item.id = build_item.item_id "
+            f"WHERE build_item.build_id IN ({', '.join('?' * len(sample))}) "
+            'ORDER BY build_item.build_id, item.is_relic, build_item."index"',
+            sample,
+        ).fetchall()
+    by_build: dict[int, BuildItems] = {}
+    for build_id, name, is_relic in rows:
+        items, relics = by_build.setdefault(build_id, ([], []))
+        (relics if is_relic else items).append(name)
+    return [
+        build_items for build_items in by_build.values() if len(build_items[0]) >= 2
+    ]
+
+
+def create_request(
+    rng: random.Random,
+    kind: str,
+    options: dict[str, list],
+    last_page: int,
+    builds_items: list[BuildItems],
+) -> Request:
+    if kind == "options":
+        return kind, "/api/options"
+    elif kind == "last_check":
+        return kind, "/api/last_check"
+
+    query: list[tuple[str, t.Any]]
+    if kind == "builds_basic":
+        # Like the basic search on the frontend: god, role and god class.
+        query = [("page", 1)]
+        for key in ["god1", "role", "god_class"]:
+            if rng.random() < 0.5:
+                query.append((key, rng.choice(options[key])))
+    elif kind == "builds_deep_page":
+        query = [("page", rng.randint(min(50, last_page), last_page))]
+    elif kind == "builds_items":
+        # Items (and a relic) of the same build, like when looking for similar builds.
+        items, relics = rng.choice(builds_items)
+        query = [("page", 1)]
+        query += [("item", item) for item in rng.sample(items, 2)]
+        if relics and rng.random() < 0.5:
+            query.append(("relic", rng.choice(relics)))
+    else:
+        raise RuntimeError(f"Unknown request kind: {kind}")
+    return kind, f"/api/builds?{urllib.parse.urlencode(query)}"
+
+
+def run_plan(base_url: str, plan: list[Request], concurrency: int) -> list[Sample]:
+    local = threading.local()
+
+    def send(request: Request) -> Sample:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        kind, path = request
+        start = time.perf_counter()
+        response = local.session.get(f"{base_url}{path}")
+        latency = time.perf_counter() - start
+        return Sample(kind, latency, response.status_code, len(response.content))
+
+    with cf.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, plan))
+
+
+# --------------------------------------------------------------------------------------
+# RESULTS
+# --------------------------------------------------------------------------------------
+
+
+def get_metrics(base_url: str, workers: int) -> dict[int, t.Any]:
+    """Metrics are per worker, so this tries to get them from all of them."""
+    metrics = {}
+    for _ in range(workers * 10):
+        # Without keep-alive, so that the requests are spread over the workers.
+        worker_metrics = requests.get(f"{base_url}/api/metrics").json()
+        metrics[worker_metrics.pop("pid")] = worker_metrics
+        if len(metrics) == workers:
+            break
+    return metrics
+
+
+def summarize(samples: list[Sample], duration: float) -> dict[str, t.Any]:
+    kinds = {"all": samples}
+    for kind in REQUEST_MIX:
+        kinds[kind] = [sample for sample in samples if sample.kind == kind]
+    return {
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(samples) / duration, 1),
+        "kinds": {
+            kind: summarize_kind(kind_samples)
+            for kind, kind_samples in kinds.items()
+            if kind_samples
+        },
+    }
+
+
+def summarize_kind(samples: list[Sample]) -> dict[str, t.Any]:
+    latencies_ms = [sample.latency * 1000 for sample in samples]
+    if len(latencies_ms) > 1:
+        percentiles = statistics.quantiles(latencies_ms, n=100, method="inclusive")
+    else:
+        percentiles = latencies_ms * 99
+    return {
+        "requests": len(samples),
+        "errors": sum(sample.status >= 400 for sample in samples),
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        "mean_size_b": round(statistics.mean(sample.size for sample in samples)),
+        "max_size_b": max(sample.size for sample in samples),
+    }
+
+
+def compare_with_baseline(
+    results: dict[str, t.Any], baseline: dict[str, t.Any], max_regression: float
+) -> bool:
+    """Prints the changes and returns whether there is no significant regression."""
+    ok = True
+    print("Compared with the baseline:", file=sys.stderr)
+    for kind, kind_results in results["kinds"].items():
+        kind_baseline = baseline["kinds"].get(kind)
+        if kind_baseline is None:
+            continue
+        changes = []
+        for key in ["p50_ms", "p95_ms", "p99_ms", "mean_size_b"]:
+            change = kind_results[key] / kind_baseline[key] - 1
+            changes.append(f"{key} {change:+.0%}")
+            if key == "p95_ms" and change > max_regression:
+                ok = False
+        print(f"{kind}: {', '.join(changes)}", file=sys.stderr)
+    throughput_change = results["throughput_rps"] / baseline["throughput_rps"] - 1
+    print(f"throughput_rps {throughput_change:+.0%}", file=sys.stderr)
+    if not ok:
+        print(
+            f"p95 latency regressed by more than {max_regression:.0%}", file=sys.stderr
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    main()
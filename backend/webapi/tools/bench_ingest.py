@@ -0,0 +1,329 @@
+"""
+Benchmark of posting builds (post_builds_inner) with per-stage timings.
+The Hi-Rez CDN and API are replaced by local stand-ins and every batch size gets
+a fresh database, so it can be run (and profiled) anywhere, e.g.:
+python -m backend.webapi.tools.bench_ingest -b 10,1000 --cdn-latency 0.05
+"""
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import typing as t
+import unittest.mock
+from pathlib import Path
+
+import PIL.Image
+import sqlalchemy as sa
+
+from backend.config import load_webapi_config
+from backend.webapi.models import Base, db_session
+from backend.webapi.post_builds import create_items, hirez_api, images, post_builds
+from backend.webapi.tools.synthetic import (
+    GOD_CLASSES,
+    ROLES,
+    Zipf,
+    get_image_name,
+    make_item_names,
+    make_names,
+)
+from backend.webapi.webapi import PostBuildRequest
+
+DEFAULT_BATCH_SIZES = "10,100,1000,10000,50000"
+# Stages in the order in which they run, values are the patched functions.
+STAGES = {
+    "skip_stored": (post_builds, "skip_stored_games"),
+    "god_info": (post_builds, "get_god_info"),
+    "keys": (post_builds, "create_item_keys"),
+    "image_fetch": (create_items, "get_image_data"),
+    "compression": (create_items, "get_compressed_image_ignore_errors"),
+    "images_total": (post_builds, "create_item_wips"),
+    "item_resolution": (post_builds, "get_or_create_items"),
+    "builds": (post_builds, "create_builds"),
+    "build_items": (post_builds, "create_build_items"),
+}
+# Not (fully) included in the other stages.
+OTHER_STAGES = ["commit", "total"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-b", "--batch-sizes", default=DEFAULT_BATCH_SIZES, help="build counts"
+    )
+    parser.add_argument("--cdn-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument(
+        "--no-download-delay",
+        action="store_true",
+        help="skip the sleeping between image downloads (to be nice to the CDN)",
+    )
+    parser.add_argument("--items", type=int, default=250, help="distinct items")
+    parser.add_argument("--relics", type=int, default=30, help="distinct relics")
+    parser.add_argument("--icon-size", type=int, default=256, help="pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="also save results here")
+    args = parser.parse_args()
+
+    # The stand-ins don't need real credentials.
+    for key in ["HMAC_KEY_HEX", "SMITE_DEV_ID", "SMITE_AUTH_KEY"]:
+        os.environ.setdefault(key, "00")
+    load_webapi_config()
+
+    batch_sizes = [int(batch_size) for batch_size in args.batch_sizes.split(",")]
+    rng = random.Random(args.seed)
+    data = SyntheticData(rng, args.items, args.relics)
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        tmp_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        cdn_url = stack.enter_context(run_fake_cdn(args.cdn_latency, args.icon_size))
+        stack.enter_context(patch_hirez(tmp_dir, data.gods, args.api_latency))
+        stack.enter_context(unittest.mock.patch.object(images, "IMG_URL", cdn_url))
+        if args.no_download_delay:
+            stack.enter_context(unittest.mock.patch.object(images, "delay"))
+
+        print_header()
+        for batch_size in batch_sizes:
+            builds = data.generate_builds(batch_size)
+            result = run_benchmark(tmp_dir / str(batch_size), builds)
+            print_result(result)
+            results.append(result)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf8")
+
+
+def run_benchmark(run_dir: Path, builds: list[PostBuildRequest]) -> dict[str, t.Any]:
+    run_dir.mkdir()
+    (archive_dir := run_dir / "item_icons_archive").mkdir()
+    engine = sa.create_engine(f"sqlite+pysqlite:///{run_dir / 'backend.db'}")
+    Base.metadata.create_all(engine)
+    db_session.remove()
+    db_session.configure(bind=engine)
+    # Cold start, as if the webapi was just started.
+    hirez_api._cached_god_info = None
+    hirez_api._last_refresh_attempt = None
+    hirez_api.GOD_INFO_PATH.unlink(missing_ok=True)
+
+    timings = dict.fromkeys([*STAGES, *OTHER_STAGES], 0.0)
+    with contextlib.ExitStack() as stack:
+        for stage, (module, func_name) in STAGES.items():
+            timed_func = timed(timings, stage, getattr(module, func_name))
+            stack.enter_context(
+                unittest.mock.patch.object(module, func_name, timed_func)
+            )
+        stack.enter_context(
+            unittest.mock.patch.object(images, "ITEM_ICONS_ARCHIVE_DIR", archive_dir)
+        )
+        # Download logs are printed.
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+
+        start = time.perf_counter()
+        with db_session.begin():
+            post_builds_result = post_builds.post_builds_inner(builds)
+            commit_start = time.perf_counter()
+        end = time.perf_counter()
+        timings["commit"] = end - commit_start
+        timings["total"] = end - start
+
+    db_session.remove()
+    engine.dispose()
+    return {
+        "builds": len(builds),
+        "new_builds": post_builds_result.new_builds,
+        "timings": timings,
+    }
+
+
+def timed(
+    timings: dict[str, float], stage: str, func: t.Callable[..., t.Any]
+) -> t.Callable[..., t.Any]:
+    @functools.wraps(func)
+    def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] += time.perf_counter() - start
+
+    return wrapper
+
+
+def print_header() -> None:
+    stages = [*STAGES, *OTHER_STAGES]
+    print(f"{'builds':>8}", *(f"{stage:>15}" for stage in stages))
+
+
+def print_result(result: dict[str, t.Any]) -> None:
+    timings = result["timings"].values()
+    print(f"{result['builds']:>8}", *(f"{timing:>14.3f}s" for timing in timings))
+
+
+# --------------------------------------------------------------------------------------
+# SYNTHETIC BUILDS
+# --------------------------------------------------------------------------------------
+
+
+class SyntheticData:
+    def __init__(self, rng: random.Random, item_count: int, relic_count: int) -> None:
+        self.rng = rng
+        self.gods = {god: rng.choice(GOD_CLASSES) for god in make_names(rng, 120)}
+        self.god_zipf = Zipf(rng, list(self.gods))
+        teams = make_names(rng, 40)
+        self.team_players = {
+            team: [f"{team}{name}" for name in make_names(rng, 5, syllables=2)]
+            for team in teams
+        }
+        self.team_zipf = Zipf(rng, teams)
+        self.item_zipf = Zipf(rng, make_item_names(rng, item_count))
+        self.relic_zipf = Zipf(rng, make_item_names(rng, relic_count))
+
+    def generate_builds(self, build_count: int) -> list[PostBuildRequest]:
+        """Whole games, so the build count is rounded down to a multiple of 10."""
+        builds = []
+        for match_i in range(max(build_count // 10, 1)):
+            builds.extend(
+                self.generate_game(match_id=match_i // 3 + 1, game_i=match_i % 3 + 1)
+            )
+        return builds
+
+    def generate_game(self, match_id: int, game_i: int) -> list[PostBuildRequest]:
+        team1 = self.team_zipf.choice()
+        while (team2 := self.team_zipf.choice()) == team1:
+            pass
+        gods = self.god_zipf.sample(10)
+        minutes, seconds = self.rng.randrange(20, 50), self.rng.randrange(60)
+        builds = []
+        for team_i, (team, opp_team) in enumerate([(team1, team2), (team2, team1)]):
+            for role_i, role in enumerate(ROLES):
+                opp_role_i = (1 - team_i) * 5 + role_i
+                build_dict = {
+                    "league": "SPL",
+                    "phase": "Bench",
+                    "year": 2023,
+                    "month": 1 + match_id % 12,
+                    "day": 1 + match_id % 28,
+                    "match_id": match_id,
+                    "game_i": game_i,
+                    "win": team_i == 0,
+                    "hours": 0,
+                    "minutes": minutes,
+                    "seconds": seconds,
+                    "kda_ratio": round(self.rng.uniform(0, 10), 1),
+                    "kills": self.rng.randrange(15),
+                    "deaths": self.rng.randrange(15),
+                    "assists": self.rng.randrange(25),
+                    "role": role,
+                    "player1": self.team_players[team][role_i],
+                    "god1": gods[team_i * 5 + role_i],
+                    "team1": team,
+                    "player2": self.team_players[opp_team][role_i],
+                    "god2": gods[opp_role_i],
+                    "team2": opp_team,
+                    "relics": self.generate_items(self.relic_zipf, 2),
+                    "items": self.generate_items(self.item_zipf, 6),
+                }
+                builds.append(PostBuildRequest.parse_obj(build_dict))
+        return builds
+
+    def generate_items(self, zipf: Zipf[str], count: int) -> list[tuple[str, str]]:
+        return [(name, get_image_name(name)) for name in zipf.sample(count)]
+
+
+# --------------------------------------------------------------------------------------
+# STAND-INS
+# --------------------------------------------------------------------------------------
+
+
+class FakeCdnServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, icon_size: int) -> None:
+        super().__init__(("127.0.0.1", 0), FakeCdnHandler)
+        self.latency = latency
+        self.icon_size = icon_size
+
+
+class FakeCdnHandler(http.server.BaseHTTPRequestHandler):
+    server: FakeCdnServer
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        image_name = self.path.rsplit("/", 1)[-1]
+        image_data = make_icon(image_name, self.server.icon_size)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(image_data)))
+        self.end_headers()
+        self.wfile.write(image_data)
+
+    def log_message(self, format: str, *args: t.Any) -> None:
+        pass
+
+
+@functools.cache
+def make_icon(image_name: str, size: int) -> bytes:
+    """Blocky noise, which differs per image name."""
+    rng = random.Random(image_name)
+    blocks = PIL.Image.frombytes("RGB", (8, 8), rng.randbytes(8 * 8 * 3))
+    image = blocks.resize((size, size), PIL.Image.Resampling.BILINEAR)
+    b = io.BytesIO()
+    image.save(b, "PNG")
+    return b.getvalue()
+
+
+@contextlib.contextmanager
+def run_fake_cdn(latency: float, icon_size: int) -> t.Iterator[str]:
+    server = FakeCdnServer(latency, icon_size)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        yield f"http://{host!s}:{port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class FakeHirezApi:
+    def __init__(self, gods: dict[str, str], latency: float) -> None:
+        self.gods = gods
+        self.latency = latency
+
+    def call_method_list(self, method: str, *args: str) -> hirez_api.Gods:
+        assert method == "getgods"
+        time.sleep(self.latency)
+        newest_god = list(self.gods)[-1]
+        return [
+            {
+                "Name": god,
+                "Roles": god_class,
+                "latestGod": "y" if god == newest_god else "n",
+            }
+            for god, god_class in self.gods.items()
+        ]
+
+
+@contextlib.contextmanager
+def patch_hirez(
+    tmp_dir: Path, gods: dict[str, str], latency: float
+) -> t.Iterator[None]:
+    api = FakeHirezApi(gods, latency)
+    with contextlib.ExitStack() as stack:
+        patch = unittest.mock.patch.object
+        stack.enter_context(patch(hirez_api, "get_api", lambda: api))
+        for path_name in ["GODS_PATH", "GOD_INFO_PATH"]:
+            path = tmp_dir / getattr(hirez_api, path_name).name
+            stack.enter_context(patch(hirez_api, path_name, path))
+        yield
+
+
+if __name__ == "__main__":
+    main()
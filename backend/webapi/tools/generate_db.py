@@ -0,0 +1,316 @@
+"""
+Generates a synthetic backend.db of a chosen size, for load testing the read path.
+Scale 1 is roughly the size of the real database (a few seasons of SPL and SCC),
+higher scales add more leagues (with their own teams and players, but still named
+SPL or SCC, because the league names have to be known by the webapi), e.g.:
+python -m backend.webapi.tools.generate_db 10 storage/bench/backend.db
+"""
+import argparse
+import base64
+import dataclasses as dc
+import datetime as dt
+import io
+import itertools
+import random
+import typing as t
+from pathlib import Path
+
+import PIL.Image
+import sqlalchemy as sa
+
+from backend.shared import SCC, SPL
+from backend.webapi.models import (
+    CURRENT_DB_VERSION,
+    Base,
+    Build,
+    BuildItem,
+    Image,
+    Item,
+    Metadata,
+    indices,
+)
+from backend.webapi.post_builds.image_hashes import dhash_image
+from backend.webapi.simple_queries import LAST_MODIFIED_KEY, VERSION_KEY
+from backend.webapi.tools.synthetic import (
+    GOD_CLASSES,
+    ROLES,
+    Zipf,
+    get_image_name,
+    make_item_names,
+    make_names,
+)
+from backend.webapi.webapi import what_time_is_it
+
+FIRST_YEAR = 2021
+SEASON_COUNT = 3
+# Two leagues times three seasons are roughly the size of the real database.
+GAMES_PER_LEAGUE_SEASON = 350
+TEAMS_PER_LEAGUE = 10
+PHASES = ["Phase 1", "Phase 2", "Phase 3", "Phase 4", "World Championship"]
+# Share of items, which get a new icon every season.
+NEW_ICON_RATIO = 0.1
+# Games generated (and inserted) at once.
+GAMES_PER_CHUNK = 5000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("scale", type=float, help="1 is roughly the real size")
+    parser.add_argument("db_path", type=Path)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-f", "--force", action="store_true", help="overwrite")
+    args = parser.parse_args()
+
+    if args.db_path.exists():
+        if not args.force:
+            parser.error(f"Database already exists: {args.db_path}")
+        args.db_path.unlink()
+    args.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    build_count = generate_db(args.db_path, args.scale, args.seed)
+    print(f"Database generated with builds: {build_count}")
+
+
+def generate_db(db_path: Path, scale: float, seed: int = 0) -> int:
+    """Returns the number of generated builds."""
+    rng = random.Random(seed)
+    league_count = max(round(2 * scale), 1)
+    game_count = round(2 * SEASON_COUNT * GAMES_PER_LEAGUE_SEASON * scale)
+    archive = SyntheticArchive(rng, league_count)
+
+    engine = sa.create_engine(f"sqlite+pysqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # Bulk inserts are a lot faster without the indices.
+        for ix in indices:
+            ix.drop(conn)
+
+        conn.execute(sa.insert(Image), archive.images)
+        conn.execute(sa.insert(Item), archive.items)
+        games = archive.generate_games(game_count)
+        while game_chunk := list(itertools.islice(games, GAMES_PER_CHUNK)):
+            builds = [build for game in game_chunk for build in game.builds]
+            build_items = [bi for game in game_chunk for bi in game.build_items]
+            conn.execute(sa.insert(Build), builds)
+            conn.execute(sa.insert(BuildItem), build_items)
+
+        # In the same order as in create_db (see reorder_indices).
+        for ix in indices:
+            ix.create(conn)
+
+        metadata = [
+            {"key": VERSION_KEY, "value": CURRENT_DB_VERSION.value},
+            {"key": LAST_MODIFIED_KEY, "value": what_time_is_it().isoformat()},
+        ]
+        conn.execute(sa.insert(Metadata), metadata)
+        build_count = conn.scalar(sa.select(sa.func.count()).select_from(Build))
+
+    engine.dispose()
+    assert build_count is not None
+    return build_count
+
+
+Row = dict[str, t.Any]
+
+
+@dc.dataclass
+class Game:
+    builds: list[Row]
+    build_items: list[Row]
+
+
+@dc.dataclass
+class League:
+    name: str
+    players: Zipf[str]
+    teams: list[str]
+
+
+class SyntheticArchive:
+    def __init__(self, rng: random.Random, league_count: int) -> None:
+        self.rng = rng
+        self.god_classes = {
+            god: rng.choice(GOD_CLASSES) for god in make_names(rng, 130)
+        }
+        self.gods = Zipf(rng, list(self.god_classes))
+        players = make_names(rng, league_count * TEAMS_PER_LEAGUE * 10, syllables=2)
+        teams = make_names(rng, league_count * TEAMS_PER_LEAGUE)
+        self.leagues = [
+            self.create_league(
+                [SPL.name, SCC.name][league_i % 2],
+                players[league_i * TEAMS_PER_LEAGUE * 10 :][: TEAMS_PER_LEAGUE * 10],
+                teams[league_i * TEAMS_PER_LEAGUE :][:TEAMS_PER_LEAGUE],
+            )
+            for league_i in range(league_count)
+        ]
+
+        self.images: list[Row] = []
+        self.items: list[Row] = []
+        self.item_names = Zipf(rng, make_item_names(rng, 250))
+        self.relic_names = Zipf(rng, make_item_names(rng, 30))
+        # Per season: (is_relic, name, name_was_modified) -> item ID.
+        self.season_items: list[dict[tuple[bool, str, int], int]] = []
+        for _ in range(SEASON_COUNT):
+            self.season_items.append(self.create_season_items())
+
+        self.build_id = itertools.count(1)
+        self.match_id = itertools.count(1)
+
+    def create_league(self, name: str, players: list[str], teams: list[str]) -> League:
+        # Players change teams, retire etc., so there are more of them than seats.
+        return League(name, Zipf(self.rng, players), teams)
+
+    def create_season_items(self) -> dict[tuple[bool, str, int], int]:
+        prev_items = self.season_items[-1] if self.season_items else {}
+        season_items = {}
+        for is_relic, names in [(True, self.relic_names), (False, self.item_names)]:
+            for name in names.values:
+                key = (is_relic, name, 0)
+                upgrade_key = (is_relic, name, 1)
+                if key in prev_items and self.rng.random() >= NEW_ICON_RATIO:
+                    season_items[key] = prev_items[key]
+                    if is_relic:
+                        season_items[upgrade_key] = prev_items[upgrade_key]
+                    continue
+
+                item_id = self.create_item(is_relic, name, 0, image_id=None)
+                season_items[key] = item_id
+                if is_relic:
+                    # Upgraded relics share the icon with the base relic.
+                    image_id = self.items[item_id - 1]["image_id"]
+                    season_items[upgrade_key] = self.create_item(*upgrade_key, image_id)
+        return season_items
+
+    def create_item(
+        self, is_relic: bool, name: str, name_was_modified: int, image_id: int | None
+    ) -> int:
+        if image_id is None:
+            image_id = len(self.images) + 1
+            image_data = make_icon(self.rng)
+            self.images.append(
+                {
+                    "id": image_id,
+                    "data": base64.b64encode(image_data),
+                    "dhash": dhash_image(image_data),
+                }
+            )
+        item_id = len(self.items) + 1
+        self.items.append(
+            {
+                "id": item_id,
+                "is_relic": is_relic,
+                "name": name,
+                "name_was_modified": name_was_modified,
+                "image_name": get_image_name(name),
+                "image_id": image_id,
+            }
+        )
+        return item_id
+
+    def generate_games(self, game_count: int) -> t.Iterator[Game]:
+        """Spread evenly over the seasons and leagues, best of 3 matches."""
+        league_seasons = list(itertools.product(range(SEASON_COUNT), self.leagues))
+        games_per_league_season = max(game_count // len(league_seasons), 1)
+        for season_i, league in league_seasons:
+            players = league.players.sample(len(league.teams) * 5)
+            rosters = {
+                team: players[team_i * 5 : (team_i + 1) * 5]
+                for team_i, team in enumerate(league.teams)
+            }
+            games_left = games_per_league_season
+            while games_left > 0:
+                progress = 1 - games_left / games_per_league_season
+                phase = PHASES[int(progress * len(PHASES))]
+                date = dt.date(FIRST_YEAR + season_i, 3, 1) + dt.timedelta(
+                    days=int(progress * 240)
+                )
+                match_id = next(self.match_id)
+                team1, team2 = self.rng.sample(league.teams, 2)
+                game_total = min(self.rng.choice([2, 3]), games_left)
+                for game_i in range(1, game_total + 1):
+                    yield self.generate_game(
+                        season_i,
+                        league,
+                        rosters,
+                        phase,
+                        date,
+                        match_id,
+                        game_i,
+                        team1,
+                        team2,
+                    )
+                games_left -= game_total
+
+    def generate_game(
+        self,
+        season_i: int,
+        league: League,
+        rosters: dict[str, list[str]],
+        phase: str,
+        date: dt.date,
+        match_id: int,
+        game_i: int,
+        team1: str,
+        team2: str,
+    ) -> Game:
+        season_items = self.season_items[season_i]
+        gods = self.gods.sample(10)
+        players = rosters[team1] + rosters[team2]
+        game_length = dt.time(0, self.rng.randrange(20, 50), self.rng.randrange(60))
+        team1_won = self.rng.random() < 0.5
+
+        game = Game([], [])
+        for team_i, (team, opp_team) in enumerate([(team1, team2), (team2, team1)]):
+            for role_i, role in enumerate(ROLES):
+                build_id = next(self.build_id)
+                build_i = team_i * 5 + role_i
+                opp_build_i = (1 - team_i) * 5 + role_i
+                game.builds.append(
+                    {
+                        "id": build_id,
+                        "season": FIRST_YEAR + season_i - 2013,
+                        "league": league.name,
+                        "phase": phase,
+                        "date": date,
+                        "match_id": match_id,
+                        "game_i": game_i,
+                        "win": team1_won == (team_i == 0),
+                        "game_length": game_length,
+                        "kda_ratio": round(self.rng.uniform(0, 10), 1),
+                        "kills": self.rng.randrange(15),
+                        "deaths": self.rng.randrange(15),
+                        "assists": self.rng.randrange(25),
+                        "role": role,
+                        "god_class": self.god_classes[gods[build_i]],
+                        "god1": gods[build_i],
+                        "player1": players[build_i],
+                        "team1": team,
+                        "god2": gods[opp_build_i],
+                        "player2": players[opp_build_i],
+                        "team2": opp_team,
+                    }
+                )
+                for index, relic_name in enumerate(self.relic_names.sample(2)):
+                    upgraded = int(self.rng.random() < 0.7)
+                    item_id = season_items[(True, relic_name, upgraded)]
+                    game.build_items.append(
+                        {"build_id": build_id, "item_id": item_id, "index": index}
+                    )
+                for index, item_name in enumerate(self.item_names.sample(6)):
+                    item_id = season_items[(False, item_name, 0)]
+                    game.build_items.append(
+                        {"build_id": build_id, "item_id": item_id, "index": index}
+                    )
+        return game
+
+
+def make_icon(rng: random.Random) -> bytes:
+    blocks = PIL.Image.frombytes("RGB", (4, 4), rng.randbytes(4 * 4 * 3))
+    image = blocks.resize((128, 128), PIL.Image.Resampling.BILINEAR)
+    b = io.BytesIO()
+    image.save(b, "JPEG")
+    return b.getvalue()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import base64
 import datetime
 import functools
 import json
@@ -8,6 +9,7 @@ import sqlalchemy as sa
 import sqlalchemy.orm as sao
 
 from backend.webapi.models import CURRENT_DB_VERSION, DbVersion, db_session
+from backend.webapi.post_builds.image_hashes import dhash_image
 from backend.webapi.simple_queries import (
     get_version,
     update_last_modified,
@@ -32,6 +34,8 @@ def migrate_db() -> None:
         add_god_class(version_index)
         add_image_table(version_index)
         cascade_del_build_items(version_index)
+        add_image_dhash(version_index)
+        add_build_phase_index(version_index)
 
         update_last_modified(what_time_is_it())
 
@@ -132,6 +136,28 @@ def add_image_table() -> None:
     save_into_tables(item=items, image=images_final)
 
 
+@migration(DbVersion.ADD_BUILD_PHASE_INDEX)
+def add_build_phase_index() -> None:
+    execute_migrations_script("07_add_build_phase_index.sql")
+
+
+@migration(DbVersion.ADD_IMAGE_DHASH)
+def add_image_dhash() -> None:
+    execute_migrations_script("06_add_image_dhash.sql")
+    image_table, *_ = get_tables("image")
+    for image in load_to_list(image_table):
+        try:
+            dhash = dhash_image(base64.b64decode(image["data"]))
+        except OSError:
+            print(f"Failed to hash image: {image['id']}")
+            continue
+        db_session.execute(
+            sa.update(image_table)
+            .where(image_table.c.id == image["id"])
+            .values(dhash=dhash)
+        )
+
+
 @migration(DbVersion.CASCADE_DEL_BUILD_ITEMS)
 def cascade_del_build_items() -> None:
     build_item_table, *_ = get_tables("build_item")
@@ -0,0 +1 @@
+ALTER TABLE image ADD COLUMN dhash BIGINT
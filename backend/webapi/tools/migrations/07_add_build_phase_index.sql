@@ -0,0 +1 @@
+CREATE INDEX ix_build_phase_match_id ON build (phase, match_id)
@@ -9,6 +9,7 @@ from backend.webapi.models import (
     db_session,
     reorder_indices,
 )
+from backend.webapi.post_builds.jobs import create_jobs_db
 from backend.webapi.simple_queries import update_last_modified, update_version
 from backend.webapi.webapi import what_time_is_it
 
@@ -17,6 +18,8 @@ def prepare_storage() -> None:
     create_dir(STORAGE_DIR)
     create_dir(ITEM_ICONS_ARCHIVE_DIR)
     create_db()
+    # Creates only the missing tables, so it's fine to run every time.
+    create_jobs_db()
 
 
 def create_dir(path: Path) -> None:
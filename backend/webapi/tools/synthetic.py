@@ -0,0 +1,60 @@
+"""Synthetic (but realistically shaped) data for the benchmark tools."""
+import bisect
+import itertools
+import random
+import typing as t
+
+ROLES = ["ADC", "Jungle", "Mid", "Solo", "Support"]
+GOD_CLASSES = ["Assassin", "Guardian", "Hunter", "Mage", "Warrior"]
+SYLLABLES = (
+    "ag ni ra thor ku zu mo ka li ne ar te mis cha ron hel ba ul sol fen ri yo tsu ga"
+).split()
+
+T = t.TypeVar("T")
+
+
+def make_names(rng: random.Random, count: int, syllables: int = 3) -> list[str]:
+    """Unique names without digits (digits make the gods/items look suspicious)."""
+    names: dict[str, None] = {}
+    for length in itertools.count(syllables):
+        for _ in range(count * 10):
+            name = "".join(rng.choice(SYLLABLES) for _ in range(length))
+            names[name.capitalize()] = None
+            if len(names) == count:
+                return list(names)
+    raise AssertionError("unreachable")
+
+
+def make_item_names(rng: random.Random, count: int) -> list[str]:
+    """Two-word names, like the real ones (e.g. 'Sturdy Stew')."""
+    words = make_names(rng, count * 2, syllables=2)
+    return [f"{words[i]} {words[i + count]}" for i in range(count)]
+
+
+def get_image_name(item_name: str) -> str:
+    # Same as the name fixing on the webapi side, so that it doesn't log anything.
+    slug = item_name.lower().replace(" ", "-").replace("'", "")
+    return f"{slug}.png"
+
+
+class Zipf(t.Generic[T]):
+    """Picks values with the probability of the n-th most common one being ~1/n."""
+
+    def __init__(self, rng: random.Random, values: t.Sequence[T]) -> None:
+        self.rng = rng
+        self.values = values
+        self.cum_weights = list(
+            itertools.accumulate(1 / n for n in range(1, len(values) + 1))
+        )
+
+    def choice(self) -> T:
+        # Same as rng.choices, but without the overhead of k and argument checks.
+        x = self.rng.random() * self.cum_weights[-1]
+        return self.values[bisect.bisect(self.cum_weights, x)]
+
+    def sample(self, k: int) -> list[T]:
+        """Distinct values (e.g. items in a single build)."""
+        result: dict[T, None] = {}
+        while len(result) < k:
+            result[self.choice()] = None
+        return list(result)
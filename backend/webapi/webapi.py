@@ -1,31 +1,39 @@
+import contextlib
 import datetime
 import email.utils
 import functools
+import gzip
 import hashlib
 import hmac
 import json
 import logging
+import os
 import typing as t
+import zlib
 
 import bottle
 import pydantic as pd
 import pydantic.types as pdt
+import zstandard
 
 from backend.config import get_webapi_config
 from backend.shared import setup_logging
-from backend.webapi.exceptions import MyValidationError
+from backend.webapi.exceptions import BodyTooLargeError, MyValidationError
 from backend.webapi.get_builds import WhereStrat, get_builds
 from backend.webapi.get_options import get_options
-from backend.webapi.models import STR_MAX_LEN, db_session
+from backend.webapi.json_stream import parse_object_stream
+from backend.webapi.models import STR_MAX_LEN, db_session, session_maker
 from backend.webapi.post_builds.auto_fixes_logger import setup_auto_fixes_logging
-from backend.webapi.post_builds.post_builds import post_builds
+from backend.webapi.post_builds.jobs import JobReceiver, get_job_dict, jobs_db_session
 from backend.webapi.simple_queries import (
+    get_known_matches,
     get_last_checked,
     get_last_modified,
     get_match_ids,
-    update_last_checked,
-    update_last_modified,
+    get_max_build_id,
 )
+from backend.webapi.single_flight import SingleFlight
+from backend.webapi.snapshots import get_read_engine
 
 # --------------------------------------------------------------------------------------
 # APP & LOGGING & HOOKS & DECORATORS
@@ -43,15 +51,17 @@ def setup_webapi_logging() -> None:
     setup_auto_fixes_logging()
 
 
-# @app.hook("before_request")
-# def before() -> None:
-# Currently not needed.
+@app.hook("before_request")
+def before() -> None:
+    # Reads go to the current snapshot, see snapshots.py.
+    db_session.registry.set(session_maker(bind=get_read_engine()))
 
 
 @app.hook("after_request")
 def after() -> None:
     # Also calls close, which also calls rollback.
     db_session.remove()
+    jobs_db_session.remove()
 
 
 @app.error(500)
@@ -76,25 +86,12 @@ def log_warnings(func: t.Callable) -> t.Callable:
     return wrapper
 
 
-def verify_integrity(func: t.Callable) -> t.Callable:
-    @functools.wraps(func)
-    def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
-        key = bytearray.fromhex(get_webapi_config().hmac_key_hex)
-
-        header_name = "X-HMAC-DIGEST-HEX"
-        if not (digest_header := bottle.request.get_header(header_name)):
-            bottle.response.status = 400
-            return f"HMAC digest was not included in the {header_name} header"
-
-        hmac_obj = hmac.new(key, bottle.request.body.read(), hashlib.sha256)
-        digest_body = hmac_obj.hexdigest()
-        if not hmac.compare_digest(digest_header, digest_body):
-            bottle.response.status = 403
-            return "Wrong HMAC digest"
+HMAC_HEADER_NAME = "X-HMAC-DIGEST-HEX"
 
-        return func(*args, **kwargs)
 
-    return wrapper
+def new_hmac() -> hmac.HMAC:
+    key = bytearray.fromhex(get_webapi_config().hmac_key_hex)
+    return hmac.new(key, digestmod=hashlib.sha256)
 
 
 def validate_request_body(model: type[pd.BaseModel]) -> t.Callable:
@@ -122,16 +119,18 @@ def validate_request_body(model: type[pd.BaseModel]) -> t.Callable:
 
 
 def cache_with_last_modified(func: t.Callable) -> t.Callable:
+    """Also passes last_modified to func, so that it's read only once per request."""
+
     @functools.wraps(func)
     def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
         last_modified = get_last_modified()
         if last_modified is None:
-            return func(*args, **kwargs)
+            return func(*args, last_modified=last_modified, **kwargs)
         if if_modified_since_s := bottle.request.get_header("If-Modified-Since"):
             if is_cached(last_modified, if_modified_since_s):
                 bottle.response.status = 304
                 return
-        result = func(*args, **kwargs)
+        result = func(*args, last_modified=last_modified, **kwargs)
         if bottle.response.status_code < 400:
             bottle.response.add_header("Last-Modified", format_rfc(last_modified))
             # This is also needed I think, since otherwise browsers try to guess
@@ -175,13 +174,17 @@ def jsonify(func: t.Callable) -> t.Callable:
     def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
         result = func(*args, **kwargs)
         if bottle.response.status_code < 400 and result is not None:
-            result = json.dumps(result, indent=2, cls=BytesEncoder)
+            result = encode_json(result)
             bottle.response.content_type = "application/json"
         return result
 
     return wrapper
 
 
+def encode_json(result: t.Any) -> str:
+    return json.dumps(result, indent=2, cls=BytesEncoder)
+
+
 class BytesEncoder(json.JSONEncoder):
     def default(self, obj: t.Any) -> t.Any:
         if isinstance(obj, bytes):
@@ -198,7 +201,7 @@ class BytesEncoder(json.JSONEncoder):
 @log_warnings
 @cache_with_last_modified
 @jsonify
-def get_options_endpoint() -> dict:
+def get_options_endpoint(last_modified: datetime.datetime | None) -> dict:
     return get_options()
 
 
@@ -247,11 +250,14 @@ class GetBuildsRequest(pd.BaseModel):
     item: list[MyStr] | None
 
 
+# Popular filters (e.g. linked by a streamer) can be requested many times at once.
+builds_single_flight: SingleFlight[str] = SingleFlight()
+
+
 @app.get("/api/builds")
 @log_warnings
 @cache_with_last_modified
-@jsonify
-def get_builds_endpoint() -> t.Any:
+def get_builds_endpoint(last_modified: datetime.datetime | None) -> t.Any:
     form_dict = bottle.request.query.decode()
     dict_with_lists = {key: form_dict.getall(key) for key in form_dict.keys()}
 
@@ -261,7 +267,35 @@ def get_builds_endpoint() -> t.Any:
         bottle.response.status = 400
         return str(e)
 
-    return get_builds(builds_query)
+    # Identical concurrent requests share the encoded JSON.
+    key = get_builds_key(builds_query, last_modified)
+    result = builds_single_flight.do(key, lambda: encode_json(get_builds(builds_query)))
+    bottle.response.content_type = "application/json"
+    return result
+
+
+def get_builds_key(
+    builds_query: GetBuildsRequest, last_modified: datetime.datetime | None
+) -> str:
+    """The order of the values of a filter doesn't change the result."""
+    normalized = {
+        key: sorted(vals) if isinstance(vals, list) else vals
+        for key, vals in builds_query.dict().items()
+        if vals is not None
+    }
+    normalized["last_modified"] = last_modified
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+@app.get("/api/metrics")
+@log_warnings
+@jsonify
+def get_metrics_endpoint() -> dict:
+    """Metrics of the current (gunicorn) worker process."""
+    return {
+        "pid": os.getpid(),
+        "builds_single_flight": builds_single_flight.get_stats(),
+    }
 
 
 # --------------------------------------------------------------------------------------
@@ -281,6 +315,31 @@ def post_phases_endpoint(phases: list[MyStr]) -> list[list[int]]:
     return [get_match_ids(phase) for phase in phases]
 
 
+@app.get("/api/known_matches")
+@log_warnings
+@jsonify
+def get_known_matches_endpoint() -> dict | str:
+    """
+    The updater keeps its own copy of the known matches, so it only needs the matches
+    of the builds after the last build of its copy (after_build_id is the max_build_id
+    it got). Builds are only ever added, so those are all the changes. When the
+    database has fewer builds than that (e.g. it was recreated), all of them.
+    """
+    max_build_id = get_max_build_id()
+    after_build_id_s = bottle.request.query.get("after_build_id")
+    try:
+        after_build_id = None if after_build_id_s is None else int(after_build_id_s)
+    except ValueError:
+        bottle.response.status = 400
+        return f"Invalid after_build_id: {after_build_id_s}"
+    if after_build_id is not None and (max_build_id or 0) < after_build_id:
+        after_build_id = None
+    return {
+        "max_build_id": max_build_id,
+        "matches": get_known_matches(after_build_id),
+    }
+
+
 MyItem = tuple[MyStr, MyStr]
 if t.TYPE_CHECKING:
     MyRelics = list[MyItem]
@@ -319,31 +378,140 @@ class PostBuildRequest(pd.BaseModel):
 
 
 class PostBuildsRequest(pd.BaseModel):
+    """The builds are received one by one, see receive_builds."""
+
     builds: list[PostBuildRequest]
-    last_checked_tooltip: str
+    # Only the last post of an updater run updates the last check.
+    last_checked_tooltip: str | None
+
+
+BODY_CHUNK_SIZE = 64 * 1024
+# After decompression.
+MAX_BODY_SIZE = 256 * 1024 * 1024
+# Content-Encoding -> function wrapping the body in a decompressing file object.
+BODY_ENCODINGS: dict[str, t.Callable[[t.Any], t.Any]] = {
+    "identity": lambda body: body,
+    "gzip": lambda body: gzip.GzipFile(fileobj=body, mode="rb"),
+    "zstd": lambda body: zstandard.ZstdDecompressor().stream_reader(body),
+}
 
 
 @app.post("/api/builds")
 @log_warnings
-@verify_integrity
-@validate_request_body(PostBuildsRequest)
-def post_builds_endpoint(request: PostBuildsRequest) -> str | None:
-    if not request.builds:
-        bottle.response.status = 204
-    else:
+@jsonify
+def post_builds_endpoint() -> dict | str:
+    """
+    The builds are only queued here and then posted by the ingest worker,
+    since downloading the item images etc. can take minutes.
+    The body can contain tens of thousands of builds, so it's processed as a stream:
+    the HMAC is computed while the builds are parsed, validated and written into the
+    job. The job is queued only if the HMAC is right.
+    """
+    if not (digest_header := bottle.request.get_header(HMAC_HEADER_NAME)):
+        bottle.response.status = 400
+        return f"HMAC digest was not included in the {HMAC_HEADER_NAME} header"
+    encoding = bottle.request.get_header("Content-Encoding", "identity").lower()
+    if encoding not in BODY_ENCODINGS:
+        bottle.response.status = 415
+        return f"Unsupported Content-Encoding: {encoding}"
+
+    hmac_obj = new_hmac()
+    body_chunks = read_body_chunks(encoding, hmac_obj)
+    job_receiver = JobReceiver()
+    try:
+        error = None
         try:
-            bottle.response.status = 201
-            post_builds(request.builds)
-        except MyValidationError as e:
-            bottle.response.status = 400
+            try:
+                last_checked_tooltip = receive_builds(body_chunks, job_receiver)
+            except (
+                UnicodeDecodeError,
+                json.JSONDecodeError,
+                pd.ValidationError,
+                MyValidationError,
+            ) as e:
+                error = str(e)
+                # Wrong HMAC takes precedence over invalid body, like before streaming.
+                with contextlib.suppress(MyValidationError):
+                    for _ in body_chunks:
+                        pass
+        except BodyTooLargeError as e:
+            # The HMAC cannot be checked without reading all of it.
+            bottle.response.status = 413
+            job_receiver.discard()
             return str(e)
 
-    now = what_time_is_it()
-    update_last_checked(format_last_checked(now), request.last_checked_tooltip)
-    if request.builds:
-        update_last_modified(now)
-    db_session.commit()
-    return None
+        if not hmac.compare_digest(digest_header, hmac_obj.hexdigest()):
+            bottle.response.status = 403
+            error = "Wrong HMAC digest"
+        elif error is not None:
+            bottle.response.status = 400
+        if error is not None:
+            job_receiver.discard()
+            return error
+    except BaseException:
+        job_receiver.discard()
+        raise
+
+    job_id = job_receiver.queue(last_checked_tooltip)
+    bottle.response.status = 202
+    bottle.response.add_header("Location", f"/api/jobs/{job_id}")
+    return {"job_id": job_id}
+
+
+def read_body_chunks(encoding: str, hmac_obj: hmac.HMAC) -> t.Iterator[bytes]:
+    """
+    The HMAC is computed over the decompressed body, i.e. the same UTF-8 JSON
+    no matter whether or how it's compressed. Decompressed in small steps,
+    so that a small, but very compressible body cannot use up all the memory.
+    """
+    # Bottle buffers big bodies in a temporary file, not in memory.
+    body = BODY_ENCODINGS[encoding](bottle.request.body)
+    size = 0
+    while True:
+        try:
+            chunk = body.read(BODY_CHUNK_SIZE)
+        except (OSError, EOFError, zlib.error, zstandard.ZstdError) as e:
+            raise MyValidationError(f"Invalid {encoding} body: {e}")
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise BodyTooLargeError(f"Body is bigger than {MAX_BODY_SIZE} bytes")
+        hmac_obj.update(chunk)
+        yield chunk
+
+
+def receive_builds(
+    body_chunks: t.Iterator[bytes], job_receiver: JobReceiver
+) -> str | None:
+    """Returns the last checked tooltip."""
+
+    def on_build(build_json: t.Any) -> None:
+        try:
+            build = PostBuildRequest.parse_obj(build_json)
+        except pd.ValidationError as e:
+            raise MyValidationError(f"builds -> {job_receiver.build_count}\n{e}")
+        job_receiver.add_build(build.dict())
+
+    body_json = parse_object_stream(body_chunks, "builds", on_build)
+    if "builds" not in body_json:
+        raise MyValidationError("builds\n  field required")
+    # Here, so that too many builds are also found out before the HMAC is checked.
+    job_receiver.write_pending_builds()
+    # The builds are already validated.
+    body = PostBuildsRequest.parse_obj({**body_json, "builds": []})
+    return body.last_checked_tooltip
+
+
+@app.get("/api/jobs/<job_id:int>")
+@log_warnings
+@jsonify
+def get_job_endpoint(job_id: int) -> dict | str:
+    job_dict = get_job_dict(job_id)
+    if job_dict is None:
+        bottle.response.status = 404
+        return f"Job not found: {job_id}"
+    return job_dict
 
 
 def what_time_is_it() -> datetime.datetime:
@@ -12,23 +12,56 @@ function start {
 }
 
 function start_docker {
-    exec gunicorn --bind 0.0.0.0:4000 backend.webapi.gunicorn:application
+    ingest_worker_forever &
+    # Threads, so that identical concurrent requests can be coalesced.
+    exec gunicorn --bind 0.0.0.0:4000 --threads 4 backend.webapi.gunicorn:application
 }
 
 function start_docker_full {
     python -m backend.webapi.tools.prepare_storage || return
     python -m backend.webapi.tools.migrate_db || return
+    # So that the web api never reads a snapshot from before the migration.
+    publish_snapshot || return
     start_docker
 }
 
+function publish_snapshot {
+    python -m backend.webapi.snapshots "$@"
+}
+
+function ingest_worker {
+    python -m backend.webapi.post_builds.ingest_worker
+}
+
+function ingest_worker_forever {
+    # Restarts the worker when it crashes, otherwise the posted builds wait forever.
+    while true; do
+        ingest_worker
+        echo "Ingest worker exited ($?), restarting in 5 s" >&2
+        sleep 5
+    done
+}
+
 function updater {
     python -m backend.updater.updater
 }
 
+function updater_daemon {
+    python -m backend.updater.daemon
+}
+
 function item_viewer {
     python -m backend.item_viewer.item_viewer "$@"
 }
 
+function bench {
+    python -m backend.webapi.tools.bench_http "$@"
+}
+
+function bench_ingest {
+    python -m backend.webapi.tools.bench_ingest "$@"
+}
+
 function lint {
     black . --check || return
     isort . --check-only || return